@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+Load test /add-glasses offline against the fake model backend.
+
+By default this starts the API itself (python src/api.py with MODEL_BACKEND=fake,
+the result cache off and throwaway output/database paths), serves synthetic input
+photos from a local HTTP server, and drives /add-glasses at each concurrency level.
+For every level it reports requests per second, p50/p95/p99 latency, status codes,
+and the server's memory and event loop lag (sampled from /health). No Replicate
+token or internet access is needed.
+
+    uv run python bench_api.py
+    uv run python bench_api.py --concurrency 1,8,32 --requests 200 --latency lognormal:2,0.5
+    uv run python bench_api.py --e6716-rate 0.1 --timeout-rate 0.02 --label flaky-upstream
+
+Every request uses a different image unless --same-image is given (which measures
+coalescing and the result cache instead of the model). Server settings that are not
+flags (MAX_CONCURRENT_GENERATIONS, NORMALIZE_INPUT, ...) are passed through from the
+environment; rate limiting is off unless RATE_LIMIT_ENABLED=true is set. Requests are
+spread over --clients API keys, since admission is fair-queued per client.
+
+To load test a server you started yourself, pass --api; it should run with
+MODEL_BACKEND=fake unless you mean to pay for real predictions.
+
+    uv run python bench_api.py --api http://localhost:8000 --concurrency 4
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def synthetic_portrait(width: int, height: int) -> bytes:
+    image = Image.effect_mandelbrot((width, height), (-2.0, -1.5, 1.0, 1.5), 100).convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def serve_images(image: bytes) -> ThreadingHTTPServer:
+    """Serve `image` at /<n>.jpg, with a COM segment carrying n so every path has distinct bytes."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            tag = self.path.encode()[:200]
+            body = image[:2] + b"\xff\xfe" + (len(tag) + 2).to_bytes(2, "big") + tag + image[2:]
+            self.send_response(200)
+            self.send_header("Content-Type", "image/jpeg")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(args, workdir: str) -> tuple:
+    port = free_port()
+    env = {
+        **os.environ,
+        "MODEL_BACKEND": "fake",
+        "FAKE_MODEL_LATENCY": args.latency,
+        "FAKE_MODEL_E6716_RATE": str(args.e6716_rate),
+        "FAKE_MODEL_TIMEOUT_RATE": str(args.timeout_rate),
+        "FAKE_MODEL_OUTPUT_SIZE": args.output_size,
+        "HOST": "127.0.0.1",
+        "PORT": str(port),
+        "RAILWAY_PUBLIC_DOMAIN": f"127.0.0.1:{port}",
+        "RESULT_CACHE_ENABLED": os.getenv("RESULT_CACHE_ENABLED", "false"),
+        "RATE_LIMIT_ENABLED": os.getenv("RATE_LIMIT_ENABLED", "false"),
+        "RESULT_CACHE_DB_PATH": os.path.join(workdir, "result_cache.db"),
+        "OUTPUT_DIR": os.path.join(workdir, "output"),
+        "VARIANT_CACHE_DIR": os.path.join(workdir, "output_variants"),
+        "OUTPUT_INDEX_DB_PATH": os.path.join(workdir, "output_index.db"),
+        "WORK_QUEUE_DB_PATH": os.path.join(workdir, "work_queue.db"),
+        "JOB_DB_PATH": os.path.join(workdir, "jobs.db"),
+        "RATE_LIMIT_DB_PATH": os.path.join(workdir, "rate_limit.db"),
+        "LOG_LEVEL": os.getenv("LOG_LEVEL", "WARNING"),
+    }
+    api = f"http://127.0.0.1:{port}"
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, "src", "api.py")], env=env, cwd=ROOT)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise Exception(f"API server exited with code {process.returncode}")
+        try:
+            # Warmed up, so the first measured requests don't pay for the cold start
+            if httpx.get(f"{api}/ready", timeout=1).status_code == 200:
+                return process, api
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise Exception("API server did not become ready within 60s")
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+async def sample_health(client: httpx.AsyncClient, api: str, samples: list, stop: asyncio.Event):
+    while not stop.is_set():
+        try:
+            process = (await client.get(f"{api}/health", timeout=5)).json().get("process")
+            if process:
+                samples.append(process)
+        except (httpx.HTTPError, ValueError):
+            pass
+        try:
+            await asyncio.wait_for(stop.wait(), 0.5)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run_level(api: str, image_base: str, concurrency: int, total: int, same_image: bool, offset: int, clients: int) -> dict:
+    latencies = []
+    statuses = Counter()
+    samples = []
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency + 1, max_keepalive_connections=concurrency + 1)
+
+    async with httpx.AsyncClient(limits=limits, timeout=600) as client:
+        async def one(i: int):
+            image_url = f"{image_base}/{'same' if same_image else offset + i}.jpg"
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    response = await client.post(
+                        f"{api}/add-glasses",
+                        json={"image_url": image_url},
+                        headers={"X-API-Key": f"bench-{i % clients}"}
+                    )
+                    ok = response.status_code == 200 and response.json().get("success")
+                    status = "ok" if ok else "failed" if response.status_code == 200 else str(response.status_code)
+                except httpx.HTTPError as e:
+                    status = type(e).__name__
+                elapsed = time.perf_counter() - start
+            statuses[status] += 1
+            if status == "ok":
+                latencies.append(elapsed)
+
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(sample_health(client, api, samples, stop))
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(total)))
+        duration = time.perf_counter() - start
+        stop.set()
+        await sampler
+
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "duration_s": duration,
+        "rps": total / duration,
+        "success_rps": statuses["ok"] / duration,
+        "statuses": dict(statuses),
+        "latency_s": {
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "mean": statistics.mean(latencies) if latencies else None,
+            "max": max(latencies) if latencies else None,
+        },
+        "server_rss_mb_max": max((s["rss_bytes"] for s in samples), default=0) / 1024 / 1024,
+        "event_loop_lag_ms_max": max((s["event_loop_lag"]["last_ms"] for s in samples), default=None),
+        "event_loop_lag_ms_mean": statistics.mean(s["event_loop_lag"]["last_ms"] for s in samples) if samples else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--api", help="Base URL of a running server (default: start one with the fake backend)")
+    parser.add_argument("--concurrency", default="1,4,16", help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=50, help="Requests per concurrency level")
+    parser.add_argument("--latency", default="lognormal:1,0.3", help="Fake model latency, e.g. fixed:8, uniform:5,12, lognormal:8,0.4")
+    parser.add_argument("--e6716-rate", type=float, default=0.0, help="Fraction of fake predictions failing with E6716")
+    parser.add_argument("--timeout-rate", type=float, default=0.0, help="Fraction of fake predictions timing out")
+    parser.add_argument("--output-size", default="1024x1024", help="Fake model output size, WIDTHxHEIGHT")
+    parser.add_argument("--input-size", default="1536x2048", help="Synthetic input photo size, WIDTHxHEIGHT")
+    parser.add_argument("--clients", type=int, default=16, help="Spread requests over this many API keys (fair queuing is per client)")
+    parser.add_argument("--same-image", action="store_true", help="Send the same image URL in every request")
+    parser.add_argument("--label", default="run", help="Name for this run in the results file")
+    parser.add_argument("--output", default="bench_api.json")
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.input_size.lower().split("x"))
+    images = serve_images(synthetic_portrait(width, height))
+    image_base = f"http://127.0.0.1:{images.server_address[1]}"
+
+    process = None
+    workdir = tempfile.mkdtemp(prefix="bench_api_")
+    try:
+        if args.api:
+            api = args.api.rstrip("/")
+        else:
+            print(f"🚀 Starting API with the fake model backend (latency {args.latency}) in {workdir}")
+            process, api = start_server(args, workdir)
+
+        levels = []
+        offset = 0
+        for concurrency in (int(c) for c in args.concurrency.split(",")):
+            print(f"🧪 concurrency={concurrency}: {args.requests} requests")
+            level = asyncio.run(run_level(api, image_base, concurrency, args.requests, args.same_image, offset, args.clients))
+            offset += args.requests
+            latency = level["latency_s"]
+            print(
+                f"  {level['rps']:.2f} req/s, p50={latency['p50'] or 0:.2f}s p95={latency['p95'] or 0:.2f}s "
+                f"p99={latency['p99'] or 0:.2f}s, rss={level['server_rss_mb_max']:.0f} MB, "
+                f"loop lag max={level['event_loop_lag_ms_max']} ms, statuses={level['statuses']}"
+            )
+            levels.append(level)
+    finally:
+        if process:
+            process.terminate()
+            process.wait(timeout=30)
+        images.shutdown()
+
+    results = {
+        "label": args.label,
+        "api": args.api or "spawned",
+        "fake_model": None if args.api else {
+            "latency": args.latency,
+            "e6716_rate": args.e6716_rate,
+            "timeout_rate": args.timeout_rate,
+            "output_size": args.output_size,
+        },
+        "input_size": args.input_size,
+        "same_image": args.same_image,
+        "clients": args.clients,
+        "levels": levels,
+    }
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"📁 Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Benchmark input normalization against pass-through.
+
+Stage benchmark (no server needed): measures how long normalization takes and how
+much it shrinks the payload sent to nano-banana, using a synthetic 12 MP phone
+photo or your own image.
+
+    uv run python bench_normalization.py
+    uv run python bench_normalization.py --image photo.jpg --max-edge 1024
+
+End-to-end benchmark: times /add-glasses against a running server. Run it twice,
+once with the server started with NORMALIZE_INPUT=false and once with
+NORMALIZE_INPUT=true (both with RESULT_CACHE_ENABLED=false so every call hits the
+model), and compare the saved JSON files.
+
+    uv run python bench_normalization.py --api http://localhost:8000 \\
+        --image-url https://example.com/portrait.jpg --runs 5 --label passthrough
+"""
+
+import argparse
+import io
+import json
+import os
+import statistics
+import sys
+import time
+
+import requests
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+
+from image_fetch import FetchedImage, read_dimensions, sniff_format  # noqa: E402
+from normalize import normalize_image, restore_size  # noqa: E402
+
+
+def synthetic_photo() -> bytes:
+    """A 4032x3024 (12 MP) JPEG with enough detail to compress like a real photo."""
+    image = Image.effect_mandelbrot((4032, 3024), (-2.0, -1.5, 1.0, 1.5), 100).convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=92)
+    return buffer.getvalue()
+
+
+def bench_stage(data: bytes, max_edge: int, output_format: str, quality: int, runs: int, bandwidth_mbps: float) -> dict:
+    image_format = sniff_format(data)
+    width, height = read_dimensions(data, image_format)
+    original = FetchedImage("local", data, image_format, width, height)
+
+    normalize_times = []
+    restore_times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        normalized, target_size = normalize_image(original, max_edge, output_format, quality)
+        normalize_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        restore_size(normalized.data, target_size, quality)
+        restore_times.append(time.perf_counter() - start)
+
+    bytes_per_second = bandwidth_mbps * 1_000_000 / 8
+    return {
+        "input": {"format": image_format, "width": width, "height": height, "bytes": len(data)},
+        "normalized": {
+            "format": normalized.format,
+            "width": normalized.width,
+            "height": normalized.height,
+            "bytes": len(normalized.data)
+        },
+        "normalize_ms_median": statistics.median(normalize_times) * 1000,
+        "restore_ms_median": statistics.median(restore_times) * 1000,
+        "payload_reduction": 1 - len(normalized.data) / len(data),
+        "bandwidth_mbps": bandwidth_mbps,
+        "upload_ms_passthrough": len(data) / bytes_per_second * 1000,
+        "upload_ms_normalized": len(normalized.data) / bytes_per_second * 1000,
+    }
+
+
+def bench_e2e(api: str, image_url: str, runs: int) -> dict:
+    latencies = []
+    failures = 0
+    for i in range(runs):
+        start = time.perf_counter()
+        response = requests.post(f"{api}/add-glasses", json={"image_url": image_url}, timeout=300)
+        elapsed = time.perf_counter() - start
+        ok = response.status_code == 200 and response.json().get("success")
+        print(f"  run {i + 1}/{runs}: {elapsed:.2f}s {'✅' if ok else '❌ ' + response.text[:200]}")
+        if ok:
+            latencies.append(elapsed)
+        else:
+            failures += 1
+    return {
+        "runs": runs,
+        "failures": failures,
+        "latency_s": {
+            "min": min(latencies) if latencies else None,
+            "median": statistics.median(latencies) if latencies else None,
+            "max": max(latencies) if latencies else None,
+        }
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--image", help="Local image for the stage benchmark (default: synthetic 12 MP photo)")
+    parser.add_argument("--max-edge", type=int, default=int(os.getenv("NORMALIZE_MAX_EDGE", "1024")))
+    parser.add_argument("--format", default=os.getenv("NORMALIZE_FORMAT", "jpeg"), choices=["jpeg", "webp"])
+    parser.add_argument("--quality", type=int, default=int(os.getenv("NORMALIZE_QUALITY", "90")))
+    parser.add_argument("--bandwidth-mbps", type=float, default=50.0, help="Uplink used to estimate upload time")
+    parser.add_argument("--api", help="Base URL of a running server for the end-to-end benchmark")
+    parser.add_argument("--image-url", help="Input image URL for the end-to-end benchmark")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--label", default="run", help="Name for this run in the results file")
+    parser.add_argument("--output", default="bench_normalization.json")
+    args = parser.parse_args()
+
+    if args.api:
+        if not args.image_url:
+            parser.error("--image-url is required with --api")
+        print(f"🚀 End-to-end: {args.runs} calls to {args.api}/add-glasses")
+        results = {"label": args.label, "mode": "e2e", **bench_e2e(args.api, args.image_url, args.runs)}
+    else:
+        if args.image:
+            with open(args.image, "rb") as f:
+                data = f.read()
+        else:
+            data = synthetic_photo()
+        print(f"🧪 Stage benchmark: max_edge={args.max_edge} format={args.format} quality={args.quality}")
+        results = {"label": args.label, "mode": "stage", **bench_stage(
+            data, args.max_edge, args.format, args.quality, args.runs, args.bandwidth_mbps
+        )}
+
+    print(json.dumps(results, indent=2))
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"📁 Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,522 @@
-from fastapi import FastAPI, HTTPException
+import time
+
+# Startup profile: measured from here, before the imports below
+PROCESS_STARTED = time.perf_counter()
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel, HttpUrl
+from starlette.datastructures import Headers, QueryParams
+from starlette.staticfiles import NotModifiedResponse
+from pydantic import BaseModel, Field, HttpUrl, ValidationError, model_validator
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+import asyncio
+import base64
+import binascii
+import io
+import logging
+import math
 import os
-import time
-import requests
-import uvicorn
-import replicate
+import tempfile
+import httpx
 from dotenv import load_dotenv
+from worker_pool import GenerationPool, PoolSaturatedError
+from jobs import Job, JobStore, create_job_store, JOB_QUEUED, JOB_RUNNING, JOB_SUCCEEDED, JOB_FAILED
+from work_queue import WorkItem, WorkQueue
+from result_cache import ResultCache, make_cache_key
+from clients import SharedClients
+from overlays import OverlayAsset, OverlayRegistry
+from templates import GlassesTemplate, TemplateRegistry
+from image_fetch import FetchedImage, ImageFetchError, fetch_image, inspect_image
+from normalize import normalize_image, restore_size_file
+from storage import OutputStorage, create_storage
+from single_flight import SingleFlight, normalize_url
+from resilience import CIRCUIT_CLOSED, CircuitOpenError, RetryPolicy, call_with_retry, is_retryable
+from retention import OutputRetention
+from predictions import PredictionTimeoutError, predict_seconds, resume_prediction, run_prediction
+from fake_replicate import FakeReplicateClient
+from model_backends import COMPOSITOR_MODEL, ModelBackend, ModelRouter
+from interprocess import ProcessLock, ProcessSlots, SlotTimeoutError
+from rate_limit import RateLimiter, client_id, client_weight, create_rate_limiter, parse_weights
+from fair_queue import ClientQueueFullError, FairQueue
+from variants import VARIANT_FORMATS, VariantCache, content_hash
+from uploads import SpooledUpload, UploadError, receive_body, receive_multipart
+import metrics
+from logs import RequestIdMiddleware, configure_logging
 
 # Load environment variables from .env file
 load_dotenv()
 
+# Structured logging: JSON lines (or "text") written by a background thread, so a
+# request never blocks on stdout. DEBUG output is rate limited per message.
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_DEBUG_RATE = float(os.getenv("LOG_DEBUG_RATE", "10"))
+configure_logging(LOG_LEVEL, LOG_FORMAT, LOG_DEBUG_RATE)
+logger = logging.getLogger(__name__)
+
+# Concurrency limits for the blocking nano-banana pipeline. Requests beyond
+# MAX_CONCURRENT_GENERATIONS running + GENERATION_QUEUE_DEPTH waiting get a 503.
+MAX_CONCURRENT_GENERATIONS = int(os.getenv("MAX_CONCURRENT_GENERATIONS", "4"))
+GENERATION_QUEUE_DEPTH = int(os.getenv("GENERATION_QUEUE_DEPTH", "16"))
+OVERLOAD_RETRY_AFTER = int(os.getenv("OVERLOAD_RETRY_AFTER", "5"))
+
+# Per-client admission in front of /add-glasses, /add-glasses/batch and /jobs. A client
+# is its API key (X-API-Key or bearer token), else its IP. Each gets a token bucket of
+# RATE_LIMIT_BURST requests refilled at RATE_LIMIT_PER_MINUTE (429 with Retry-After once
+# empty; the "sqlite" backend shares buckets between workers). Model runs then get
+# weighted fair shares of FAIR_QUEUE_CONCURRENCY slots, with at most FAIR_QUEUE_PER_CLIENT
+# of a client's requests waiting. RATE_LIMIT_CLIENT_WEIGHTS ("key:<id>=4,
+# origin:https://app.example.com=2") scales a client's rate and share; an origin's weight
+# applies to each IP sending that Origin, which still gets a bucket of its own.
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_PER_MINUTE = float(os.getenv("RATE_LIMIT_PER_MINUTE", "30"))
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "10"))
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_DB_PATH = os.getenv("RATE_LIMIT_DB_PATH", "rate_limit.db")
+CLIENT_WEIGHTS = parse_weights(os.getenv("RATE_LIMIT_CLIENT_WEIGHTS", ""))
+# Take the client IP from X-Forwarded-For; only behind a proxy that sets it (Railway does)
+TRUST_FORWARDED_FOR = os.getenv("TRUST_FORWARDED_FOR", "false").lower() == "true"
+FAIR_QUEUE_CONCURRENCY = int(os.getenv("FAIR_QUEUE_CONCURRENCY", str(MAX_CONCURRENT_GENERATIONS)))
+FAIR_QUEUE_DEPTH = int(os.getenv("FAIR_QUEUE_DEPTH", str(GENERATION_QUEUE_DEPTH)))
+FAIR_QUEUE_PER_CLIENT = int(os.getenv("FAIR_QUEUE_PER_CLIENT", str(max(1, GENERATION_QUEUE_DEPTH // 4))))
+
+# Production server mode: WORKERS processes share the port (uvicorn's process manager;
+# WEB_CONCURRENCY is honored too). Model calls of all workers together are capped at
+# UPSTREAM_MAX_CONCURRENCY through lock files in WORKER_LOCK_DIR, so adding workers
+# doesn't multiply upstream load. On shutdown a worker stops accepting connections and
+# waits up to SHUTDOWN_DRAIN_SECONDS for in-flight generations and jobs.
+WORKERS = int(os.getenv("WORKERS", os.getenv("WEB_CONCURRENCY", "1")))
+UPSTREAM_MAX_CONCURRENCY = int(os.getenv("UPSTREAM_MAX_CONCURRENCY", str(MAX_CONCURRENT_GENERATIONS)))
+WORKER_LOCK_DIR = os.getenv("WORKER_LOCK_DIR", os.path.join(tempfile.gettempdir(), f"glasses-api-{os.getenv('PORT', '8000')}"))
+SHUTDOWN_DRAIN_SECONDS = float(os.getenv("SHUTDOWN_DRAIN_SECONDS", "60"))
+
+# Asynchronous job API: "memory" keeps jobs in-process, "sqlite" keeps them across restarts
+JOB_STORE = os.getenv("JOB_STORE", "memory")
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", "jobs.db")
+JOB_TTL_SECONDS = int(os.getenv("JOB_TTL_SECONDS", "86400"))
+JOB_CALLBACK_TIMEOUT = int(os.getenv("JOB_CALLBACK_TIMEOUT", "10"))
+
+# Durable work queue: every model run is recorded in WORK_QUEUE_DB_PATH with its
+# Replicate prediction id, so the first worker after a restart resumes polling the
+# predictions that were still running instead of paying for them again, and re-runs
+# unfinished jobs (with JOB_STORE=sqlite). Predictions older than
+# WORK_QUEUE_RESUME_MAX_AGE aren't resumed: Replicate deletes API outputs after an hour.
+WORK_QUEUE_ENABLED = os.getenv("WORK_QUEUE_ENABLED", "true").lower() == "true"
+WORK_QUEUE_DB_PATH = os.getenv("WORK_QUEUE_DB_PATH", "work_queue.db")
+WORK_QUEUE_RESUME_MAX_AGE = int(os.getenv("WORK_QUEUE_RESUME_MAX_AGE", "3000"))
+
+# Content-addressed result cache: identical image bytes + overlay + prompt + model reuse the stored output
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "true").lower() == "true"
+RESULT_CACHE_DB_PATH = os.getenv("RESULT_CACHE_DB_PATH", "result_cache.db")
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "10000"))
+RESULT_CACHE_TTL_SECONDS = int(os.getenv("RESULT_CACHE_TTL_SECONDS", "604800"))
+
+# Batch endpoint: per-batch fan-out (capped at BATCH_MAX_CONCURRENCY) and maximum unique URLs per batch
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", str(MAX_CONCURRENT_GENERATIONS)))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", str(MAX_CONCURRENT_GENERATIONS)))
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "500"))
+
+# Shared keep-alive connection pools for image hosts and the Replicate API
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "30"))
+
+# Where generated images go: "local" writes to OUTPUT_DIR and serves it under /output,
+# "s3" uploads to an S3-compatible bucket and hands out direct or presigned URLs
+OUTPUT_STORAGE = os.getenv("OUTPUT_STORAGE", "local")
+OUTPUT_DIR = os.getenv("OUTPUT_DIR", "output")
+S3_BUCKET = os.getenv("S3_BUCKET")
+S3_PREFIX = os.getenv("S3_PREFIX", "output")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL")
+S3_REGION = os.getenv("S3_REGION")
+S3_PUBLIC_BASE_URL = os.getenv("S3_PUBLIC_BASE_URL")
+S3_PRESIGN_EXPIRY = int(os.getenv("S3_PRESIGN_EXPIRY", "3600"))
+
+# Retries of a failed prediction: jittered exponential backoff, capped by an attempt budget
+# and a per-request deadline that also cancels a prediction still running. After REPLICATE_BREAKER_THRESHOLD consecutive upstream
+# failures of a model it gets no new predictions for REPLICATE_BREAKER_RESET_SECONDS,
+# then a probe is let through.
+REPLICATE_MAX_ATTEMPTS = int(os.getenv("REPLICATE_MAX_ATTEMPTS", "3"))
+REPLICATE_BACKOFF_BASE = float(os.getenv("REPLICATE_BACKOFF_BASE", "1"))
+REPLICATE_BACKOFF_MAX = float(os.getenv("REPLICATE_BACKOFF_MAX", "10"))
+REPLICATE_DEADLINE_SECONDS = float(os.getenv("REPLICATE_DEADLINE_SECONDS", "180"))
+REPLICATE_BREAKER_THRESHOLD = int(os.getenv("REPLICATE_BREAKER_THRESHOLD", "5"))
+REPLICATE_BREAKER_RESET_SECONDS = float(os.getenv("REPLICATE_BREAKER_RESET_SECONDS", "30"))
+
+# Routing between models for requests that don't name one. "failover" uses the first of
+# MODEL_CANDIDATES while it is healthy and the best-ranked other one while it is degraded;
+# "latency" always uses the best-ranked healthy candidate (observed p95, error rate, cost).
+MODEL_ROUTING = os.getenv("MODEL_ROUTING", "failover")
+MODEL_CANDIDATES = os.getenv("MODEL_CANDIDATES", "nano-banana,image-mixer").split(",")
+MODEL_DEGRADED_ERROR_RATE = float(os.getenv("MODEL_DEGRADED_ERROR_RATE", "0.5"))
+MODEL_DEGRADED_P95_SECONDS = float(os.getenv("MODEL_DEGRADED_P95_SECONDS", "120"))
+MODEL_ROUTING_COST_WEIGHT = float(os.getenv("MODEL_ROUTING_COST_WEIGHT", "100"))
+MODEL_STATS_WINDOW = int(os.getenv("MODEL_STATS_WINDOW", "50"))
+MODEL_STATS_MAX_AGE = float(os.getenv("MODEL_STATS_MAX_AGE", "600"))
+
+# Retention for local storage: least recently used results are deleted once the output
+# directory exceeds these limits (0 disables a limit). Runs at startup and every interval.
+OUTPUT_RETENTION_ENABLED = os.getenv("OUTPUT_RETENTION_ENABLED", "true").lower() == "true"
+OUTPUT_INDEX_DB_PATH = os.getenv("OUTPUT_INDEX_DB_PATH", "output_index.db")
+OUTPUT_MAX_BYTES = int(os.getenv("OUTPUT_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+OUTPUT_MAX_FILES = int(os.getenv("OUTPUT_MAX_FILES", "20000"))
+OUTPUT_MAX_AGE_SECONDS = int(os.getenv("OUTPUT_MAX_AGE_SECONDS", "604800"))
+OUTPUT_RETENTION_INTERVAL = int(os.getenv("OUTPUT_RETENTION_INTERVAL", "300"))
+
+# Serving local results under /output: content-addressed files get a strong ETag and
+# immutable caching. ?w=<width>&fmt=<jpeg|webp|avif|png> returns a resized and/or
+# re-encoded variant (width rounded up to VARIANT_WIDTH_STEP, at most VARIANT_MAX_WIDTH),
+# generated once and kept in VARIANT_CACHE_DIR up to VARIANT_CACHE_MAX_BYTES (LRU).
+VARIANTS_ENABLED = os.getenv("VARIANTS_ENABLED", "true").lower() == "true"
+VARIANT_CACHE_DIR = os.getenv("VARIANT_CACHE_DIR", "output_variants")
+VARIANT_CACHE_MAX_BYTES = int(os.getenv("VARIANT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+VARIANT_MAX_WIDTH = int(os.getenv("VARIANT_MAX_WIDTH", "2048"))
+VARIANT_WIDTH_STEP = int(os.getenv("VARIANT_WIDTH_STEP", "32"))
+VARIANT_QUALITY = int(os.getenv("VARIANT_QUALITY", "80"))
+OUTPUT_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Model backend: "replicate" calls the real API, "fake" runs an offline stand-in for
+# nano-banana (no token, no cost) for load tests, benchmarks and local development
+MODEL_BACKEND = os.getenv("MODEL_BACKEND", "replicate")
+FAKE_MODEL_LATENCY = os.getenv("FAKE_MODEL_LATENCY", "lognormal:8,0.4")
+FAKE_MODEL_E6716_RATE = float(os.getenv("FAKE_MODEL_E6716_RATE", "0"))
+FAKE_MODEL_TIMEOUT_RATE = float(os.getenv("FAKE_MODEL_TIMEOUT_RATE", "0"))
+FAKE_MODEL_OUTPUT_SIZE = os.getenv("FAKE_MODEL_OUTPUT_SIZE", "1024x1024")
+FAKE_MODEL_SEED = os.getenv("FAKE_MODEL_SEED")
+
+# Local fast path: detect the eyes on the CPU and composite the overlay without a model
+# call. Used when the detection is at least COMPOSITOR_MIN_CONFIDENCE sure, otherwise
+# the request falls back to the model. Needs the compositor extra (OpenCV).
+COMPOSITOR_ENABLED = os.getenv("COMPOSITOR_ENABLED", "false").lower() == "true"
+COMPOSITOR_MIN_CONFIDENCE = float(os.getenv("COMPOSITOR_MIN_CONFIDENCE", "0.6"))
+COMPOSITOR_WORKERS = int(os.getenv("COMPOSITOR_WORKERS", "2"))
+# Part of the cache key of composited results
+COMPOSITOR_SIGNATURE = "compositor=v1"
+
+clients: SharedClients = None
+storage: OutputStorage = None
+generation_pool: GenerationPool = None
+job_store: JobStore = None
+work_queue: Optional[WorkQueue] = None
+# Predictions of a previous process being resumed, by flight key: requests for the same
+# work wait for them instead of starting another prediction
+resumed_flights: Dict[str, asyncio.Task] = {}
+result_cache: Optional[ResultCache] = None
+overlays: OverlayRegistry = None
+templates: TemplateRegistry = None
+retention: Optional[OutputRetention] = None
+compositor_pool: Optional[ProcessPoolExecutor] = None
+upstream_slots: ProcessSlots = None
+rate_limiter: Optional[RateLimiter] = None
+variants: Optional[VariantCache] = None
+variant_flights = SingleFlight()
+fair_queue: FairQueue = None
+# Held (shared) by every live worker; a worker that can take it exclusively is the only one
+worker_lock = ProcessLock(os.path.join(WORKER_LOCK_DIR, "workers.lock"))
+# Held by the one worker that enforces output retention
+retention_lock = ProcessLock(OUTPUT_INDEX_DB_PATH + ".lock")
+retry_policy = RetryPolicy(REPLICATE_MAX_ATTEMPTS, REPLICATE_BACKOFF_BASE, REPLICATE_BACKOFF_MAX, REPLICATE_DEADLINE_SECONDS)
+flights = SingleFlight()
+# Keep references to running job tasks so they are not garbage collected mid-flight
+job_tasks = set()
+resume_tasks = set()
+loop_lag = metrics.LoopLagMonitor()
+startup = metrics.StartupProfile(PROCESS_STARTED)
+# Set once warm_up() has run; GET /ready passes only then
+warmed_up = False
+# Set when Replicate rejects REPLICATE_API_TOKEN during warm-up
+token_rejected = False
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create shared resources on startup and release them on shutdown"""
+    global clients, storage, generation_pool, job_store, result_cache, overlays, retention, compositor_pool, upstream_slots
+    global rate_limiter, fair_queue, variants, templates, work_queue
+    began = time.perf_counter()
+    # From the end of the imports until uvicorn runs this (its own imports and setup)
+    startup.record("server", began - IMPORTED)
+    os.makedirs(WORKER_LOCK_DIR, exist_ok=True)
+    # The only worker alive (the first to start, or a lone restart) may clean up after the last run
+    first_worker = worker_lock.try_acquire()
+    storage = create_storage(
+        OUTPUT_STORAGE,
+        OUTPUT_DIR,
+        f"{PUBLIC_URL}/output",
+        bucket=S3_BUCKET,
+        key_prefix=S3_PREFIX,
+        endpoint_url=S3_ENDPOINT_URL,
+        region=S3_REGION,
+        public_base_url=S3_PUBLIC_BASE_URL,
+        presign_expiry=S3_PRESIGN_EXPIRY
+    )
+    storage.startup()
+    if first_worker:
+        # Sibling workers may be writing partial files of their own
+        storage.cleanup()
+    retention_task = None
+    # Remote buckets expire objects with their own lifecycle rules
+    if OUTPUT_RETENTION_ENABLED and OUTPUT_STORAGE == "local":
+        retention = OutputRetention(
+            OUTPUT_DIR, OUTPUT_INDEX_DB_PATH, OUTPUT_MAX_BYTES, OUTPUT_MAX_FILES, OUTPUT_MAX_AGE_SECONDS
+        )
+        retention_task = asyncio.create_task(run_retention())
+    if VARIANTS_ENABLED and OUTPUT_STORAGE == "local":
+        variants = VariantCache(
+            OUTPUT_DIR, VARIANT_CACHE_DIR, VARIANT_CACHE_MAX_BYTES, VARIANT_MAX_WIDTH, VARIANT_WIDTH_STEP, VARIANT_QUALITY
+        )
+    loop_lag_task = asyncio.create_task(loop_lag.run())
+    fake_model = None
+    if MODEL_BACKEND == "fake":
+        width, height = (int(v) for v in FAKE_MODEL_OUTPUT_SIZE.lower().split("x"))
+        fake_model = FakeReplicateClient(
+            latency=FAKE_MODEL_LATENCY,
+            e6716_rate=FAKE_MODEL_E6716_RATE,
+            timeout_rate=FAKE_MODEL_TIMEOUT_RATE,
+            output_size=(width, height),
+            seed=int(FAKE_MODEL_SEED) if FAKE_MODEL_SEED else None
+        )
+        logger.warning("Using the fake model backend: no predictions are sent to Replicate", extra={"latency": FAKE_MODEL_LATENCY})
+    clients = SharedClients(
+        REPLICATE_API_TOKEN,
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        connect_timeout=HTTP_CONNECT_TIMEOUT,
+        read_timeout=HTTP_READ_TIMEOUT,
+        replicate_client=fake_model
+    )
+    generation_pool = GenerationPool(MAX_CONCURRENT_GENERATIONS, GENERATION_QUEUE_DEPTH)
+    upstream_slots = ProcessSlots(os.path.join(WORKER_LOCK_DIR, "upstream"), UPSTREAM_MAX_CONCURRENCY)
+    fair_queue = FairQueue(FAIR_QUEUE_CONCURRENCY, FAIR_QUEUE_DEPTH, FAIR_QUEUE_PER_CLIENT)
+    if RATE_LIMIT_ENABLED:
+        rate_limiter = create_rate_limiter(
+            RATE_LIMIT_BACKEND, RATE_LIMIT_DB_PATH, RATE_LIMIT_PER_MINUTE / 60, RATE_LIMIT_BURST, CLIENT_WEIGHTS
+        )
+    if COMPOSITOR_ENABLED:
+        # OpenCV is slow to import, so only servers with the fast path on load it
+        from compositor import COMPOSITOR_AVAILABLE
+        if not COMPOSITOR_AVAILABLE:
+            raise Exception(
+                "COMPOSITOR_ENABLED=true needs OpenCV: install it with "
+                "pip install 'glasses-overlay[compositor]' (or opencv-python-headless and numpy)"
+            )
+        # Processes, not threads: detection and blending are CPU bound and hold the GIL
+        compositor_pool = ProcessPoolExecutor(max_workers=COMPOSITOR_WORKERS)
+    # Gauges are read at scrape time, so the hot path never updates them
+    metrics.GENERATIONS_RUNNING.set_function(lambda: generation_pool.stats()["in_flight"])
+    metrics.GENERATIONS_QUEUED.set_function(lambda: generation_pool.stats()["queued"])
+    metrics.JOBS_ACTIVE.set_function(lambda: len(job_tasks))
+    for name, breaker in router.breakers.items():
+        metrics.CIRCUIT_OPEN.labels(name).set_function(lambda breaker=breaker: breaker.state != CIRCUIT_CLOSED)
+    job_store = create_job_store(JOB_STORE, JOB_DB_PATH)
+    if WORKERS > 1 and JOB_STORE == "memory":
+        logger.warning("JOB_STORE=memory with %d workers: a job is only visible on the worker that created it; use JOB_STORE=sqlite", WORKERS)
+    if RESULT_CACHE_ENABLED:
+        result_cache = ResultCache(RESULT_CACHE_DB_PATH, storage.exists, RESULT_CACHE_MAX_ENTRIES, RESULT_CACHE_TTL_SECONDS)
+    # Read, validate and compile the templates once (an invalid file stops the startup)
+    overlays = OverlayRegistry(refresh_margin=OVERLAY_URL_REFRESH_MARGIN)
+    templates = await asyncio.to_thread(
+        TemplateRegistry, TEMPLATES_PATH, overlays, list(router.backends.values()), GLASSES_PATH
+    )
+    template_task = asyncio.create_task(run_template_reload()) if TEMPLATE_RELOAD_INTERVAL > 0 else None
+    if WORK_QUEUE_ENABLED:
+        work_queue = WorkQueue(WORK_QUEUE_DB_PATH, keep_finished=JOB_TTL_SECONDS)
+    # Pick up what a previous process left unfinished. Its predictions are resumed first so
+    # re-run jobs join them; without the work queue, jobs are failed explicitly. With
+    # sibling workers still running, unfinished work may be theirs, so leave it.
+    if first_worker:
+        if work_queue:
+            resume_unfinished_work()
+        for job in job_store.unfinished():
+            if work_queue:
+                restart_job(job)
+            else:
+                job_store.update(job.id, status=JOB_FAILED, error="Job was interrupted by a server restart. Please resubmit.")
+    await asyncio.to_thread(worker_lock.try_acquire, shared=True, wait=True)
+    startup.record("startup", time.perf_counter() - began)
+    # The server starts answering (GET /health) now; GET /ready waits for the warm-up
+    warm_up_task = asyncio.create_task(warm_up())
+    yield
+    warm_up_task.cancel()
+    metrics.READY.set(0)
+    # uvicorn has stopped accepting connections and waited for open requests (up to
+    # SHUTDOWN_DRAIN_SECONDS); background jobs get the same grace before being cancelled
+    if job_tasks:
+        logger.info("Draining %d job(s) before shutdown", len(job_tasks))
+        await asyncio.wait(list(job_tasks), timeout=SHUTDOWN_DRAIN_SECONDS)
+    for task in [*job_tasks, *resume_tasks]:
+        task.cancel()
+    if retention_task:
+        retention_task.cancel()
+    if template_task:
+        template_task.cancel()
+    loop_lag_task.cancel()
+    generation_pool.shutdown(wait=True)
+    if compositor_pool:
+        compositor_pool.shutdown(wait=True, cancel_futures=True)
+    job_store.close()
+    if work_queue:
+        work_queue.close()
+    if result_cache:
+        result_cache.close()
+    if retention:
+        retention.close()
+    if rate_limiter:
+        rate_limiter.close()
+    retention_lock.release()
+    worker_lock.release()
+    storage.close()
+    clients.close()
+
+async def warm_up():
+    """
+    Do in the background what the first requests would otherwise pay for, then mark
+    this worker ready: import replicate and open a connection to its API (which also
+    checks the token), upload the overlays of all templates, pin community models to
+    a version, and start the compositor processes. A step that fails is logged and
+    left to the request path, which still does all of it lazily.
+    """
+    global warmed_up, token_rejected
+    if REPLICATE_API_TOKEN or MODEL_BACKEND == "fake":
+        try:
+            with startup.phase("preconnect"):
+                await asyncio.to_thread(clients.preconnect)
+        except Exception as e:
+            if getattr(e, "status", None) in (401, 403):
+                token_rejected = True
+            logger.warning("Could not pre-connect to Replicate: %s", e)
+        with startup.phase("overlays"):
+            # Every prediction then reuses the hosted URL
+            for overlay in {template.overlay for template in templates.all().values()}:
+                try:
+                    await asyncio.to_thread(overlay.hosted_url, clients.replicate)
+                except Exception as e:
+                    logger.warning("Could not preload glasses overlay (will retry on first request): %s", e)
+        with startup.phase("models"):
+            for backend in router.backends.values():
+                try:
+                    await asyncio.to_thread(backend.model_ref, clients.replicate)
+                except Exception as e:
+                    logger.warning("Could not resolve the version of %s: %s", backend.name, e)
+    if compositor_pool:
+        from compositor import warm_up as warm_up_compositor
+
+        overlay_paths = tuple({template.overlay.path for template in templates.all().values()})
+        loop = asyncio.get_running_loop()
+        try:
+            with startup.phase("compositor"):
+                # One call per worker process, roughly: starts them and loads the cascades
+                await asyncio.gather(*(
+                    loop.run_in_executor(compositor_pool, warm_up_compositor, overlay_paths) for _ in range(COMPOSITOR_WORKERS)
+                ))
+        except Exception as e:
+            logger.warning("Could not warm up the compositor: %s", e)
+    warmed_up = True
+    startup.mark_ready()
+    logger.info("Warmed up", extra={"startup": startup.stats(), "problems": readiness_problems()})
+
+def configuration_problems() -> List[str]:
+    """Why this server can't generate anything even when warm; shown by /health and /ready"""
+    problems = []
+    if MODEL_BACKEND != "fake" and not REPLICATE_API_TOKEN:
+        problems.append("REPLICATE_API_TOKEN is not set")
+    elif token_rejected:
+        problems.append("REPLICATE_API_TOKEN was rejected by Replicate")
+    return problems
+
+def readiness_problems() -> List[str]:
+    """Why this worker shouldn't get traffic yet; empty once it should"""
+    problems = configuration_problems()
+    if not warmed_up:
+        problems.append("warming up")
+    return problems
+
+async def run_retention():
+    """
+    Enforce the output limits at startup and then every OUTPUT_RETENTION_INTERVAL seconds.
+    Only one worker enforces them; the others just write their recorded accesses to the
+    shared index. If the enforcing worker exits, the next run of another one takes over.
+    """
+    while True:
+        try:
+            # Directory scans and deletes run on a thread so requests are never blocked
+            if retention_lock.held or retention_lock.try_acquire():
+                await asyncio.to_thread(retention.enforce)
+            else:
+                await asyncio.to_thread(retention.flush)
+        except Exception:
+            logger.exception("Output retention run failed")
+        await asyncio.sleep(OUTPUT_RETENTION_INTERVAL)
+
+async def run_template_reload():
+    """Pick up changes to the templates file and its overlays every TEMPLATE_RELOAD_INTERVAL seconds"""
+    while True:
+        await asyncio.sleep(TEMPLATE_RELOAD_INTERVAL)
+        # Only stats files unless something changed; never raises
+        await asyncio.to_thread(templates.refresh)
+
+class OutputFiles(StaticFiles):
+    """
+    StaticFiles for results. A result's name contains its content hash, so that hash
+    is its strong ETag and it may be cached forever; ?w= and ?fmt= serve variants from
+    the variant cache. Range requests and conditional requests (If-None-Match,
+    If-Range) work for both. Served results count as recently used for retention.
+    """
+
+    def cached_file_response(self, full_path: str, stat_result: os.stat_result, scope, etag: Optional[str], media_type: Optional[str] = None):
+        headers = {"etag": f'"{etag}"', "cache-control": OUTPUT_CACHE_CONTROL} if etag else None
+        response = FileResponse(full_path, stat_result=stat_result, headers=headers, media_type=media_type)
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return NotModifiedResponse(response.headers)
+        return response
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        return self.cached_file_response(full_path, stat_result, scope, content_hash(os.path.basename(full_path)))
+
+    async def variant_response(self, path: str, query: QueryParams, scope) -> Response:
+        name = os.path.basename(path)
+        if name != path or name.startswith("."):
+            raise HTTPException(status_code=404, detail="Not Found")
+        try:
+            width, fmt = variants.parse(query.get("w"), query.get("fmt"))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        async def render():
+            with metrics.stage("variant"):
+                return await asyncio.to_thread(variants.get, name, width, fmt)
+
+        # Concurrent first views of one thumbnail share a single resize
+        variant_path, _ = await variant_flights.do((name, width, fmt), render)
+        if variant_path is None:
+            raise HTTPException(status_code=404, detail="Not Found")
+        return self.cached_file_response(
+            variant_path,
+            await asyncio.to_thread(os.stat, variant_path),
+            scope,
+            variants.etag(name, width, fmt),
+            VARIANT_FORMATS[fmt][2]
+        )
+
+    async def get_response(self, path: str, scope):
+        query = QueryParams(scope["query_string"])
+        if variants and ("w" in query or "fmt" in query):
+            response = await self.variant_response(path, query, scope)
+        else:
+            response = await super().get_response(path, scope)
+        if retention and response.status_code in (200, 206, 304):
+            retention.touch(os.path.basename(path))
+        return response
+
 # Initialize FastAPI app
-app = FastAPI(title="Glasses Overlay API", version="1.0.0")
+app = FastAPI(title="Glasses Overlay API", version="1.0.0", lifespan=lifespan)
 
 # Get allowed origins from environment or use * for development
 ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS", "*").split(",")
@@ -28,8 +530,16 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Mount the output directory as static files so we can serve the images
-app.mount("/output", StaticFiles(directory="output"), name="output")
+# Per-route latency histograms for /metrics
+app.add_middleware(metrics.RequestMetricsMiddleware)
+# Outermost: every record logged while handling a request carries its X-Request-ID
+app.add_middleware(RequestIdMiddleware)
+
+# Mount the output directory as static files so we can serve the images.
+# Remote storage backends serve results themselves, so nothing is mounted for them.
+if OUTPUT_STORAGE == "local":
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    app.mount("/output", OutputFiles(directory=OUTPUT_DIR), name="output")
 
 # Get configuration from environment variables with defaults
 REPLICATE_API_TOKEN = os.getenv("REPLICATE_API_TOKEN")
@@ -42,56 +552,89 @@ if not PUBLIC_URL.startswith("http"):
     PUBLIC_URL = f"https://{PUBLIC_URL}" if "railway" in PUBLIC_URL else f"http://{PUBLIC_URL}"
 
 class GlassesRequest(BaseModel):
-    image_url: HttpUrl
+    # Exactly one of: a public URL, or the image itself as base64 (or a data: URL)
+    image_url: Optional[HttpUrl] = None
+    image_base64: Optional[str] = None
+    # Run this model instead of letting the router choose (see GET / for the names)
+    model: Optional[str] = None
+    # Glasses template to use (see GET /templates); None uses the default one
+    template: Optional[str] = None
+
+    @model_validator(mode="after")
+    def one_image(self):
+        if (self.image_url is None) == (self.image_base64 is None):
+            raise ValueError("Provide exactly one of image_url and image_base64")
+        return self
 
 class GlassesResponse(BaseModel):
     success: bool
     message: str
     image_url: str = None
-    local_path: str = None
+    local_path: Optional[str] = None
+    cache: Optional[str] = None
+    model: Optional[str] = None
+    # "local" when composited on the CPU, "model" when generated by a Replicate model
+    path: Optional[str] = None
+    template: Optional[str] = None
 
-class GlassesRequest(BaseModel):
+class BatchRequest(BaseModel):
+    image_urls: List[HttpUrl] = Field(..., min_length=1)
+    concurrency: Optional[int] = Field(None, ge=1)
+    model: Optional[str] = None
+    template: Optional[str] = None
+
+class BatchItemResult(GlassesResponse):
+    source_url: str
+
+class JobRequest(BaseModel):
     image_url: HttpUrl
+    callback_url: Optional[HttpUrl] = None
+    model: Optional[str] = None
+    template: Optional[str] = None
 
-class GlassesResponse(BaseModel):
-    success: bool
-    message: str
-    image_url: str = None
-    local_path: str = None
+class JobResponse(BaseModel):
+    job: Job
+    status_url: str
+    events_url: str
 
-def add_glasses_to_image(image_url: str, output_dir: str = "output"):
-    """
-    Add glasses to a person in an image using Google's nano-banana model via Replicate API.
-    Uses the glasses.png file and applies it to the input image.
-    Returns the path to the generated image.
-    """
-    if not REPLICATE_API_TOKEN:
-        raise Exception("REPLICATE_API_TOKEN environment variable is required")
-    
-    # Initialize Replicate client with the token
-    client = replicate.Client(api_token=REPLICATE_API_TOKEN.strip())
-    
-    # Validate the image URL
-    try:
-        print(f"Validating image URL: {image_url}")
-        response = requests.head(image_url, timeout=10, allow_redirects=True)
-        if response.status_code not in [200, 301, 302]:
-            raise Exception(f"Image URL returned status {response.status_code}. Please provide a valid, accessible image URL.")
-        print(f"✓ Image URL is accessible")
-    except requests.exceptions.RequestException as e:
-        raise Exception(f"Cannot access image URL: {str(e)}. Please ensure the image URL is publicly accessible.")
-    
-    try:
-        print(f"Adding glasses with nano-banana model: {image_url}")
-        
-        # Use local glasses.png file
-        glasses_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "images", "glasses.png")
-        
-        if not os.path.exists(glasses_path):
-            raise Exception(f"Glasses file not found at: {glasses_path}")
-        
-        # Enhanced prompt for perfect glasses overlay with maximum eye visibility
-        prompt = """TASK: Overlay the provided glasses on every detected face in the image.
+# Model reference sent to Replicate; pin a version with "google/nano-banana:<version>"
+NANO_BANANA_MODEL = os.getenv("NANO_BANANA_MODEL", "google/nano-banana")
+# Blends the overlay into the photo without a prompt (/add-glasses-flux, failover).
+# A community model: without a pinned ":<version>" the latest one is looked up once.
+IMAGE_MIXER_MODEL = os.getenv("IMAGE_MIXER_MODEL", "lambdal/image-mixer")
+
+# Local glasses overlay passed to the model as the second image (by the built-in template)
+GLASSES_PATH = os.getenv(
+    "GLASSES_OVERLAY_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "images", "glasses.png")
+)
+# Glasses templates (overlay, prompt, model, output format) that requests pick by name;
+# the file is checked for changes every TEMPLATE_RELOAD_INTERVAL seconds (0 disables)
+TEMPLATES_PATH = os.getenv(
+    "TEMPLATES_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "templates.json")
+)
+TEMPLATE_RELOAD_INTERVAL = float(os.getenv("TEMPLATE_RELOAD_INTERVAL", "5"))
+# Input image limits, enforced while streaming the single GET to the origin (or the upload)
+INPUT_MAX_BYTES = int(os.getenv("INPUT_MAX_BYTES", str(20 * 1024 * 1024)))
+INPUT_MAX_PIXELS = int(os.getenv("INPUT_MAX_PIXELS", "50000000"))
+INPUT_FETCH_TIMEOUT = float(os.getenv("INPUT_FETCH_TIMEOUT", "10"))
+
+# Input normalization before the model call: honor EXIF orientation, downscale to
+# NORMALIZE_MAX_EDGE, re-encode without metadata; the output is resized back afterwards
+NORMALIZE_INPUT = os.getenv("NORMALIZE_INPUT", "true").lower() == "true"
+NORMALIZE_MAX_EDGE = int(os.getenv("NORMALIZE_MAX_EDGE", "1024"))
+NORMALIZE_FORMAT = os.getenv("NORMALIZE_FORMAT", "jpeg")
+NORMALIZE_QUALITY = int(os.getenv("NORMALIZE_QUALITY", "90"))
+OUTPUT_JPEG_QUALITY = int(os.getenv("OUTPUT_JPEG_QUALITY", "92"))
+# Part of the cache key, since normalization settings change what the model sees
+NORMALIZE_SIGNATURE = f"normalize={NORMALIZE_MAX_EDGE}/{NORMALIZE_FORMAT}/{NORMALIZE_QUALITY}" if NORMALIZE_INPUT else "normalize=off"
+
+# Re-upload the overlay this many seconds before its Replicate file URL expires
+OVERLAY_URL_REFRESH_MARGIN = int(os.getenv("OVERLAY_URL_REFRESH_MARGIN", "3600"))
+
+# Enhanced prompt for perfect glasses overlay with maximum eye visibility
+NANO_BANANA_PROMPT = """TASK: Overlay the provided glasses on every detected face in the image.
 
 RULES:
 MAKE SURE TO OVERLAY THE GLASSES AKA, IN TOP OF THE NOISE ETC DON4T MAKE NOISE IN TOP OF GLASSES 
@@ -112,77 +655,518 @@ FINAL NOTE:
 The result must be the original image with glasses correctly sized, aligned, and placed on each face.  
 If eyes exist, keep them visible.  
 If eyes don't exist, just place glasses naturally, never draw eyes."""
+
+# Every model that can add glasses, with its input mapping; ORDER MATTERS: [base_image, overlay_image]
+router = ModelRouter(
+    [
+        ModelBackend(
+            "nano-banana",
+            NANO_BANANA_MODEL,
+            images="image_input",
+            prompt=NANO_BANANA_PROMPT,
+            params={"output_format": "jpg"},
+            output_prefix="nano_banana_glasses",
+            cost_per_run=0.039,
+            expected_latency=10,
+            description="Google's nano-banana model for precise glasses overlay"
+        ),
+        ModelBackend(
+            "image-mixer",
+            IMAGE_MIXER_MODEL,
+            images=("image1", "image2"),
+            params={"image1_strength": 1, "image2_strength": 1, "cfg_scale": 3, "num_steps": 30, "num_samples": 1},
+            output_format="png",
+            official=False,
+            cost_per_run=0.02,
+            expected_latency=15,
+            description="lambdal/image-mixer: blends the glasses into the photo (no prompt)"
+        ),
+    ],
+    MODEL_CANDIDATES,
+    policy=MODEL_ROUTING,
+    breaker_threshold=REPLICATE_BREAKER_THRESHOLD,
+    breaker_reset=REPLICATE_BREAKER_RESET_SECONDS,
+    window=MODEL_STATS_WINDOW,
+    max_age=MODEL_STATS_MAX_AGE,
+    degraded_error_rate=MODEL_DEGRADED_ERROR_RATE,
+    degraded_p95=MODEL_DEGRADED_P95_SECONDS,
+    cost_weight=MODEL_ROUTING_COST_WEIGHT
+)
+
+def add_glasses_to_image(
+    image_url: str,
+    output_storage: OutputStorage = None,
+    template: GlassesTemplate = None,
+    image: FetchedImage = None,
+    uploads: dict = None,
+    backend: ModelBackend = None,
+    on_submitted: Optional[Callable[[str, Optional[Tuple[int, int]], str], None]] = None,
+    deadline: Optional[float] = None
+):
+    """
+    Add glasses to a person in an image using a Replicate model (Google's nano-banana
+    unless another `backend` is given). Puts the glasses overlay of `template` (the
+    default template unless given) on the input image, with the template's prompt.
+    Pass an already fetched `image` to avoid downloading image_url again.
+    The result is written to output_storage (the configured storage by default).
+    Returns the file name of the generated image.
+
+    This is a single attempt; run_glasses_pipeline retries it. Pass the same `uploads`
+    dict to every attempt so the input is uploaded to Replicate only once.
+    on_submitted is called with the prediction id, the size to restore and the output
+    format as soon as Replicate has created the prediction, before it finishes.
+    deadline (time.monotonic(); REPLICATE_DEADLINE_SECONDS from now by default) bounds
+    the wait for an upstream slot and the prediction, which is canceled when it passes.
+    """
+    if not REPLICATE_API_TOKEN and MODEL_BACKEND != "fake":
+        raise Exception("REPLICATE_API_TOKEN environment variable is required")
+    if deadline is None:
+        deadline = time.monotonic() + REPLICATE_DEADLINE_SECONDS
+    
+    # Shared Replicate client: connections to the API are reused across requests
+    client = clients.replicate
+    output_storage = output_storage or storage
+    backend = backend or router.get(router.candidates[0])
+    template = template or templates.get()
+    compiled = template.inputs[backend.name]
+    
+    # Fetch and validate the image with one streaming GET, unless the caller already did
+    if image is None:
+        logger.debug("Fetching image URL: %s", image_url)
+        image = load_input_image(image_url)
+    logger.info(
+        "Image fetched",
+        extra={"image_format": image.format, "width": image.width, "height": image.height, "bytes": len(image.data)}
+    )
+    
+    # Shrink the payload the model has to receive; remember the size to restore afterwards
+    target_size = None
+    if NORMALIZE_INPUT:
+        try:
+            with metrics.stage("normalize"):
+                image, target_size = normalize_image(image, NORMALIZE_MAX_EDGE, NORMALIZE_FORMAT, NORMALIZE_QUALITY)
+        except Exception as e:
+            raise Exception(f"Could not decode the input image: {str(e)}")
+        logger.info(
+            "Image normalized",
+            extra={"image_format": image.format, "width": image.width, "height": image.height, "bytes": len(image.data)}
+        )
+    
+    try:
+        logger.info("Adding glasses with %s", backend.name, extra={"model": backend.model, "template": template.name})
         
-        print(f"DEBUG: Base image (person): {image_url}")
-        print(f"DEBUG: Overlay image (glasses): {glasses_path}")
+        # The template's overlay (loaded once, cached in memory)
+        overlay = template.overlay
+        glasses_path = overlay.path
         
-        # Retry logic for Replicate API
-        max_retries = 2
-        retry_count = 0
-        last_error = None
+        logger.debug("Base image (person): %s", image_url)
+        logger.debug("Overlay image (glasses): %s", glasses_path)
         
-        while retry_count <= max_retries:
+        # The fetched bytes are uploaded once and the file URL is reused by later attempts,
+        # so the origin is never contacted again, not even by Replicate
+        if uploads is None:
+            uploads = {}
+        image_input = uploads.get(image.sha256)
+        if image_input is None:
+            with metrics.stage("upload"):
+                image_input = client.files.create(
+                    io.BytesIO(image.data),
+                    filename=image.filename,
+                    content_type=image.content_type
+                ).urls["get"]
+            uploads[image.sha256] = image_input
+        
+        # Reuse the overlay's hosted URL instead of re-uploading the PNG on every attempt
+        try:
+            glasses_input = overlay.hosted_url(client)
+        except Exception as e:
+            logger.warning("Overlay upload failed, sending the file inline: %s", e)
+            glasses_input = overlay.file_object()
+        
+        logger.debug("Submitting to %s", backend.name)
+        # The backend maps the two images (in its declared order), prompt and parameters to its input
+        # A slot shared by all workers, so the upstream limit holds for the whole server
+        with metrics.stage("upstream_wait"):
+            slot = upstream_slots.acquire(max(0.0, deadline - time.monotonic()))
+        submitted_at = time.perf_counter()
+
+        def predict(glasses_input):
+            return run_prediction(
+                client,
+                backend.model_ref(client),
+                input=backend.build_input(image_input, glasses_input, compiled),
+                on_created=(lambda created: on_submitted(created.id, target_size, compiled.output_format)) if on_submitted else None,
+                deadline=deadline
+            )
+
+        try:
             try:
-                # Open local glasses file
-                with open(glasses_path, "rb") as glasses_file:
-                    print(f"Submitting to nano-banana (attempt {retry_count + 1}/{max_retries + 1})...")
-                    # Use google/nano-banana model - ORDER MATTERS: [base_image, overlay_image]
-                    output = client.run(
-                        "google/nano-banana",
-                        input={
-                            "prompt": prompt,
-                            "image_input": [image_url, glasses_file],
-                            "output_format": "jpg"
-                        }
-                    )
-                
-                print(f"✓ Prediction submitted successfully")
-                
-                # Download the generated image
-                if output:
-                    print(f"Downloading image from nano-banana...")
-                    
-                    # Save the image directly from the result
-                    timestamp = int(time.time())
-                    output_filename = f"nano_banana_glasses_{timestamp}.jpg"
-                    output_path = os.path.join(output_dir, output_filename)
-                    
-                    # Write the file to disk
-                    with open(output_path, "wb") as f:
-                        f.write(output.read())
-                    
-                    print(f"✓ Image saved to: {output_path}")
-                    return output_filename
-                else:
-                    raise Exception("No image was generated by nano-banana")
-                    
+                output, prediction = predict(glasses_input)
             except Exception as e:
-                last_error = e
-                error_str = str(e)
-                
-                # Check if it's a retryable error
-                if "E6716" in error_str or "Director" in error_str or "timeout" in error_str.lower():
-                    retry_count += 1
-                    if retry_count <= max_retries:
-                        wait_time = retry_count * 2  # Progressive backoff: 2s, 4s
-                        print(f"⚠ Replicate service error (attempt {retry_count}/{max_retries + 1}). Retrying in {wait_time}s...")
-                        time.sleep(wait_time)
-                        continue
-                    else:
-                        print(f"❌ Failed after {max_retries + 1} attempts")
-                        raise Exception(f"Replicate service error after {max_retries + 1} attempts. This may be due to: 1) Temporary Replicate service issues, 2) Image format/size incompatibility, or 3) Network issues. Please try again with a different image or wait a moment. Original error: {error_str}")
-                else:
-                    # Non-retryable error
-                    raise e
+                # An expired or deleted hosted overlay fails the prediction: send the file
+                # inline this time, and upload it again for the next request
+                if not isinstance(glasses_input, str) or not overlay.forget_url(e):
+                    raise
+                logger.warning("The hosted overlay URL was rejected, sending the file inline: %s", e)
+                output, prediction = predict(overlay.file_object())
+        except Exception as e:
+            from replicate.exceptions import ModelError
+
+            if isinstance(e, ModelError):
+                metrics.PREDICTIONS.labels(backend.name, "failed").inc()
+            elif isinstance(e, PredictionTimeoutError):
+                metrics.PREDICTIONS.labels(backend.name, "canceled").inc()
+            # Only upstream trouble counts against the model, not a rejected input
+            if is_retryable(e):
+                router.record(backend.name, None, ok=False)
+            raise
+        finally:
+            upstream_slots.release(slot)
+        # Replicate reports the model's own run time; the rest of the wall time is
+        # queueing, cold boot and API round trips
+        elapsed = time.perf_counter() - submitted_at
+        inference = predict_seconds(prediction)
+        router.record(backend.name, elapsed, ok=True)
+        metrics.PREDICTIONS.labels(backend.name, prediction.status).inc()
+        metrics.observe_stage("inference", inference)
+        metrics.observe_stage("model_queue", max(0.0, elapsed - inference))
+        
+        logger.info(
+            "Prediction finished",
+            extra={
+                "prediction_id": prediction.id,
+                "status": prediction.status,
+                "elapsed_s": round(elapsed, 3),
+                "inference_s": round(inference, 3)
+            }
+        )
         
-        # If we get here, all retries failed
-        if last_error:
-            raise last_error
+        return store_output(backend, output, target_size, compiled.output_format, output_storage)
             
     except Exception as e:
-        print(f"Error processing image with nano-banana: {str(e)}")
+        logger.warning("Error processing image with %s: %s", backend.name, e, extra={"error_type": type(e).__name__})
         raise e
 
+def store_output(
+    backend: ModelBackend,
+    output,
+    target_size: Optional[Tuple[int, int]],
+    output_format: str,
+    output_storage: OutputStorage = None
+) -> str:
+    """Download a prediction's output into the output storage; returns the file name"""
+    output_storage = output_storage or storage
+    output = backend.first_output(output)
+    if not output:
+        raise Exception(f"No image was generated by {backend.name}")
+    logger.debug("Downloading image from %s", backend.name)
+    
+    # Stream the result to a temp file and publish it under a content-hash name
+    # only once it is complete, so concurrent requests never collide
+    with output_storage.writer(backend.output_prefix, ".jpg") as output_file:
+        with metrics.stage("download"):
+            for chunk in output:
+                output_file.write(chunk)
+        metrics.OUTPUT_BYTES.inc(output_file.bytes_written)
+        with metrics.stage("store"):
+            if target_size or output_format != "jpg":
+                # Prompt rule 1: keep the original image dimensions (and store every result as JPEG)
+                restore_size_file(output_file.close_temp(), target_size, OUTPUT_JPEG_QUALITY)
+            output_filename = output_file.publish()
+    
+    logger.info("Image saved", extra={"output_filename": output_filename, "bytes": output_file.bytes_written})
+    return output_filename
+
+def resume_unfinished_work():
+    """Resume the predictions a previous process was waiting for; fail what can't be resumed"""
+    for item in work_queue.unfinished():
+        if not item.prediction_id:
+            # Stopped before Replicate created a prediction, so nothing was paid for
+            work_queue.failed(item, "Interrupted by a server restart before the prediction was created")
+        elif time.time() - item.created_at > WORK_QUEUE_RESUME_MAX_AGE:
+            metrics.RESUMED.labels("expired").inc()
+            work_queue.failed(item, "Interrupted by a server restart; too old to resume")
+        else:
+            task = asyncio.create_task(resume_work(item))
+            resume_tasks.add(task)
+            resumed_flights[item.flight_key] = task
+            task.add_done_callback(lambda task, key=item.flight_key: forget_resumed(key, task))
+    if resume_tasks:
+        logger.info("Resuming %d prediction(s) of a previous process", len(resume_tasks))
+
+def forget_resumed(flight_key: str, task: asyncio.Task):
+    resume_tasks.discard(task)
+    if resumed_flights.get(flight_key) is task:
+        del resumed_flights[flight_key]
+    if not task.cancelled():
+        # Reported by resume_work; retrieved so asyncio doesn't log it again
+        task.exception()
+
+def finish_resumed(item: WorkItem) -> str:
+    """Poll a prediction to its end and store its output, on a worker thread"""
+    backend = router.get(item.model)
+    # The same budget a new request gets; a prediction stuck upstream is canceled
+    output, prediction = resume_prediction(
+        clients.replicate, item.prediction_id, time.monotonic() + REPLICATE_DEADLINE_SECONDS
+    )
+    metrics.PREDICTIONS.labels(backend.name, prediction.status).inc()
+    return store_output(backend, output, item.target_size, item.output_format)
+
+async def resume_work(item: WorkItem) -> Tuple[str, str]:
+    """
+    Finish a generation a previous process submitted: the result goes into the cache
+    like any other. Returns (output_filename, model name). If it is cancelled (another
+    shutdown), the item stays unfinished and the next process tries again.
+    """
+    try:
+        output_filename = await asyncio.to_thread(finish_resumed, item)
+    except Exception as e:
+        metrics.RESUMED.labels("failed").inc()
+        logger.warning("Resumed prediction failed: %s", e, extra={"prediction_id": item.prediction_id})
+        await asyncio.to_thread(work_queue.failed, item, str(e))
+        raise
+    if retention:
+        retention.touch(output_filename)
+    if result_cache:
+        await asyncio.to_thread(result_cache.put, item.content_key, output_filename)
+    await asyncio.to_thread(work_queue.succeeded, item, output_filename)
+    work_queue.resumed += 1
+    metrics.RESUMED.labels("succeeded").inc()
+    logger.info("Resumed prediction finished", extra={"prediction_id": item.prediction_id, "output_filename": output_filename})
+    return output_filename, item.model
+
+def load_input_image(image_url: str) -> FetchedImage:
+    """Download, sniff and size the input image in a single request to its origin"""
+    with metrics.stage("fetch"):
+        return fetch_image(clients.http, image_url, INPUT_MAX_BYTES, INPUT_MAX_PIXELS, INPUT_FETCH_TIMEOUT)
+
+async def run_glasses_pipeline(
+    image_url: str,
+    wait: bool = False,
+    on_start: Optional[Callable[[], None]] = None,
+    model: Optional[str] = None,
+    image: Optional[FetchedImage] = None,
+    template: Optional[str] = None,
+    client: str = "anonymous"
+):
+    """
+    Produce a glasses image for image_url, reusing a cached result when possible.
+
+    Concurrent calls for the same image URL share one fetch and one prediction, and
+    so do calls for different URLs that serve the same image bytes. Every caller gets
+    the same output file; only the first caller's on_start is called. Only a model
+    run takes a fair-queue turn, under the client that started it: cache hits and
+    callers joining a running prediction never queue.
+
+    Args:
+        image_url: Public URL of the input image
+        wait: Wait for a free worker instead of failing fast with PoolSaturatedError;
+            decided for this caller alone, even when it joins another caller's run
+        on_start: Called on the worker thread right before a model run starts
+        model: Name of the model to use; None lets the router choose (and fail over)
+        image: The input image, already received (an upload); image_url is then only a label
+        template: Name of the glasses template; None uses the default one
+        client: Client id the model run is admitted under
+
+    Returns:
+        (output_filename, cache_hit, model name)
+    """
+    # Compiled at load time, so this is only a lookup
+    glasses = templates.get(template)
+    model = model or glasses.model
+    if image is not None:
+        # Nothing to fetch; identical uploads are coalesced by content in produce_glasses
+        return await produce_glasses(image_url, glasses, wait, on_start, model, client, image)
+    url_key = make_cache_key("url:" + normalize_url(image_url), glasses.sha256, "", model or "auto", NORMALIZE_SIGNATURE)
+    result, shared = await join_flight(url_key, lambda: produce_glasses(image_url, glasses, wait, on_start, model, client), wait)
+    if shared:
+        metrics.COALESCED.inc()
+        logger.info("Joined an identical in-flight request")
+    return result
+
+async def join_flight(key: str, fn: Callable[[], Awaitable], wait: bool) -> tuple:
+    """
+    flights.do(key, fn) with admission decided for each caller rather than by whoever
+    leads the flight. The leader's model run is admitted with the leader's `wait`, so
+    if it was rejected (fail-fast and the server full), that is a decision only for
+    the callers that fail fast too: callers that wait run the flight again instead,
+    leading it under their own admission or joining whoever does.
+    """
+    while True:
+        try:
+            return await flights.do(key, fn)
+        except (ClientQueueFullError, PoolSaturatedError):
+            # A waiting caller's own run is never rejected, so this was the leader's
+            if not wait:
+                raise
+
+async def produce_glasses(
+    image_url: str,
+    glasses: GlassesTemplate,
+    wait: bool,
+    on_start: Optional[Callable[[], None]],
+    model: Optional[str],
+    client: str,
+    image: Optional[FetchedImage] = None
+):
+    """Fetch, look up the cache and generate; the body of run_glasses_pipeline"""
+    # The only request to the image origin; the bytes feed both the cache key and the model
+    if image is None:
+        image = await asyncio.to_thread(load_input_image, image_url)
+
+    def content_key(backend: ModelBackend) -> str:
+        return make_cache_key(
+            image.sha256, glasses.overlay_sha256, glasses.inputs[backend.name].cache_part, backend.model, NORMALIZE_SIGNATURE
+        )
+
+    # Clear single portraits are composited locally; a requested model always runs
+    if compositor_pool and not model:
+        local_key = make_cache_key(image.sha256, glasses.overlay_sha256, "", COMPOSITOR_MODEL, COMPOSITOR_SIGNATURE)
+        if result_cache:
+            cached_filename = await asyncio.to_thread(result_cache.get, local_key)
+            if cached_filename:
+                metrics.CACHE_LOOKUPS.labels("hit").inc()
+                logger.info("Cache hit", extra={"output_filename": cached_filename, "model": COMPOSITOR_MODEL})
+                if retention:
+                    retention.touch(cached_filename)
+                return cached_filename, True, COMPOSITOR_MODEL
+        output_filename = await composite_locally(image, glasses.overlay)
+        if output_filename:
+            if retention:
+                retention.touch(output_filename)
+            if result_cache:
+                await asyncio.to_thread(result_cache.put, local_key, output_filename)
+            return output_filename, False, COMPOSITOR_MODEL
+
+    # Different URLs with the same bytes (mirrors, CDN variants) share one prediction too
+    flight_key = make_cache_key(image.sha256, glasses.sha256, "", model or "auto", NORMALIZE_SIGNATURE)
+    resumed = resumed_flights.get(flight_key)
+    if resumed:
+        # A previous process already paid for this prediction
+        try:
+            output_filename, model_name = await asyncio.shield(resumed)
+            logger.info("Joined a resumed prediction", extra={"output_filename": output_filename})
+            return output_filename, False, model_name
+        except Exception:
+            pass
+
+    if model:
+        backend, reason = router.get(model), "explicit"
+    else:
+        backend, reason = router.choose()
+    if result_cache:
+        cached_filename = await asyncio.to_thread(result_cache.get, content_key(backend))
+        metrics.CACHE_LOOKUPS.labels("hit" if cached_filename else "miss").inc()
+        if cached_filename:
+            logger.info("Cache hit", extra={"output_filename": cached_filename, "model": backend.name})
+            if retention:
+                retention.touch(cached_filename)
+            return cached_filename, True, backend.name
+
+    uploads = {}
+    started = False
+    attempts = 0
+
+    submitted_at = 0.0
+
+    def generate(chosen: ModelBackend, deadline: float):
+        nonlocal started
+        metrics.observe_stage("worker_queue", time.perf_counter() - submitted_at)
+        if on_start and not started:
+            on_start()
+        started = True
+        if not work_queue:
+            return add_glasses_to_image(
+                image_url, template=glasses, image=image, uploads=uploads, backend=chosen, deadline=deadline
+            )
+        item = work_queue.accept(flight_key, content_key(chosen), chosen.name, glasses.name)
+
+        def submitted(prediction_id: str, target_size: Optional[Tuple[int, int]], output_format: str):
+            nonlocal item
+            item = work_queue.submitted(item, prediction_id, target_size, output_format)
+
+        try:
+            output_filename = add_glasses_to_image(
+                image_url,
+                template=glasses,
+                image=image,
+                uploads=uploads,
+                backend=chosen,
+                on_submitted=submitted,
+                deadline=deadline
+            )
+        except Exception as e:
+            work_queue.failed(item, str(e))
+            raise
+        work_queue.succeeded(item, output_filename)
+        return output_filename
+
+    async def attempt(deadline: float):
+        nonlocal submitted_at, attempts, backend, reason
+        # Retries of a routed request are routed again, so they fail over once the
+        # model that just failed is degraded; an explicitly chosen model is kept
+        if attempts and not model:
+            backend, reason = router.choose()
+        attempts += 1
+        chosen = backend
+        metrics.MODEL_ROUTED.labels(chosen.name, reason).inc()
+        if reason not in ("primary", "explicit"):
+            logger.info("Routing to %s", chosen.name, extra={"reason": reason})
+        # Only the model run waits for the client's fair turn. Retries were already
+        # admitted once, so they queue instead of failing fast; no slot or worker is
+        # held while backing off between attempts
+        async with fair_queue.slot(client, client_weight(CLIENT_WEIGHTS, client), wait=wait or started):
+            submitted_at = time.perf_counter()
+            return await router.breakers[chosen.name].call(
+                lambda: generation_pool.run(generate, chosen, deadline, wait=wait or started), is_retryable
+            ), chosen
+
+    async def generate_and_store():
+        output_filename, chosen = await call_with_retry(
+            attempt, retry_policy, on_retry=lambda e: metrics.RETRIES.labels(type(e).__name__).inc()
+        )
+        if retention and output_filename:
+            retention.touch(output_filename)
+        if result_cache and output_filename:
+            # Stored under the model that actually produced it
+            await asyncio.to_thread(result_cache.put, content_key(chosen), output_filename)
+        return output_filename, chosen.name
+
+    (output_filename, model_name), _ = await join_flight(flight_key, generate_and_store, wait)
+    return output_filename, False, model_name
+
+async def composite_locally(image: FetchedImage, overlay: OverlayAsset) -> Optional[str]:
+    """
+    Composite the overlay onto image in the compositor process pool and store the result.
+    Returns its file name, or None if the detection wasn't confident enough (or failed).
+    """
+    from compositor import composite_glasses
+
+    try:
+        with metrics.stage("composite"):
+            data, confidence, reason = await asyncio.get_running_loop().run_in_executor(
+                compositor_pool, composite_glasses, image.data, overlay.path, COMPOSITOR_MIN_CONFIDENCE, OUTPUT_JPEG_QUALITY
+            )
+    except Exception as e:
+        metrics.COMPOSITOR.labels("error").inc()
+        logger.warning("Local compositing failed, falling back to the model: %s", e, extra={"error_type": type(e).__name__})
+        return None
+    if data is None:
+        metrics.COMPOSITOR.labels("fallback").inc()
+        logger.info("Falling back to the model", extra={"confidence": confidence, "reason": reason})
+        return None
+
+    def store() -> str:
+        with storage.writer("local_glasses", ".jpg") as output_file:
+            output_file.write(data)
+            return output_file.publish()
+
+    with metrics.stage("store"):
+        output_filename = await asyncio.to_thread(store)
+    metrics.COMPOSITOR.labels("used").inc()
+    logger.info("Composited locally", extra={"confidence": confidence, "output_filename": output_filename})
+    return output_filename
+
 @app.get("/")
 async def root():
     """Root endpoint with API information"""
@@ -190,76 +1174,516 @@ async def root():
         "name": "AI Image Generation API",
         "version": "1.0.0",
         "endpoints": {
-            "POST /add-glasses": "Add glasses to an image from URL using Google's nano-banana model",
-            "GET /health": "Health check endpoint"
+            "POST /add-glasses": "Add glasses to an image (by URL or uploaded) using Google's nano-banana model",
+            "POST /add-glasses-flux": "Add glasses by blending the overlay into the image with lambdal/image-mixer",
+            "POST /add-glasses/batch": "Add glasses to many image URLs; streams per-item results as NDJSON",
+            "POST /jobs": "Submit an asynchronous glasses job; returns a job id immediately",
+            "GET /jobs/{job_id}": "Job status and result",
+            "GET /jobs/{job_id}/events": "Server-Sent Events stream of job status changes",
+            "GET /templates": "Glasses templates that requests can pick by name",
+            "GET /health": "Liveness and stats; status is \"degraded\" while models can't run",
+            "GET /ready": "Readiness: 200 once this worker is warmed up, 503 before",
+            "GET /metrics": "Prometheus metrics"
         },
-        "models": {
-            "nano-banana": "Google's nano-banana model for precise glasses overlay"
-        }
+        "models": {name: backend.description for name, backend in router.backends.items()}
+    }
+
+@app.get("/templates")
+async def list_templates():
+    """The glasses templates by name; pass one as `template` to choose it"""
+    return {
+        "default": templates.default,
+        "templates": {name: template.describe() for name, template in templates.all().items()}
     }
 
+@app.get("/ready")
+async def readiness_check():
+    """
+    Readiness: 200 once this worker is warmed up and configured to generate, 503
+    with the reasons before. Point load balancer and deploy health checks here.
+    """
+    problems = readiness_problems()
+    if problems:
+        return JSONResponse(status_code=503, content={"status": "not_ready", "problems": problems})
+    return {"status": "ready", "startup": startup.stats()}
+
 @app.get("/health")
 async def health_check():
-    """Health check endpoint"""
-    return {"status": "healthy", "service": "glasses-overlay-api"}
+    """Liveness and stats: always 200 while the process runs; "degraded" if it can't generate"""
+    problems = configuration_problems()
+    return {
+        "status": "degraded" if problems else "healthy",
+        "problems": problems,
+        "ready": not readiness_problems(),
+        "service": "glasses-overlay-api",
+        "generation_pool": generation_pool.stats() if generation_pool else None,
+        "result_cache": result_cache.stats() if result_cache else None,
+        "output_retention": retention.stats() if retention else None,
+        "output_variants": variants.stats() if variants else None,
+        "templates": templates.stats() if templates else None,
+        "work_queue": work_queue.stats() if work_queue else None,
+        "models": router.stats(),
+        "coalescing": flights.stats(),
+        "compositor": {"enabled": compositor_pool is not None, "min_confidence": COMPOSITOR_MIN_CONFIDENCE},
+        "model_backend": MODEL_BACKEND,
+        "upstream_slots": upstream_slots.stats() if upstream_slots else None,
+        "admission": {
+            "rate_limit": rate_limiter.stats() if rate_limiter else None,
+            "fair_queue": fair_queue.stats() if fair_queue else None
+        },
+        "process": {
+            "pid": os.getpid(),
+            "workers": WORKERS,
+            "retention_leader": retention_lock.held,
+            "rss_bytes": metrics.rss_bytes(),
+            "startup": startup.stats(),
+            "event_loop_lag": loop_lag.stats()
+        }
+    }
 
-@app.post("/add-glasses", response_model=GlassesResponse)
-async def add_glasses(request: GlassesRequest):
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus scrape endpoint: per-stage latency histograms, counters and gauges"""
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE_LATEST)
+
+def success_response(output_filename: str, cache_hit: bool, model: str, template: Optional[str] = None) -> GlassesResponse:
+    """Build the GlassesResponse for a generated (or cached) output file"""
+    # Create the full URL for the generated image (a presigned one for private buckets)
+    image_url = storage.url_for(output_filename)
+    
+    return GlassesResponse(
+        success=True,
+        message=f"Glasses added successfully with {model}!",
+        image_url=image_url,
+        local_path=storage.local_path(output_filename),
+        cache="hit" if cache_hit else "miss",
+        model=model,
+        path="local" if model == COMPOSITOR_MODEL else "model",
+        template=template or templates.default
+    )
+
+def check_model(model: Optional[str]):
+    """Reject an unknown explicitly requested model with a 400"""
+    if model and model not in router.backends:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown model '{model}'. Available models: {', '.join(router.backends)}"
+        )
+
+def check_template(template: Optional[str]):
+    """Reject an unknown template name with a 400"""
+    if template and template not in templates.all():
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown template '{template}'. Available templates: {', '.join(templates.all())}"
+        )
+
+def failure_response(e: Exception, model: Optional[str] = None) -> GlassesResponse:
+    """Turn a pipeline error into the user-facing GlassesResponse"""
+    model = model or router.candidates[0]
+    metrics.ERRORS.labels(type(e).__name__).inc()
+    if isinstance(e, httpx.HTTPError):
+        return GlassesResponse(
+            success=False,
+            message=f"Failed to download image: {str(e)}"
+        )
+    error_message = str(e)
+    if "REPLICATE_API_TOKEN" in error_message:
+        return GlassesResponse(
+            success=False,
+            message="Replicate API token is required. Please set REPLICATE_API_TOKEN environment variable."
+        )
+    else:
+        return GlassesResponse(
+            success=False,
+            message=f"Error adding glasses with {model}: {error_message}"
+        )
+
+async def admit(http_request: Request, cost: float = 1) -> str:
+    """
+    Charge `cost` requests to the caller's rate limit and return its client id.
+    Raises a 429 with Retry-After once the client's bucket is empty.
+    """
+    peer = http_request.client.host if http_request.client else None
+    client = client_id(http_request.headers, peer, TRUST_FORWARDED_FOR, CLIENT_WEIGHTS)
+    if rate_limiter:
+        retry_after = await asyncio.to_thread(rate_limiter.check, client, cost)
+        if retry_after:
+            metrics.REJECTIONS.labels("rate_limited").inc()
+            logger.info("Rate limited", extra={"client": client, "retry_after": round(retry_after, 1)})
+            raise HTTPException(
+                status_code=429,
+                detail="Too many requests. Please slow down.",
+                headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+            )
+    return client
+
+# /add-glasses takes a JSON GlassesRequest, a multipart upload or a raw image body
+GLASSES_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "application/json": {"schema": GlassesRequest.model_json_schema()},
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "properties": {
+                        "image": {"type": "string", "format": "binary"},
+                        "model": {"type": "string"},
+                        "template": {"type": "string"}
+                    },
+                    "required": ["image"]
+                }
+            },
+            "image/*": {"schema": {"type": "string", "format": "binary"}}
+        }
+    }
+}
+
+async def read_glasses_request(http_request: Request) -> Tuple[GlassesRequest, Optional[FetchedImage]]:
+    """
+    Parse the body of /add-glasses: a JSON GlassesRequest, a multipart/form-data
+    upload (an "image" file part and optional "model" and "template" fields), or a raw
+    image body (Content-Type image/* or application/octet-stream, model and template
+    in the query string).
+
+    Uploaded bytes are streamed into a spooled temp file, hashed on the way in and
+    cut off at INPUT_MAX_BYTES. Returns the request and the received image, which is
+    None for an image_url that still has to be fetched.
+    """
+    content_type = http_request.headers.get("content-type", "application/json")
+    media_type = content_type.split(";")[0].strip().lower()
+    content_length = http_request.headers.get("content-length", "")
+    # Base64 is 4/3 the size of the image, plus some room for the JSON or multipart framing
+    max_body = INPUT_MAX_BYTES * 4 // 3 + 64 * 1024
+    if content_length.isdigit() and int(content_length) > max_body:
+        raise HTTPException(status_code=413, detail=f"Request body is too large (limit is {INPUT_MAX_BYTES} bytes of image).")
+
+    upload = SpooledUpload(INPUT_MAX_BYTES)
+    try:
+        if media_type == "application/json":
+            body = SpooledUpload(max_body)
+            await receive_body(http_request.stream(), body)
+            try:
+                request = GlassesRequest.model_validate_json(body.read() or b"{}")
+            except ValidationError as e:
+                # Reported like FastAPI's own body validation errors
+                raise RequestValidationError(
+                    [{**error, "loc": ("body", *error["loc"])} for error in e.errors(include_url=False, include_context=False)]
+                )
+            if request.image_base64 is None:
+                return request, None
+            encoded = request.image_base64.strip()
+            if encoded.startswith("data:"):
+                encoded = encoded.partition(",")[2]
+            try:
+                upload.write(base64.b64decode(encoded, validate=True))
+            except binascii.Error as e:
+                raise UploadError(f"image_base64 is not valid base64: {str(e)}")
+            request = request.model_copy(update={"image_base64": None})
+        elif media_type == "multipart/form-data":
+            # Form fields, falling back to the query string
+            fields = {**http_request.query_params, **await receive_multipart(http_request.stream(), content_type, upload)}
+            request = GlassesRequest.model_construct(model=fields.get("model"), template=fields.get("template"))
+        elif media_type.startswith("image/") or media_type == "application/octet-stream":
+            await receive_body(http_request.stream(), upload)
+            query = http_request.query_params
+            request = GlassesRequest.model_construct(model=query.get("model"), template=query.get("template"))
+        else:
+            raise UploadError(
+                f"Unsupported Content-Type '{media_type}'; send JSON, multipart/form-data or an image body", 415
+            )
+        if not upload.size:
+            raise UploadError("The uploaded image is empty.")
+        data = upload.read()
+    except UploadError as e:
+        metrics.ERRORS.labels(type(e).__name__).inc()
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    finally:
+        upload.close()
+
+    try:
+        image = await asyncio.to_thread(
+            inspect_image, f"upload:{upload.sha256[:16]}", data, INPUT_MAX_PIXELS,
+            "The upload is not a JPEG, PNG, GIF or WebP image.", upload.sha256
+        )
+    except ImageFetchError as e:
+        metrics.ERRORS.labels(type(e).__name__).inc()
+        raise HTTPException(status_code=400, detail=str(e))
+    logger.info("Image uploaded", extra={"image_format": image.format, "bytes": len(data), "sha256": image.sha256})
+    return request, image
+
+@app.post("/add-glasses", response_model=GlassesResponse, openapi_extra=GLASSES_REQUEST_BODY)
+async def add_glasses(http_request: Request):
     """
     Add glasses to a person in an image using Google's nano-banana model.
-    
-    Args:
-        request: GlassesRequest with image_url
-        
+
+    Send a JSON GlassesRequest with the image_url (or the image as image_base64), a
+    multipart/form-data upload with an "image" file part, or the image itself as the
+    request body. Uploads go straight to the model, without a public URL.
+
+    Set `model` to pick a model explicitly; otherwise the router picks one and
+    fails over to another model while nano-banana is degraded.
+
     Returns:
         GlassesResponse with the URL of the processed image
     """
+    client = await admit(http_request)
+    request, image = await read_glasses_request(http_request)
+    return await glasses_response(request, image, client)
+
+async def glasses_response(request: GlassesRequest, image: Optional[FetchedImage], client: str) -> GlassesResponse:
+    """Run one admitted /add-glasses request and map the outcome to a response or an HTTP error"""
+    check_model(request.model)
+    check_template(request.template)
     try:
-        # Ensure output directory exists
-        os.makedirs("output", exist_ok=True)
-        
-        # Process the image with nano-banana
-        output_filename = add_glasses_to_image(str(request.image_url))
+        # Process the image on the worker pool so the event loop stays free; a model run
+        # waits for this client's fair turn first
+        output_filename, cache_hit, model = await run_glasses_pipeline(
+            image.url if image else str(request.image_url),
+            model=request.model,
+            image=image,
+            template=request.template,
+            client=client
+        )
         
         if output_filename:
-            # Create the full URL for the generated image
-            image_url = f"{PUBLIC_URL}/output/{output_filename}"
-            
-            return GlassesResponse(
-                success=True,
-                message="Glasses added successfully with nano-banana!",
-                image_url=image_url,
-                local_path=f"output/{output_filename}"
-            )
+            return success_response(output_filename, cache_hit, model, request.template)
         else:
             raise HTTPException(status_code=500, detail="Failed to add glasses")
             
-    except requests.exceptions.RequestException as e:
-        return GlassesResponse(
-            success=False,
-            message=f"Failed to download image: {str(e)}"
+    except ClientQueueFullError as e:
+        metrics.REJECTIONS.labels("client_queue_full").inc()
+        raise HTTPException(
+            status_code=429,
+            detail=f"Too many concurrent requests: {str(e)}. Please retry shortly.",
+            headers={"Retry-After": str(OVERLOAD_RETRY_AFTER)}
+        )
+    except (PoolSaturatedError, SlotTimeoutError) as e:
+        metrics.REJECTIONS.labels("pool_saturated" if isinstance(e, PoolSaturatedError) else "upstream_busy").inc()
+        raise HTTPException(
+            status_code=503,
+            detail=f"Server is busy: {str(e)}. Please retry shortly.",
+            headers={"Retry-After": str(OVERLOAD_RETRY_AFTER)}
+        )
+    except CircuitOpenError as e:
+        metrics.REJECTIONS.labels("circuit_open").inc()
+        raise HTTPException(
+            status_code=503,
+            detail=f"{str(e)}. Please retry shortly.",
+            headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))}
         )
     except Exception as e:
-        error_message = str(e)
-        if "REPLICATE_API_TOKEN" in error_message:
-            return GlassesResponse(
-                success=False,
-                message="Replicate API token is required. Please set REPLICATE_API_TOKEN environment variable."
-            )
-        else:
-            return GlassesResponse(
-                success=False,
-                message=f"Error adding glasses with nano-banana: {error_message}"
-            )
+        return failure_response(e, request.model)
+
+@app.post("/add-glasses-flux", response_model=GlassesResponse, openapi_extra=GLASSES_REQUEST_BODY)
+async def add_glasses_flux(http_request: Request):
+    """
+    Add glasses by blending the glasses overlay into the image with lambdal/image-mixer.
+    Same as POST /add-glasses with model "image-mixer", and takes the same bodies.
+    """
+    client = await admit(http_request)
+    request, image = await read_glasses_request(http_request)
+    return await glasses_response(request.model_copy(update={"model": "image-mixer"}), image, client)
+
+@app.post("/add-glasses/batch")
+async def add_glasses_batch(request: BatchRequest, http_request: Request):
+    """
+    Add glasses to many images in one call.
+
+    Duplicate URLs are processed once. Items run with bounded parallelism and each
+    result is streamed back as one NDJSON line (a BatchItemResult) as soon as it
+    finishes, so fast items never wait for the slowest. A failing item is reported
+    in its own line and doesn't affect the rest of the batch. Every unique URL counts
+    against the caller's rate limit, and items take fair turns with other clients.
+    """
+    # dict.fromkeys keeps the first occurrence of each URL, in order
+    image_urls = list(dict.fromkeys(str(url) for url in request.image_urls))
+    if len(image_urls) > BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch has {len(image_urls)} unique image URLs; the maximum is {BATCH_MAX_ITEMS}"
+        )
+    check_model(request.model)
+    check_template(request.template)
+    client = await admit(http_request, cost=len(image_urls))
+    concurrency = min(request.concurrency or BATCH_CONCURRENCY, BATCH_MAX_CONCURRENCY)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def process(source_url: str) -> BatchItemResult:
+        async with semaphore:
+            try:
+                output_filename, cache_hit, model = await run_glasses_pipeline(
+                    source_url, wait=True, model=request.model, template=request.template, client=client
+                )
+                if not output_filename:
+                    raise Exception("Failed to add glasses")
+                result = success_response(output_filename, cache_hit, model, request.template)
+            except Exception as e:
+                result = failure_response(e, request.model)
+        return BatchItemResult(source_url=source_url, **result.model_dump(exclude_none=True))
+
+    async def results():
+        tasks = [asyncio.create_task(process(url)) for url in image_urls]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                item = await finished
+                yield item.model_dump_json() + "\n"
+        finally:
+            # Client went away: stop items that haven't started yet
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+def job_response(job: Job) -> JobResponse:
+    if job.output_filename:
+        # Re-sign on every read so presigned result URLs don't go stale in the job store
+        job = job.model_copy(update={"result_url": storage.url_for(job.output_filename)})
+    return JobResponse(
+        job=job,
+        status_url=f"{PUBLIC_URL}/jobs/{job.id}",
+        events_url=f"{PUBLIC_URL}/jobs/{job.id}/events"
+    )
+
+def deliver_callback(job: Job):
+    """POST the finished job to its callback_url. Failures are logged, never raised."""
+    try:
+        response = clients.http.post(job.callback_url, json=job.model_dump(), timeout=JOB_CALLBACK_TIMEOUT)
+        logger.info("Job callback delivered", extra={"job_id": job.id, "status_code": response.status_code})
+    except httpx.HTTPError as e:
+        logger.warning("Job callback failed: %s", e, extra={"job_id": job.id})
+
+def restart_job(job: Job):
+    """Run a job a previous process left unfinished again, from the start"""
+    job_store.update(job.id, status=JOB_QUEUED)
+    # Restarted jobs share one fair-queue lane, so they don't crowd out new requests
+    task = asyncio.create_task(run_job(job.id, "restart"))
+    job_tasks.add(task)
+    task.add_done_callback(job_tasks.discard)
+
+async def run_job(job_id: str, client: str):
+    """Background task driving one job from queued to a terminal state"""
+    job = job_store.get(job_id)
+    try:
+        # Jobs wait for their fair turn and a free worker instead of being rejected
+        # like synchronous requests
+        output_filename, _, model = await run_glasses_pipeline(
+            job.image_url,
+            wait=True,
+            on_start=lambda: job_store.update(job_id, status=JOB_RUNNING),
+            model=job.model,
+            template=job.template,
+            client=client
+        )
+        if not output_filename:
+            raise Exception("Failed to add glasses")
+        job = job_store.update(
+            job_id,
+            status=JOB_SUCCEEDED,
+            model=model,
+            output_filename=output_filename,
+            result_url=storage.url_for(output_filename)
+        )
+    except asyncio.CancelledError:
+        # With the work queue, the next process picks the job up again
+        if not work_queue:
+            job_store.update(job_id, status=JOB_FAILED, error="Job was cancelled by a server shutdown. Please resubmit.")
+        raise
+    except Exception as e:
+        job = job_store.update(job_id, status=JOB_FAILED, error=str(e))
+
+    if job.callback_url:
+        await asyncio.to_thread(deliver_callback, job)
+
+@app.post("/jobs", response_model=JobResponse, status_code=202)
+async def create_job(request: JobRequest, http_request: Request):
+    """
+    Submit an asynchronous glasses job.
+
+    Returns immediately with the job id. Poll GET /jobs/{job_id}, follow
+    GET /jobs/{job_id}/events, or pass callback_url to be notified on completion.
+    """
+    check_model(request.model)
+    check_template(request.template)
+    client = await admit(http_request)
+    job_store.prune(JOB_TTL_SECONDS)
+    job = job_store.create(
+        str(request.image_url),
+        callback_url=str(request.callback_url) if request.callback_url else None,
+        model=request.model,
+        template=request.template
+    )
+    task = asyncio.create_task(run_job(job.id, client))
+    job_tasks.add(task)
+    task.add_done_callback(job_tasks.discard)
+    return job_response(job)
+
+@app.get("/jobs/{job_id}", response_model=JobResponse)
+async def get_job(job_id: str):
+    """Return the current status of a job, including output_filename and result_url once it has succeeded"""
+    job = job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job_response(job)
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """
+    Stream job status changes as Server-Sent Events.
+
+    Sends a "status" event with the job JSON on every change and closes the
+    stream once the job has succeeded or failed.
+    """
+    if job_store.get(job_id) is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+
+    async def event_stream():
+        last_sent = None
+        while True:
+            changed = job_store.subscribe(job_id)
+            job = job_store.get(job_id)
+            if job is None:
+                return
+            if job.updated_at != last_sent:
+                last_sent = job.updated_at
+                yield f"event: status\ndata: {job.model_dump_json()}\n\n"
+                if job.finished:
+                    return
+            else:
+                # Comment line keeps proxies from closing an idle connection
+                yield ": keep-alive\n\n"
+            try:
+                await asyncio.wait_for(changed.wait(), timeout=15)
+            except asyncio.TimeoutError:
+                pass
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# Everything above runs when the module is imported
+startup.record("imports", time.perf_counter() - PROCESS_STARTED)
+IMPORTED = time.perf_counter()
 
 if __name__ == "__main__":
-    print("Starting AI Image Generation API server...")
-    print(f"API will be available at: {PUBLIC_URL}")
-    print(f"Documentation available at: {PUBLIC_URL}/docs")
-    print(f"Port: {PORT}, Host: {HOST}")
-    print("Using nano-banana model for precise glasses overlay")
+    logger.info("Starting AI Image Generation API server", extra={"public_url": PUBLIC_URL, "host": HOST, "port": PORT, "workers": WORKERS})
+    logger.info("Documentation available at: %s/docs", PUBLIC_URL)
     if REPLICATE_API_TOKEN:
-        print(f"✓ Replicate API token configured (starts with: {REPLICATE_API_TOKEN[:10]}...)")
+        logger.info("Replicate API token configured")
     else:
-        print("⚠ Replicate API token not set - /add-glasses endpoint will require REPLICATE_API_TOKEN")
-    uvicorn.run(app, host=HOST, port=PORT)
+        logger.warning("Replicate API token not set - /add-glasses endpoint will require REPLICATE_API_TOKEN")
+    import uvicorn
+
+    # log_config=None keeps uvicorn's own records on the queued handler configured above.
+    # Several workers need the app as an import string so each process builds its own.
+    uvicorn.run(
+        "api:app" if WORKERS > 1 else app,
+        host=HOST,
+        port=PORT,
+        workers=WORKERS,
+        log_config=None,
+        timeout_graceful_shutdown=SHUTDOWN_DRAIN_SECONDS
+    )
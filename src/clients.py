@@ -0,0 +1,92 @@
+import threading
+
+import httpx
+
+# HTTP/2 needs the optional h2 package (httpx[http2]); fall back to HTTP/1.1 keep-alive without it
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+class SharedClients:
+    """
+    Long-lived HTTP clients shared by every request.
+
+    `http` talks to image hosts (input validation/download, job callbacks) and
+    `replicate` talks to the Replicate API, including output file downloads, which
+    go through the Replicate client's own connection pool. Both keep connections
+    alive between requests so TLS handshakes and DNS lookups are paid once per
+    host instead of once per request. Create on startup, close on shutdown.
+
+    The replicate package (which pulls in numpy) is only imported when `replicate`
+    is first used, normally by preconnect() during warm-up, so it doesn't delay the
+    server's start.
+    """
+
+    def __init__(
+        self,
+        replicate_api_token: str,
+        max_connections: int,
+        max_keepalive_connections: int,
+        keepalive_expiry: float,
+        connect_timeout: float,
+        read_timeout: float,
+        replicate_client=None,
+    ):
+        self.http2 = HTTP2_AVAILABLE
+        self.max_connections = max_connections
+        self._replicate_api_token = replicate_api_token
+        self._limit_args = (max_connections, max_keepalive_connections, keepalive_expiry)
+        self._timeout = timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self._lock = threading.Lock()
+
+        self.http = httpx.Client(
+            http2=self.http2,
+            limits=self._limits(max_connections, max_keepalive_connections, keepalive_expiry),
+            timeout=timeout,
+            follow_redirects=True,
+        )
+        # A ready-made client (e.g. the offline fake model backend) replaces the real one
+        self._owns_replicate = replicate_client is None
+        self._replicate = replicate_client
+
+    @property
+    def replicate(self):
+        if self._replicate is None:
+            with self._lock:
+                if self._replicate is None:
+                    import replicate
+
+                    # replicate.Client wraps the transport in its own retry layer and builds
+                    # the underlying httpx.Client lazily, so the pool is only opened on first use
+                    self._replicate = replicate.Client(
+                        api_token=self._replicate_api_token.strip() if self._replicate_api_token else None,
+                        timeout=self._timeout,
+                        transport=httpx.HTTPTransport(http2=self.http2, limits=self._limits(*self._limit_args)),
+                    )
+        return self._replicate
+
+    def preconnect(self):
+        """
+        Open a connection to the Replicate API (DNS, TCP and TLS) with one cheap
+        authenticated request, so the first prediction doesn't pay for it. Raises
+        replicate's ReplicateError (status 401) if the API token is rejected.
+        """
+        client = self.replicate
+        if self._owns_replicate:
+            client.accounts.current()
+
+    @staticmethod
+    def _limits(max_connections: int, max_keepalive_connections: int, keepalive_expiry: float) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+
+    def close(self):
+        self.http.close()
+        if self._owns_replicate and self._replicate is not None:
+            self._replicate._client.close()
@@ -0,0 +1,189 @@
+import io
+import math
+from functools import lru_cache
+from typing import Optional, Tuple
+
+from PIL import Image, ImageOps
+
+# Face and eye detection need OpenCV (the compositor extra); without it only the model path exists
+try:
+    import cv2
+    import numpy as np
+    COMPOSITOR_AVAILABLE = True
+except ImportError:
+    COMPOSITOR_AVAILABLE = False
+
+# Detection runs on a downscaled copy; landmarks are scaled back to the full image
+DETECT_MAX_EDGE = 800
+# Haar cascade level weights at which a face / an eye counts as certain (observed on
+# clear frontal portraits; weaker detections scale the confidence down linearly)
+FACE_WEIGHT_FULL = 5.0
+EYE_WEIGHT_FULL = 2.0
+# Plausible eye geometry, relative to the face box
+EYE_SPACING_RANGE = (0.28, 0.55)
+EYE_HEIGHT_RANGE = (0.2, 0.55)
+MAX_TILT_DEGREES = 25.0
+
+
+class Detection:
+    """Eye centers (image pixels, left eye = smaller x) and how sure we are they are right."""
+
+    def __init__(self, confidence: float, reason: str, left_eye=None, right_eye=None):
+        self.confidence = confidence
+        self.reason = reason
+        self.left_eye = left_eye
+        self.right_eye = right_eye
+
+
+@lru_cache(maxsize=None)
+def _cascades():
+    face = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
+    eye = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_eye.xml")
+    return face, eye
+
+
+@lru_cache(maxsize=4)
+def _overlay(path: str) -> Tuple[Image.Image, Tuple[float, float], Tuple[float, float]]:
+    """The glasses overlay and its lens centers (centroids of the frame's left and right halves)."""
+    overlay = Image.open(path).convert("RGBA")
+    alpha = np.asarray(overlay.getchannel("A"), dtype=np.float64)
+    left, top, right, bottom = overlay.getchannel("A").getbbox()
+    middle = (left + right) // 2
+    centers = []
+    for x0, x1 in ((left, middle), (middle, right)):
+        weights = alpha[top:bottom, x0:x1]
+        ys, xs = np.mgrid[top:bottom, x0:x1]
+        total = weights.sum()
+        centers.append(((xs * weights).sum() / total, (ys * weights).sum() / total))
+    return overlay, centers[0], centers[1]
+
+
+def _linear(value: float, full: float) -> float:
+    return max(0.0, min(1.0, value / full))
+
+
+def _within(value: float, low: float, high: float, slack: float) -> float:
+    """1 inside [low, high], falling linearly to 0 at `slack` outside it."""
+    outside = max(low - value, value - high, 0.0)
+    return max(0.0, 1.0 - outside / slack)
+
+
+def detect_eyes(image: Image.Image) -> Detection:
+    """Find the eyes of the single frontal face in image, with a confidence in [0, 1]."""
+    scale = min(1.0, DETECT_MAX_EDGE / max(image.size))
+    small = image.convert("L")
+    if scale < 1:
+        small = small.resize((round(image.width * scale), round(image.height * scale)), Image.BILINEAR)
+    gray = cv2.equalizeHist(np.asarray(small))
+    face_cascade, eye_cascade = _cascades()
+
+    min_face = max(48, min(gray.shape) // 8)
+    faces, _, face_weights = face_cascade.detectMultiScale3(
+        gray, scaleFactor=1.1, minNeighbors=5, minSize=(min_face, min_face), outputRejectLevels=True
+    )
+    # Weak detections are mostly texture that happens to look like a face
+    faces = [(face, float(weight)) for face, weight in zip(faces, np.ravel(face_weights)) if weight >= FACE_WEIGHT_FULL / 2]
+    if len(faces) != 1:
+        # Group photos (prompt rule 9) and faceless images go to the model
+        return Detection(0.0, f"{len(faces)} faces found")
+    (x, y, w, h), face_weight = faces[0]
+
+    # Eyes sit in the upper part of the face box
+    roi = gray[y:y + int(h * 0.6), x:x + w]
+    eyes, _, eye_weights = eye_cascade.detectMultiScale3(
+        roi, scaleFactor=1.05, minNeighbors=3, minSize=(w // 10, w // 10), outputRejectLevels=True
+    )
+    candidates = [
+        (ex + ew / 2, ey + eh / 2, float(weight))
+        for (ex, ey, ew, eh), weight in zip(eyes, np.ravel(eye_weights) if len(eyes) else [])
+    ]
+    left = [c for c in candidates if c[0] < w / 2]
+    right = [c for c in candidates if c[0] >= w / 2]
+    if not left or not right:
+        return Detection(0.0, f"{len(candidates)} eye candidates, not one per side")
+    # Most confident eye on each side
+    left_eye = max(left, key=lambda c: c[2])
+    right_eye = max(right, key=lambda c: c[2])
+
+    dx, dy = right_eye[0] - left_eye[0], right_eye[1] - left_eye[1]
+    tilt = math.degrees(math.atan2(dy, dx))
+    spacing = math.hypot(dx, dy) / w
+    height = (left_eye[1] + right_eye[1]) / 2 / h
+    offset = abs((left_eye[0] + right_eye[0]) / 2 / w - 0.5)
+    confidence = (
+        _linear(face_weight, FACE_WEIGHT_FULL)
+        * _linear(min(left_eye[2], right_eye[2]), EYE_WEIGHT_FULL)
+        * _within(spacing, *EYE_SPACING_RANGE, slack=0.1)
+        * _within(height, *EYE_HEIGHT_RANGE, slack=0.1)
+        * max(0.0, 1.0 - offset / 0.15)
+        * max(0.0, 1.0 - abs(tilt) / MAX_TILT_DEGREES)
+    )
+    return Detection(
+        round(confidence, 3),
+        "frontal face",
+        ((x + left_eye[0]) / scale, (y + left_eye[1]) / scale),
+        ((x + right_eye[0]) / scale, (y + right_eye[1]) / scale)
+    )
+
+
+def place_glasses(image: Image.Image, overlay_path: str, detection: Detection) -> Image.Image:
+    """Rotate, scale and alpha-blend the overlay so its lens centers land on the eyes."""
+    overlay, lens_left, lens_right = _overlay(overlay_path)
+    (lx, ly), (rx, ry) = detection.left_eye, detection.right_eye
+    angle = math.atan2(ry - ly, rx - lx)
+    scale = math.hypot(rx - lx, ry - ly) / math.hypot(lens_right[0] - lens_left[0], lens_right[1] - lens_left[1])
+    eye_mid = ((lx + rx) / 2, (ly + ry) / 2)
+    lens_mid = ((lens_left[0] + lens_right[0]) / 2, (lens_left[1] + lens_right[1]) / 2)
+
+    # Only the region the overlay lands in is transformed and blended
+    cos, sin = math.cos(angle) * scale, math.sin(angle) * scale
+    corners = [
+        (eye_mid[0] + cos * (u - lens_mid[0]) - sin * (v - lens_mid[1]),
+         eye_mid[1] + sin * (u - lens_mid[0]) + cos * (v - lens_mid[1]))
+        for u in (0, overlay.width) for v in (0, overlay.height)
+    ]
+    x0 = max(0, math.floor(min(x for x, _ in corners)))
+    y0 = max(0, math.floor(min(y for _, y in corners)))
+    x1 = min(image.width, math.ceil(max(x for x, _ in corners)))
+    y1 = min(image.height, math.ceil(max(y for _, y in corners)))
+    if x1 <= x0 or y1 <= y0:
+        return image
+
+    # Affine map from region pixels back to overlay pixels: rotate by -angle, scale by 1/scale
+    a, b = math.cos(angle) / scale, math.sin(angle) / scale
+    d, e = -b, a
+    c = lens_mid[0] - (a * (eye_mid[0] - x0) + b * (eye_mid[1] - y0))
+    f = lens_mid[1] - (d * (eye_mid[0] - x0) + e * (eye_mid[1] - y0))
+    layer = overlay.transform((x1 - x0, y1 - y0), Image.AFFINE, (a, b, c, d, e, f), resample=Image.BICUBIC)
+    region = image.crop((x0, y0, x1, y1)).convert("RGBA")
+    region.alpha_composite(layer)
+    result = image.copy()
+    result.paste(region.convert("RGB"), (x0, y0))
+    return result
+
+
+def warm_up(overlay_paths: Tuple[str, ...]):
+    """Load the cascades and overlays in a pool process ahead of its first image."""
+    _cascades()
+    for path in overlay_paths:
+        _overlay(path)
+
+
+def composite_glasses(data: bytes, overlay_path: str, min_confidence: float, quality: int) -> Tuple[Optional[bytes], float, str]:
+    """
+    Put the glasses on the single frontal face in the image, entirely on the CPU.
+
+    Returns (JPEG bytes at the input's own dimensions, confidence, reason), with no
+    bytes when the detection is less confident than min_confidence, so the caller
+    falls back to the model. Runs in a worker process; arguments must pickle.
+    """
+    with Image.open(io.BytesIO(data)) as source:
+        # Same orientation the model path sees (normalize honors EXIF too)
+        image = ImageOps.exif_transpose(source).convert("RGB")
+    detection = detect_eyes(image)
+    if detection.confidence < min_confidence:
+        return None, detection.confidence, detection.reason
+    result = place_glasses(image, overlay_path, detection)
+    buffer = io.BytesIO()
+    result.save(buffer, "JPEG", quality=quality)
+    return buffer.getvalue(), detection.confidence, detection.reason
@@ -0,0 +1,159 @@
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Tuple
+
+from worker_pool import PoolSaturatedError
+
+
+class ClientQueueFullError(Exception):
+    """Raised when one client already has as many requests waiting as it may."""
+
+
+class FairQueue:
+    """
+    Weighted fair admission of requests from many clients to `capacity` slots.
+
+    While a slot is free and nobody waits, requests go straight through. Otherwise
+    they wait, and each freed slot goes to the waiting request with the smallest
+    virtual finish time (start-time fair queuing): a client's requests are spaced
+    1/weight apart in virtual time, so with N clients waiting each gets its weighted
+    share of the slots no matter how many requests it queued, and a newcomer is served
+    right after the requests already in service instead of behind a heavy client's
+    backlog.
+
+    Fail-fast requests (wait=False) are limited to `per_client_depth` waiting per
+    client (ClientQueueFullError) and `queue_depth` waiting in total. When the queue
+    is full, the newest request of the client with the most waiting is pushed out with
+    PoolSaturatedError to make room for a client with fewer, otherwise the newcomer
+    gets it. Requests with wait=True (jobs, batch items) are never rejected but still
+    take their fair turn. Must be used from a single event loop.
+    """
+
+    MAX_TRACKED_CLIENTS = 10000
+
+    def __init__(self, capacity: int, queue_depth: int, per_client_depth: int):
+        self.capacity = capacity
+        self.queue_depth = queue_depth
+        self.per_client_depth = per_client_depth
+        self.running = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.evicted = 0
+        self._virtual_time = 0.0
+        self._last_finish: Dict[str, float] = {}
+        # Per client, its waiting requests in arrival order: (finish tag, future, may be evicted)
+        self._waiting: Dict[str, Deque[Tuple[float, asyncio.Future, bool]]] = {}
+
+    def _tag(self, client: str, weight: float) -> float:
+        tag = max(self._virtual_time, self._last_finish.get(client, 0.0)) + 1.0 / weight
+        self._last_finish[client] = tag
+        return tag
+
+    def _make_room(self, client: str):
+        """Reject a fail-fast newcomer, or evict someone else's newest waiter for it."""
+        mine = len(self._waiting.get(client, ()))
+        if mine >= self.per_client_depth:
+            self.rejected += 1
+            raise ClientQueueFullError(f"{mine} requests from this client are already waiting")
+        if self.queued < self.queue_depth:
+            return
+        heaviest = max(
+            (c for c, waiting in self._waiting.items() if any(evictable for _, _, evictable in waiting)),
+            key=lambda c: len(self._waiting[c]),
+            default=None
+        )
+        if heaviest is None or len(self._waiting[heaviest]) <= mine + 1:
+            self.rejected += 1
+            raise PoolSaturatedError(f"Admission queue is full ({self.capacity} running, {self.queued} waiting)")
+        waiting = self._waiting[heaviest]
+        for i in range(len(waiting) - 1, -1, -1):
+            tag, future, evictable = waiting[i]
+            if evictable:
+                del waiting[i]
+                break
+        if not waiting:
+            del self._waiting[heaviest]
+        self.queued -= 1
+        self.evicted += 1
+        future.set_exception(PoolSaturatedError("Pushed out of the admission queue by other clients' requests"))
+
+    async def acquire(self, client: str, weight: float = 1.0, wait: bool = False):
+        """Take a slot for client, waiting for its fair turn; release() it when done."""
+        if self.running < self.capacity and not self.queued:
+            self._tag(client, weight)
+            self.running += 1
+            self.admitted += 1
+            return
+        if not wait:
+            self._make_room(client)
+        tag = self._tag(client, weight)
+        future = asyncio.get_running_loop().create_future()
+        self._waiting.setdefault(client, deque()).append((tag, future, not wait))
+        self.queued += 1
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted just as the caller went away: hand the slot on
+                self.release()
+            else:
+                self._forget(client, future)
+            raise
+        self.admitted += 1
+
+    def _forget(self, client: str, future: asyncio.Future):
+        waiting = self._waiting.get(client)
+        if not waiting:
+            return
+        for entry in waiting:
+            if entry[1] is future:
+                waiting.remove(entry)
+                self.queued -= 1
+                break
+        if not waiting:
+            del self._waiting[client]
+
+    def release(self):
+        self.running -= 1
+        while self.running < self.capacity and self.queued:
+            client = min(self._waiting, key=lambda c: self._waiting[c][0][0])
+            waiting = self._waiting[client]
+            tag, future, _ = waiting.popleft()
+            if not waiting:
+                del self._waiting[client]
+            self.queued -= 1
+            if future.done():
+                # Its caller was cancelled and hasn't run its cleanup yet
+                continue
+            self._virtual_time = max(self._virtual_time, tag)
+            self.running += 1
+            future.set_result(None)
+        # Tags at or behind the virtual time no longer matter, so the table doesn't grow forever
+        if not self.running and not self.queued:
+            self._last_finish.clear()
+            self._virtual_time = 0.0
+        elif len(self._last_finish) > self.MAX_TRACKED_CLIENTS:
+            self._last_finish = {c: t for c, t in self._last_finish.items() if t > self._virtual_time}
+
+    @asynccontextmanager
+    async def slot(self, client: str, weight: float = 1.0, wait: bool = False):
+        await self.acquire(client, weight, wait)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> dict:
+        return {
+            "capacity": self.capacity,
+            "queue_depth": self.queue_depth,
+            "per_client_depth": self.per_client_depth,
+            "running": self.running,
+            "queued": self.queued,
+            "waiting_clients": len(self._waiting),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "evicted": self.evicted
+        }
@@ -0,0 +1,216 @@
+import base64
+import io
+import math
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from typing import Optional, Tuple, Union
+
+import httpx
+from PIL import Image
+
+# What Replicate reports when its own infrastructure drops a prediction
+E6716_ERROR = "Director: unexpected error handling prediction (E6716)"
+
+
+class LatencyDistribution:
+    """
+    Model latency in seconds, parsed from a spec string:
+
+        fixed:8              always 8 s
+        uniform:5,12         uniformly between 5 and 12 s
+        normal:8,2           mean 8 s, standard deviation 2 s (clamped at 0)
+        lognormal:8,0.4      median 8 s, log-space sigma 0.4 (long right tail, like real models)
+    """
+
+    def __init__(self, spec: str):
+        kind, _, params = spec.partition(":")
+        values = [float(v) for v in params.split(",") if v]
+        expected = {"fixed": 1, "uniform": 2, "normal": 2, "lognormal": 2}
+        if kind not in expected or len(values) != expected[kind]:
+            raise ValueError(f"Invalid latency spec '{spec}' (e.g. fixed:8, uniform:5,12, normal:8,2, lognormal:8,0.4)")
+        self.spec = spec
+        self.kind = kind
+        self.values = values
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == "fixed":
+            return self.values[0]
+        if self.kind == "uniform":
+            return rng.uniform(*self.values)
+        if self.kind == "normal":
+            return max(0.0, rng.gauss(*self.values))
+        median, sigma = self.values
+        return rng.lognormvariate(math.log(median), sigma) if median > 0 else 0.0
+
+
+class FakeFile:
+    def __init__(self, size: int):
+        self.id = uuid.uuid4().hex
+        self.size = size
+        self.urls = {"get": f"https://api.replicate.com/v1/files/{self.id}"}
+        self.expires_at = (datetime.now(timezone.utc) + timedelta(days=1)).isoformat()
+
+
+class FakePrediction:
+    def __init__(
+        self,
+        status: str,
+        output: Optional[str] = None,
+        error: Optional[str] = None,
+        predict_time: float = 0.0,
+        id: Optional[str] = None,
+        client: Optional["FakeReplicateClient"] = None
+    ):
+        self.id = id or uuid.uuid4().hex
+        self.status = status
+        self.output = output
+        self.error = error
+        self.metrics = {"predict_time": predict_time}
+        self._client = client
+
+    def wait(self):
+        if self.status in ("starting", "processing"):
+            self._update(self._client.resolve(self.id, block=True))
+
+    def reload(self):
+        if self.status in ("starting", "processing"):
+            self._update(self._client.resolve(self.id))
+
+    def cancel(self):
+        if self.status in ("starting", "processing"):
+            self.status = "canceled"
+            self._client.canceled += 1
+
+    def _update(self, current: "FakePrediction"):
+        self.__dict__.update(status=current.status, output=current.output, error=current.error, metrics=current.metrics)
+
+
+class _Files:
+    def __init__(self, client: "FakeReplicateClient"):
+        self._client = client
+
+    def create(self, file, **params) -> FakeFile:
+        # Read the upload like the real client would, so upload cost stays in the measurements
+        return FakeFile(len(file.read()))
+
+
+class _Predictions:
+    def __init__(self, client: "FakeReplicateClient"):
+        self._client = client
+
+    def create(self, version=None, input=None, model=None, wait=True, **params) -> FakePrediction:
+        return self._client.predict(input or {}, wait=wait)
+
+    def get(self, id: str) -> FakePrediction:
+        return self._client.resolve(id)
+
+
+class _Models:
+    def __init__(self, client: "FakeReplicateClient"):
+        self.predictions = _Predictions(client)
+
+    def get(self, name: str):
+        # Community models are run by version; every fake model has the same one
+        return SimpleNamespace(latest_version=SimpleNamespace(id="fake"))
+
+
+class FakeReplicateClient:
+    """
+    Offline stand-in for replicate.Client running a fake google/nano-banana (every
+    model reference runs the same fake).
+
+    Implements the parts of the client the pipeline uses (files.create, models.get,
+    predictions.create, models.predictions.create, predictions.get), so everything
+    else (uploads, retries, output download, storage) runs the real code. Predictions
+    block for a latency drawn from `latency`, fail with E6716 with probability
+    e6716_rate or raise a read timeout with probability timeout_rate, and otherwise
+    return a noise JPEG of output_size (unique bytes per prediction) as a data URL.
+
+    Created with wait=False, a prediction returns at once as "starting" and finishes
+    in wait() or reload(); with wait=<seconds>, create blocks at most that long.
+
+    A prediction's id encodes when and how it finishes, so predictions.get() works in
+    another process too, like resuming a real prediction after a restart.
+    """
+
+    def __init__(
+        self,
+        latency: str = "lognormal:8,0.4",
+        e6716_rate: float = 0.0,
+        timeout_rate: float = 0.0,
+        output_size: Tuple[int, int] = (1024, 1024),
+        seed: Optional[int] = None
+    ):
+        self.latency = LatencyDistribution(latency)
+        self.e6716_rate = e6716_rate
+        self.timeout_rate = timeout_rate
+        self.files = _Files(self)
+        self.predictions = _Predictions(self)
+        self.models = _Models(self)
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self._output = _noise_jpeg(output_size, self._rng)
+        # Like replicate.Client: seconds between reloads while waiting for a prediction
+        self.poll_interval = 0.1
+        self.canceled = 0
+
+    def predict(self, input: dict, wait: Union[bool, int] = True) -> FakePrediction:
+        with self._rng_lock:
+            delay = self.latency.sample(self._rng)
+            roll = self._rng.random()
+            marker = self._rng.getrandbits(128).to_bytes(16, "big")
+        if roll < self.timeout_rate:
+            outcome = "timeout"
+        elif roll < self.timeout_rate + self.e6716_rate:
+            outcome = "failed"
+        else:
+            outcome = "succeeded"
+        # <marker>-<outcome>-<finish time in ms>-<latency in ms>
+        prediction_id = f"{marker.hex()}-{outcome}-{int((time.time() + delay) * 1000)}-{int(delay * 1000)}"
+        if not wait:
+            return FakePrediction("starting", id=prediction_id, client=self)
+        # "Prefer: wait=<seconds>" answers with the still running prediction after that long
+        if wait is not True and delay > wait:
+            time.sleep(wait)
+            return FakePrediction("processing", id=prediction_id, client=self)
+        return self.resolve(prediction_id, block=True)
+
+    def resolve(self, prediction_id: str, block: bool = False) -> FakePrediction:
+        """The prediction as it is now, or (with block) once it has finished."""
+        try:
+            marker_hex, outcome, finish_ms, delay_ms = prediction_id.split("-")
+            marker, finish_at, delay = bytes.fromhex(marker_hex), int(finish_ms) / 1000, int(delay_ms) / 1000
+        except ValueError:
+            raise ValueError(f"Unknown fake prediction id '{prediction_id}'")
+        remaining = finish_at - time.time()
+        if remaining > 0:
+            if not block:
+                return FakePrediction("processing", id=prediction_id, client=self)
+            time.sleep(remaining)
+        if outcome == "timeout":
+            raise httpx.ReadTimeout("Fake nano-banana prediction timed out")
+        if outcome == "failed":
+            return FakePrediction("failed", error=E6716_ERROR, predict_time=delay, id=prediction_id)
+        # A COM segment right after SOI makes every output unique without re-encoding
+        data = self._output[:2] + b"\xff\xfe\x00\x12" + marker + self._output[2:]
+        return FakePrediction(
+            "succeeded",
+            output="data:image/jpeg;base64," + base64.b64encode(data).decode(),
+            predict_time=delay,
+            id=prediction_id
+        )
+
+    def close(self):
+        pass
+
+
+def _noise_jpeg(size: Tuple[int, int], rng: random.Random) -> bytes:
+    # Noise compresses poorly, so the output is about as large as a detailed photo
+    image = Image.frombytes("RGB", size, rng.randbytes(size[0] * size[1] * 3))
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=90)
+    return buffer.getvalue()
@@ -0,0 +1,157 @@
+import hashlib
+import struct
+from typing import Optional, Tuple
+
+import httpx
+
+# Magic bytes of the formats nano-banana accepts
+IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+)
+
+CONTENT_TYPES = {"jpeg": "image/jpeg", "png": "image/png", "gif": "image/gif", "webp": "image/webp"}
+EXTENSIONS = {"jpeg": "jpg", "png": "png", "gif": "gif", "webp": "webp"}
+
+
+class ImageFetchError(Exception):
+    """The input image could not be fetched or is not an acceptable image."""
+
+
+class FetchedImage:
+    """An input image that has been downloaded, sniffed and sized exactly once."""
+
+    def __init__(self, url: str, data: bytes, format: str, width: int, height: int, sha256: Optional[str] = None):
+        self.url = url
+        self.data = data
+        self.format = format
+        self.width = width
+        self.height = height
+        # Uploads are hashed while they stream in; pass that hash to skip a second pass
+        self.sha256 = sha256 or hashlib.sha256(data).hexdigest()
+
+    @property
+    def content_type(self) -> str:
+        return CONTENT_TYPES[self.format]
+
+    @property
+    def filename(self) -> str:
+        return f"input.{EXTENSIONS[self.format]}"
+
+
+def fetch_image(http: httpx.Client, url: str, max_bytes: int, max_pixels: int, timeout: float) -> FetchedImage:
+    """
+    Download an input image with a single streaming GET.
+
+    Rejects the response as early as possible: on an error status, a non-image
+    Content-Type, a Content-Length over max_bytes, a body that grows past
+    max_bytes, unknown magic bytes, or header dimensions over max_pixels.
+    """
+    try:
+        with http.stream("GET", url, timeout=timeout) as response:
+            response.raise_for_status()
+
+            content_type = response.headers.get("content-type", "").split(";")[0].strip().lower()
+            # Some CDNs serve images as octet-stream; the magic bytes decide in that case
+            if content_type and not content_type.startswith("image/") and content_type != "application/octet-stream":
+                raise ImageFetchError(f"Image URL returned content type '{content_type}', not an image.")
+
+            content_length = response.headers.get("content-length")
+            if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+                raise ImageFetchError(f"Image is too large ({int(content_length)} bytes, limit is {max_bytes}).")
+
+            chunks = []
+            received = 0
+            for chunk in response.iter_bytes():
+                received += len(chunk)
+                if received > max_bytes:
+                    raise ImageFetchError(f"Image is too large (more than {max_bytes} bytes).")
+                chunks.append(chunk)
+    except httpx.HTTPError as e:
+        raise ImageFetchError(f"Cannot access image URL: {str(e)}. Please ensure the image URL is publicly accessible.")
+
+    return inspect_image(url, b"".join(chunks), max_pixels, "Image URL did not return a JPEG, PNG, GIF or WebP image.")
+
+
+def inspect_image(url: str, data: bytes, max_pixels: int, not_an_image: str, sha256: Optional[str] = None) -> FetchedImage:
+    """
+    Check received image bytes (magic bytes, header dimensions against max_pixels) and
+    wrap them in a FetchedImage. Raises ImageFetchError, with not_an_image as the
+    message for unknown formats.
+    """
+    image_format = sniff_format(data)
+    if image_format is None:
+        raise ImageFetchError(not_an_image)
+
+    size = read_dimensions(data, image_format)
+    if size is None:
+        raise ImageFetchError("Image header is corrupt or truncated.")
+    width, height = size
+    if width * height > max_pixels:
+        raise ImageFetchError(f"Image is too large ({width}x{height}, limit is {max_pixels} pixels).")
+
+    return FetchedImage(url, data, image_format, width, height, sha256)
+
+
+def sniff_format(data: bytes) -> Optional[str]:
+    """Identify the image format from its magic bytes."""
+    for signature, image_format in IMAGE_SIGNATURES:
+        if data.startswith(signature):
+            return image_format
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+def read_dimensions(data: bytes, image_format: str) -> Optional[Tuple[int, int]]:
+    """Read (width, height) from the image header without decoding pixels."""
+    try:
+        if image_format == "png":
+            return struct.unpack(">II", data[16:24])
+        if image_format == "gif":
+            return struct.unpack("<HH", data[6:10])
+        if image_format == "webp":
+            return _webp_dimensions(data)
+        if image_format == "jpeg":
+            return _jpeg_dimensions(data)
+    except struct.error:
+        return None
+    return None
+
+
+def _webp_dimensions(data: bytes) -> Optional[Tuple[int, int]]:
+    chunk = data[12:16]
+    if chunk == b"VP8 ":
+        width, height = struct.unpack("<HH", data[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b"VP8L":
+        bits = struct.unpack("<I", data[21:25])[0]
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b"VP8X":
+        width = int.from_bytes(data[24:27], "little") + 1
+        height = int.from_bytes(data[27:30], "little") + 1
+        return width, height
+    return None
+
+
+def _jpeg_dimensions(data: bytes) -> Optional[Tuple[int, int]]:
+    # Walk the marker segments until a start-of-frame (SOFn) marker, which holds the size
+    offset = 2
+    while offset + 4 <= len(data):
+        if data[offset] != 0xFF:
+            return None
+        marker = data[offset + 1]
+        if marker == 0xFF:
+            offset += 1
+            continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            offset += 2
+            continue
+        length = struct.unpack(">H", data[offset + 2:offset + 4])[0]
+        if marker in (0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF):
+            height, width = struct.unpack(">HH", data[offset + 5:offset + 9])
+            return width, height
+        offset += 2 + length
+    return None
@@ -0,0 +1,134 @@
+import os
+import threading
+import time
+from typing import Optional
+
+# Advisory file locks coordinate the worker processes of one server. The kernel drops
+# a dead process's locks, so a crashed worker can never leak a slot or the leadership.
+try:
+    import fcntl
+    FILE_LOCKS_AVAILABLE = True
+except ImportError:
+    FILE_LOCKS_AVAILABLE = False
+
+
+class SlotTimeoutError(Exception):
+    """Raised when no shared slot became free within the timeout."""
+
+
+class ProcessLock:
+    """
+    A lock file shared by the worker processes, held until release() or process exit.
+
+    try_acquire() doesn't block by default. A shared hold lets any number of processes in while
+    keeping exclusive acquisitions out, which tells a starting worker whether any
+    sibling is still running. Without fcntl (Windows) every acquisition succeeds,
+    which is right for the single process such platforms run.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.held = False
+        self._fd: Optional[int] = None
+
+    def try_acquire(self, shared: bool = False, wait: bool = False) -> bool:
+        """
+        Take (or convert the hold to) an exclusive or shared lock. Returns False if
+        another process prevents it, unless wait=True, which blocks until it doesn't.
+        """
+        if not FILE_LOCKS_AVAILABLE:
+            self.held = True
+            return True
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(self._fd, (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | (0 if wait else fcntl.LOCK_NB))
+        except BlockingIOError:
+            # A failed conversion may have dropped the previous hold as well
+            self.release()
+            return False
+        self.held = True
+        return True
+
+    def release(self):
+        self.held = False
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class ProcessSlots:
+    """
+    Counting semaphore shared by every process that uses the same directory.
+
+    Each of the `slots` slots is a lock file; holding its lock holds the slot. A
+    caller tries the slots in turn and sleeps `poll_interval` between rounds when all
+    are taken, so waiters are served roughly but not strictly in order. Slots are
+    acquired from worker threads, never from the event loop.
+    """
+
+    def __init__(self, directory: str, slots: int, poll_interval: float = 0.05):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.slots = slots
+        self.poll_interval = poll_interval
+        self.held = 0
+        self.acquired = 0
+        self.waited_seconds = 0.0
+        self._lock = threading.Lock()
+        # Without fcntl the limit still holds within this process
+        self._local = threading.BoundedSemaphore(slots) if not FILE_LOCKS_AVAILABLE else None
+
+    def _try_any(self) -> Optional[int]:
+        # Start at a per-process offset so workers don't all contend for slot 0. Every
+        # attempt opens the file anew, and flock locks belong to the open file, so two
+        # threads of one process exclude each other just like two processes do.
+        offset = os.getpid() % self.slots
+        for i in range(self.slots):
+            path = os.path.join(self.directory, f"slot-{(offset + i) % self.slots}.lock")
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except BlockingIOError:
+                os.close(fd)
+        return None
+
+    def acquire(self, timeout: float) -> Optional[int]:
+        """Block until a slot is free and return its handle for release(); SlotTimeoutError after `timeout` seconds."""
+        start = time.monotonic()
+        handle = None
+        if self._local is not None:
+            if not self._local.acquire(timeout=timeout):
+                raise SlotTimeoutError(f"All {self.slots} upstream slots stayed busy for {timeout:.0f}s")
+        else:
+            while handle is None:
+                handle = self._try_any()
+                if handle is None:
+                    if time.monotonic() - start >= timeout:
+                        raise SlotTimeoutError(f"All {self.slots} upstream slots stayed busy for {timeout:.0f}s")
+                    time.sleep(self.poll_interval)
+        with self._lock:
+            self.held += 1
+            self.acquired += 1
+            self.waited_seconds += time.monotonic() - start
+        return handle
+
+    def release(self, handle: Optional[int]):
+        # Closing the file drops its lock
+        if handle is None:
+            self._local.release()
+        else:
+            os.close(handle)
+        with self._lock:
+            self.held -= 1
+
+    def stats(self) -> dict:
+        """Slots held by this process; the limit applies to all processes together."""
+        with self._lock:
+            return {
+                "limit": self.slots,
+                "held_here": self.held,
+                "acquired": self.acquired,
+                "waited_seconds": round(self.waited_seconds, 3)
+            }
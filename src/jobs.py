@@ -0,0 +1,198 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Optional
+
+from pydantic import BaseModel
+
+# Job lifecycle: queued -> running -> succeeded | failed
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+TERMINAL_STATES = (JOB_SUCCEEDED, JOB_FAILED)
+
+
+class Job(BaseModel):
+    id: str
+    status: str = JOB_QUEUED
+    image_url: str
+    callback_url: Optional[str] = None
+    # Requested model; the model that produced the result once succeeded
+    model: Optional[str] = None
+    # Glasses template name; None uses the default one
+    template: Optional[str] = None
+    output_filename: Optional[str] = None
+    result_url: Optional[str] = None
+    error: Optional[str] = None
+    created_at: float
+    updated_at: float
+
+    @property
+    def finished(self) -> bool:
+        return self.status in TERMINAL_STATES
+
+
+class JobStore:
+    """
+    Base class for job state storage.
+
+    Subclasses implement _load/_save/_delete_finished_before; this class adds
+    change notification so SSE streams can wake up as soon as a job moves on.
+    Updates may come from worker threads, so waiters are woken through the loop.
+    """
+
+    def __init__(self):
+        self._waiters = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def create(
+        self,
+        image_url: str,
+        callback_url: Optional[str] = None,
+        model: Optional[str] = None,
+        template: Optional[str] = None
+    ) -> Job:
+        now = time.time()
+        job = Job(
+            id=uuid.uuid4().hex,
+            image_url=image_url,
+            callback_url=callback_url,
+            model=model,
+            template=template,
+            created_at=now,
+            updated_at=now
+        )
+        self._save(job)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._load(job_id)
+
+    def update(self, job_id: str, **fields) -> Job:
+        job = self._load(job_id)
+        if job is None:
+            raise KeyError(job_id)
+        job = job.model_copy(update={**fields, "updated_at": time.time()})
+        self._save(job)
+        self._notify(job_id)
+        return job
+
+    def prune(self, max_age: float):
+        """Forget finished jobs last updated more than max_age seconds ago."""
+        self._delete_finished_before(time.time() - max_age)
+
+    def subscribe(self, job_id: str) -> asyncio.Event:
+        """
+        Return an event that is set on the next update of job_id.
+
+        Subscribe before reading the job so an update landing in between is not missed.
+        """
+        self._loop = asyncio.get_running_loop()
+        return self._waiters.setdefault(job_id, asyncio.Event())
+
+    def _notify(self, job_id: str):
+        if self._loop is None or self._loop.is_closed():
+            return
+        self._loop.call_soon_threadsafe(self._wake, job_id)
+
+    def _wake(self, job_id: str):
+        event = self._waiters.pop(job_id, None)
+        if event:
+            event.set()
+
+    def _load(self, job_id: str) -> Optional[Job]:
+        raise NotImplementedError
+
+    def _save(self, job: Job):
+        raise NotImplementedError
+
+    def _delete_finished_before(self, cutoff: float):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class MemoryJobStore(JobStore):
+    """Keeps jobs in a dict. Fast, but everything is lost on restart."""
+
+    def __init__(self):
+        super().__init__()
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def _load(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _save(self, job: Job):
+        with self._lock:
+            self._jobs[job.id] = job
+
+    def _delete_finished_before(self, cutoff: float):
+        with self._lock:
+            for job_id in [j.id for j in self._jobs.values() if j.finished and j.updated_at < cutoff]:
+                del self._jobs[job_id]
+
+    def unfinished(self) -> list:
+        with self._lock:
+            return [j for j in self._jobs.values() if not j.finished]
+
+
+class SqliteJobStore(JobStore):
+    """Persists jobs in a SQLite file so their state survives restarts."""
+
+    def __init__(self, path: str):
+        super().__init__()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY, status TEXT NOT NULL, updated_at REAL NOT NULL, data TEXT NOT NULL)"
+        )
+        self._lock = threading.Lock()
+
+    def _load(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return Job(**json.loads(row[0])) if row else None
+
+    def _save(self, job: Job):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO jobs (id, status, updated_at, data) VALUES (?, ?, ?, ?)",
+                (job.id, job.status, job.updated_at, job.model_dump_json())
+            )
+
+    def _delete_finished_before(self, cutoff: float):
+        with self._lock:
+            self._conn.execute(
+                f"DELETE FROM jobs WHERE status IN ({','.join('?' * len(TERMINAL_STATES))}) AND updated_at < ?",
+                (*TERMINAL_STATES, cutoff)
+            )
+
+    def unfinished(self) -> list:
+        """Jobs that were queued or running when the previous process stopped."""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT data FROM jobs WHERE status NOT IN ({','.join('?' * len(TERMINAL_STATES))})",
+                TERMINAL_STATES
+            ).fetchall()
+        return [Job(**json.loads(row[0])) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def create_job_store(backend: str, sqlite_path: str) -> JobStore:
+    """Build the job store selected by the JOB_STORE setting ("memory" or "sqlite")."""
+    if backend == "memory":
+        return MemoryJobStore()
+    if backend == "sqlite":
+        return SqliteJobStore(sqlite_path)
+    raise ValueError(f"Unknown JOB_STORE backend: {backend!r} (expected 'memory' or 'sqlite')")
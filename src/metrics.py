@@ -0,0 +1,174 @@
+import asyncio
+import os
+import resource
+import time
+from contextlib import contextmanager
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+# Buckets span cache hits (milliseconds) to slow predictions (a minute or more)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 45, 60, 90, 120, 180)
+
+HTTP_REQUEST_DURATION = Histogram(
+    "glasses_http_request_duration_seconds",
+    "Time to produce an HTTP response (headers, for streaming responses)",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS
+)
+STAGE_DURATION = Histogram(
+    "glasses_stage_duration_seconds",
+    "Time spent in one stage of the generation pipeline",
+    ["stage"],
+    buckets=LATENCY_BUCKETS
+)
+PREDICTIONS = Counter("glasses_predictions_total", "Replicate predictions by model and final status", ["model", "status"])
+MODEL_ROUTED = Counter(
+    "glasses_model_routed_total",
+    "Prediction attempts by model and routing reason (explicit, primary, failover, latency, degraded)",
+    ["model", "reason"]
+)
+RETRIES = Counter("glasses_retries_total", "Prediction attempts that were retried, by error type", ["error"])
+ERRORS = Counter("glasses_errors_total", "Failed glasses requests by error type", ["error"])
+REJECTIONS = Counter("glasses_rejections_total", "Requests rejected with 429 or 503, by reason", ["reason"])
+CACHE_LOOKUPS = Counter("glasses_cache_lookups_total", "Result cache lookups", ["result"])
+COMPOSITOR = Counter(
+    "glasses_compositor_total",
+    "Local compositing attempts: used, fallback (not confident enough) or error",
+    ["result"]
+)
+COALESCED = Counter("glasses_coalesced_requests_total", "Requests that joined an identical in-flight request")
+RESUMED = Counter(
+    "glasses_predictions_resumed_total",
+    "Predictions of a previous process picked up after a restart: succeeded, failed or expired",
+    ["result"]
+)
+EVENT_LOOP_LAG = Histogram(
+    "glasses_event_loop_lag_seconds",
+    "How late the event loop woke up a periodic timer (time requests waited behind blocking work)",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+)
+OUTPUT_BYTES = Counter("glasses_output_bytes_total", "Bytes of generated images downloaded from Replicate")
+
+GENERATIONS_RUNNING = Gauge("glasses_generations_running", "Generations currently running on a worker")
+GENERATIONS_QUEUED = Gauge("glasses_generations_queued", "Generations waiting for a worker")
+JOBS_ACTIVE = Gauge("glasses_jobs_active", "Asynchronous jobs not yet finished")
+CIRCUIT_OPEN = Gauge("glasses_replicate_circuit_open", "1 while a model's circuit breaker is open or half-open", ["model"])
+STARTUP_DURATION = Gauge("glasses_startup_phase_seconds", "Time this process spent in each startup phase", ["phase"])
+READY = Gauge("glasses_ready", "1 once this process is warmed up and accepts generations")
+
+
+@contextmanager
+def stage(name: str):
+    """Time a block into glasses_stage_duration_seconds{stage=name}."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_DURATION.labels(name).observe(time.perf_counter() - start)
+
+
+def observe_stage(name: str, seconds: float):
+    STAGE_DURATION.labels(name).observe(seconds)
+
+
+def rss_bytes() -> int:
+    """Current resident set size of this process (peak RSS where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # ru_maxrss is in KiB on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if os.uname().sysname == "Darwin" else peak * 1024
+
+
+class StartupProfile:
+    """
+    How long each phase of starting this process took, from `began` (a perf_counter
+    reading taken before the heavy imports) until it was ready for traffic.
+    """
+
+    def __init__(self, began: float):
+        self.began = began
+        self.phases = {}
+        self.ready_after = None
+
+    def record(self, name: str, seconds: float):
+        self.phases[name] = seconds
+        STARTUP_DURATION.labels(name).set(seconds)
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def mark_ready(self):
+        self.ready_after = time.perf_counter() - self.began
+        self.record("total", self.ready_after)
+        READY.set(1)
+
+    def stats(self) -> dict:
+        return {
+            "phases_s": {name: round(seconds, 3) for name, seconds in self.phases.items()},
+            "ready_after_s": round(self.ready_after, 3) if self.ready_after is not None else None
+        }
+
+
+class LoopLagMonitor:
+    """
+    Measures event loop lag: sleeps `interval` seconds in a loop and records how much
+    later than requested it woke up. Sustained lag means something blocks the loop.
+    """
+
+    def __init__(self, interval: float = 0.25):
+        self.interval = interval
+        self.last = 0.0
+        self.max = 0.0
+
+    async def run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - start - self.interval)
+            self.last = lag
+            self.max = max(self.max, lag)
+            EVENT_LOOP_LAG.observe(lag)
+
+    def stats(self) -> dict:
+        return {"last_ms": round(self.last * 1000, 2), "max_ms": round(self.max * 1000, 2)}
+
+
+def render() -> bytes:
+    return generate_latest()
+
+
+class RequestMetricsMiddleware:
+    """
+    Pure ASGI middleware recording glasses_http_request_duration_seconds.
+
+    Requests are labelled with the route template (e.g. /jobs/{job_id}) or the mount
+    path (/output), never the raw path, to keep label cardinality bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+
+        async def send_with_metrics(message):
+            if message["type"] == "http.response.start":
+                route = scope.get("route")
+                label = route.path if route else (scope.get("root_path") or "unmatched")
+                HTTP_REQUEST_DURATION.labels(scope["method"], label, str(message["status"])).observe(
+                    time.perf_counter() - start
+                )
+            await send(message)
+
+        await self.app(scope, receive, send_with_metrics)
@@ -0,0 +1,250 @@
+import json
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+from resilience import CIRCUIT_CLOSED, CircuitBreaker
+
+# Routing policies: "failover" sticks to the first candidate while it is healthy,
+# "latency" always takes the best-scoring healthy candidate
+ROUTING_FAILOVER = "failover"
+ROUTING_LATENCY = "latency"
+# Name reported as the "model" of results composited locally (see compositor.py)
+COMPOSITOR_MODEL = "local-compositor"
+
+
+class ModelInput:
+    """
+    A backend's prediction input with everything but the two images filled in, and
+    what identifies it in the result cache; built once by ModelBackend.compile().
+    """
+
+    def __init__(self, params: Dict[str, Any], cache_part: str, output_format: str):
+        self.params = params
+        self.cache_part = cache_part
+        # What the model returns; anything but "jpg" is re-encoded before it is stored
+        self.output_format = output_format
+
+
+class ModelBackend:
+    """
+    Adapter for one Replicate model that can put glasses on a photo.
+
+    Declares how the two images are passed (one list field such as nano-banana's
+    `image_input`, or one field per image such as image-mixer's `image1`/`image2`)
+    and in which order, the prompt field, fixed parameters, and what a run is
+    expected to cost and take before any latency has been observed.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        model: str,
+        images: Union[str, Sequence[str]],
+        image_order: Tuple[str, str] = ("image", "overlay"),
+        prompt: Optional[str] = None,
+        prompt_field: str = "prompt",
+        params: Optional[Dict[str, Any]] = None,
+        output_format: str = "jpg",
+        output_prefix: Optional[str] = None,
+        official: bool = True,
+        cost_per_run: float = 0.0,
+        expected_latency: float = 10.0,
+        description: str = ""
+    ):
+        self.name = name
+        self.model = model
+        self.images = images
+        self.image_order = image_order
+        self.prompt = prompt
+        self.prompt_field = prompt_field
+        self.params = params or {}
+        self.output_format = output_format
+        self.output_prefix = output_prefix or name.replace("-", "_") + "_glasses"
+        self.official = official
+        self.cost_per_run = cost_per_run
+        self.expected_latency = expected_latency
+        self.description = description
+        self._resolved_model = None
+
+    def compile(self, prompt: Optional[str] = None, output_format: Optional[str] = None) -> ModelInput:
+        """
+        The input for a template's prompt and output format (None keeps this backend's
+        own). Models without a prompt ignore the prompt, and only models that take an
+        `output_format` parameter honor the output format.
+        """
+        params = dict(self.params)
+        if output_format and "output_format" in params:
+            params["output_format"] = output_format
+        if self.prompt is not None:
+            prompt = prompt or self.prompt
+            params[self.prompt_field] = prompt
+        else:
+            prompt = None
+        # The prompt identifies the input (the parameters do for prompt-less models), so
+        # results cached before templates existed keep their keys
+        fixed = {key: value for key, value in params.items() if key != self.prompt_field or self.prompt is None}
+        cache_part = prompt or json.dumps(fixed, sort_keys=True)
+        if prompt and fixed != self.params:
+            cache_part += "\n" + json.dumps(fixed, sort_keys=True)
+        return ModelInput(params, cache_part, params.get("output_format", self.output_format))
+
+    def build_input(self, image_input: Any, overlay_input: Any, compiled: Optional[ModelInput] = None) -> dict:
+        """The prediction input for a base photo and the glasses overlay."""
+        by_role = {"image": image_input, "overlay": overlay_input}
+        ordered = [by_role[role] for role in self.image_order]
+        input = dict((compiled or self.compile()).params)
+        if isinstance(self.images, str):
+            input[self.images] = ordered
+        else:
+            input.update(zip(self.images, ordered))
+        return input
+
+    def model_ref(self, client) -> str:
+        """
+        Model reference for run_prediction. Official models run by name; community
+        models need a version, so the latest one is looked up once and pinned.
+        """
+        if self.official or ":" in self.model:
+            return self.model
+        if self._resolved_model is None:
+            version = client.models.get(self.model).latest_version.id
+            self._resolved_model = f"{self.model}:{version}"
+        return self._resolved_model
+
+    @staticmethod
+    def first_output(output: Any) -> Any:
+        """Models that can return several samples return a list; only the first is used."""
+        if isinstance(output, (list, tuple)):
+            return output[0] if output else None
+        return output
+
+
+class _BackendHealth:
+    """Outcomes of recent runs of one backend, bounded by count and age."""
+
+    def __init__(self, window: int):
+        self.outcomes = deque(maxlen=window)
+
+    def record(self, seconds: Optional[float], ok: bool):
+        self.outcomes.append((time.monotonic(), seconds, ok))
+
+    def recent(self, max_age: float) -> List[tuple]:
+        cutoff = time.monotonic() - max_age
+        return [outcome for outcome in self.outcomes if outcome[0] >= cutoff]
+
+
+class ModelRouter:
+    """
+    Picks the backend for each prediction attempt.
+
+    Every backend has its own circuit breaker and a window of recent outcomes
+    (at most `window` runs, none older than `max_age` seconds). A backend is
+    degraded while its circuit is not closed, or once it has `min_samples` recent
+    runs and their error rate reaches `degraded_error_rate` or their p95 latency
+    reaches `degraded_p95`. Healthy backends are ranked by
+
+        p95 latency * (1 + error_penalty * error rate) + cost_weight * cost per run
+
+    using the declared expected latency until enough runs were observed. With the
+    "failover" policy the first candidate is used whenever it is healthy; with
+    "latency" the best-ranked healthy candidate always is. If every candidate is
+    degraded the best-ranked one is tried anyway (its breaker may reject it).
+    """
+
+    def __init__(
+        self,
+        backends: List[ModelBackend],
+        candidates: List[str],
+        policy: str = ROUTING_FAILOVER,
+        breaker_threshold: int = 5,
+        breaker_reset: float = 30,
+        window: int = 50,
+        max_age: float = 600,
+        min_samples: int = 5,
+        degraded_error_rate: float = 0.5,
+        degraded_p95: float = 120,
+        error_penalty: float = 4.0,
+        cost_weight: float = 100.0
+    ):
+        self.backends = {backend.name: backend for backend in backends}
+        unknown = [name for name in candidates if name not in self.backends]
+        if unknown or not candidates:
+            raise ValueError(f"Unknown routing candidates {unknown}; known models are {list(self.backends)}")
+        if policy not in (ROUTING_FAILOVER, ROUTING_LATENCY):
+            raise ValueError(f"Unknown routing policy '{policy}'")
+        self.candidates = candidates
+        self.policy = policy
+        self.max_age = max_age
+        self.min_samples = min_samples
+        self.degraded_error_rate = degraded_error_rate
+        self.degraded_p95 = degraded_p95
+        self.error_penalty = error_penalty
+        self.cost_weight = cost_weight
+        self.breakers = {name: CircuitBreaker(breaker_threshold, breaker_reset) for name in self.backends}
+        self._health = {name: _BackendHealth(window) for name in self.backends}
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> ModelBackend:
+        """The backend registered as name; raises KeyError for unknown names."""
+        return self.backends[name]
+
+    def record(self, name: str, seconds: Optional[float], ok: bool):
+        """Report a finished run: its model latency if it succeeded, ok=False for an upstream failure."""
+        with self._lock:
+            self._health[name].record(seconds, ok)
+
+    def _observed(self, name: str) -> Tuple[float, float, int]:
+        """(p95 latency, error rate, samples) over the recent window."""
+        with self._lock:
+            recent = self._health[name].recent(self.max_age)
+        latencies = sorted(seconds for _, seconds, ok in recent if ok and seconds is not None)
+        errors = sum(1 for _, _, ok in recent if not ok)
+        error_rate = errors / len(recent) if recent else 0.0
+        if len(latencies) >= self.min_samples:
+            p95 = latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))]
+        else:
+            p95 = self.backends[name].expected_latency
+        return p95, error_rate, len(recent)
+
+    def is_degraded(self, name: str) -> bool:
+        if self.breakers[name].state != CIRCUIT_CLOSED:
+            return True
+        p95, error_rate, samples = self._observed(name)
+        if samples < self.min_samples:
+            return False
+        return error_rate >= self.degraded_error_rate or p95 >= self.degraded_p95
+
+    def score(self, name: str) -> float:
+        """Lower is better."""
+        p95, error_rate, _ = self._observed(name)
+        return p95 * (1 + self.error_penalty * error_rate) + self.cost_weight * self.backends[name].cost_per_run
+
+    def choose(self) -> Tuple[ModelBackend, str]:
+        """(backend, reason) for the next attempt; reason is "primary", "latency", "failover" or "degraded"."""
+        healthy = [name for name in self.candidates if not self.is_degraded(name)]
+        primary = self.candidates[0]
+        if self.policy == ROUTING_FAILOVER and primary in healthy:
+            return self.backends[primary], "primary"
+        if healthy:
+            best = min(healthy, key=self.score)
+            reason = "latency" if self.policy == ROUTING_LATENCY else "failover"
+            return self.backends[best], reason
+        return self.backends[min(self.candidates, key=self.score)], "degraded"
+
+    def stats(self) -> dict:
+        models = {}
+        for name, backend in self.backends.items():
+            p95, error_rate, samples = self._observed(name)
+            models[name] = {
+                "model": backend.model,
+                "candidate": name in self.candidates,
+                "degraded": self.is_degraded(name),
+                "p95_seconds": round(p95, 3),
+                "error_rate": round(error_rate, 3),
+                "samples": samples,
+                "cost_per_run": backend.cost_per_run,
+                "circuit": self.breakers[name].stats()
+            }
+        return {"policy": self.policy, "candidates": self.candidates, "models": models}
@@ -0,0 +1,79 @@
+import io
+from typing import Optional, Tuple
+
+from PIL import Image, ImageOps
+
+from image_fetch import FetchedImage
+
+PIL_FORMATS = {"jpeg": "JPEG", "webp": "WEBP"}
+
+
+def normalize_image(image: FetchedImage, max_edge: int, output_format: str, quality: int) -> Tuple[FetchedImage, Tuple[int, int]]:
+    """
+    Prepare an input image for the model.
+
+    Applies the EXIF orientation, downscales so the longest edge is at most max_edge,
+    flattens transparency onto white and re-encodes as output_format ("jpeg" or
+    "webp") without any metadata.
+
+    Returns:
+        (normalized image, original size as displayed) - the output is restored to
+        the second value so the original dimensions are kept
+    """
+    with Image.open(io.BytesIO(image.data)) as source:
+        source.seek(0)  # first frame of animated GIF/WebP
+        width, height = source.size
+        # Orientations 5-8 rotate by 90/270 degrees and swap width and height
+        if source.getexif().get(0x0112, 1) in (5, 6, 7, 8):
+            width, height = height, width
+        target_size = (width, height)
+        if source.format == "JPEG":
+            # Let libjpeg decode at a reduced scale instead of decoding all 12 megapixels
+            source.draft("RGB", (max_edge, max_edge))
+        oriented = ImageOps.exif_transpose(source)
+        if max(oriented.size) > max_edge:
+            oriented.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        normalized = _flatten(oriented)
+
+        buffer = io.BytesIO()
+        # No exif=/icc_profile= arguments: the re-encoded file carries no metadata
+        normalized.save(buffer, PIL_FORMATS[output_format], quality=quality, optimize=True)
+
+    normalized_image = FetchedImage(image.url, buffer.getvalue(), output_format, normalized.width, normalized.height)
+    return normalized_image, target_size
+
+
+def restore_size(data: bytes, size: Tuple[int, int], quality: int) -> bytes:
+    """Resize a generated JPEG back to the original input dimensions (prompt rule 1)."""
+    with Image.open(io.BytesIO(data)) as output:
+        if output.size == size:
+            return data
+        resized = _flatten(output).resize(size, Image.LANCZOS)
+    buffer = io.BytesIO()
+    resized.save(buffer, "JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def restore_size_file(path: str, size: Optional[Tuple[int, int]], quality: int) -> bool:
+    """
+    Like restore_size, but rewrites the image at path in place. Outputs of models that
+    don't produce JPEG are converted too; size=None only converts. Returns True if the
+    file was rewritten.
+    """
+    with Image.open(path) as output:
+        if (size is None or output.size == size) and output.format == "JPEG":
+            return False
+        restored = _flatten(output)
+        if size is not None and restored.size != size:
+            restored = restored.resize(size, Image.LANCZOS)
+    restored.save(path, "JPEG", quality=quality)
+    return True
+
+
+def _flatten(image: Image.Image) -> Image.Image:
+    if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+        rgba = image.convert("RGBA")
+        background = Image.new("RGB", rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.getchannel("A"))
+        return background
+    return image.convert("RGB")
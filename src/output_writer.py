@@ -0,0 +1,96 @@
+import glob
+import hashlib
+import os
+import tempfile
+
+# Partial files live next to their final path (same filesystem, so the rename is atomic)
+TEMP_PREFIX = ".partial-"
+
+
+class AtomicOutputFile:
+    """
+    Streams a generated image to a temporary file and publishes it atomically.
+
+    Chunks are written to a hidden temp file in the output directory. publish()
+    fsyncs it and renames it to a content-addressed name, so a reader (or
+    StaticFiles) either sees the complete file or nothing - never a truncated one -
+    and two concurrent requests can't overwrite each other's results. If the block
+    exits without publish(), the temp file is removed.
+
+        with AtomicOutputFile(output_dir, "nano_banana_glasses", ".jpg") as out:
+            for chunk in output:
+                out.write(chunk)
+            output_filename = out.publish()
+    """
+
+    def __init__(self, output_dir: str, prefix: str, suffix: str):
+        self.output_dir = output_dir
+        self.prefix = prefix
+        self.suffix = suffix
+        self.bytes_written = 0
+        fd, self.temp_path = tempfile.mkstemp(dir=output_dir, prefix=TEMP_PREFIX, suffix=suffix)
+        self._file = os.fdopen(fd, "wb")
+        self._published = False
+
+    def write(self, chunk: bytes):
+        self._file.write(chunk)
+        self.bytes_written += len(chunk)
+
+    def close_temp(self) -> str:
+        """Finish writing and return the temp path, e.g. to post-process it in place."""
+        if not self._file.closed:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+        return self.temp_path
+
+    def publish(self) -> str:
+        """Atomically move the finished file to its final name and return that name."""
+        self.close_temp()
+        digest = hashlib.sha256()
+        with open(self.temp_path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        filename = f"{self.prefix}_{digest.hexdigest()[:32]}{self.suffix}"
+        # mkstemp creates 0600 files; published results must be readable like any static file
+        os.chmod(self.temp_path, 0o644)
+        os.replace(self.temp_path, os.path.join(self.output_dir, filename))
+        _fsync_dir(self.output_dir)
+        self._published = True
+        return filename
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self._file.closed:
+            self._file.close()
+        if not self._published and os.path.exists(self.temp_path):
+            os.unlink(self.temp_path)
+        return False
+
+
+def cleanup_partial_files(output_dir: str) -> int:
+    """Delete partial files left behind by a crash. Only call when no writes are in flight."""
+    removed = 0
+    for path in glob.glob(os.path.join(output_dir, TEMP_PREFIX + "*")):
+        try:
+            os.unlink(path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
+
+
+def _fsync_dir(path: str):
+    # Persist the rename itself; not supported on every platform, so best effort
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
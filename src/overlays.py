@@ -0,0 +1,124 @@
+import hashlib
+import io
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# How long a hosted URL is reused when Replicate doesn't say when it expires (its
+# files last 24h by default), regardless of the refresh margin
+ASSUMED_URL_TTL = 3600
+
+
+class OverlayAsset:
+    """
+    A glasses overlay image, read once and uploaded to Replicate once.
+
+    The bytes and their hash stay in memory; load() re-reads the file only when its
+    size or mtime changed, and is called when the template registry polls for
+    changes, not per request. The hosted Replicate file URL is reused for every
+    prediction until it is about to expire, the file content changes or a prediction
+    fails to fetch it (see forget_url).
+    """
+
+    def __init__(self, path: str, refresh_margin: float):
+        self.path = path
+        self.refresh_margin = refresh_margin
+        self.data: bytes = None
+        self.sha256: str = None
+        self._stat = None
+        self._url: Optional[str] = None
+        self._url_sha256: Optional[str] = None
+        self._url_refresh_at = 0.0
+        self._lock = threading.Lock()
+
+    def load(self):
+        """(Re)read the file if it changed on disk since the last load."""
+        if not os.path.exists(self.path):
+            raise Exception(f"Glasses file not found at: {self.path}")
+        stat = os.stat(self.path)
+        signature = (stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            if signature == self._stat:
+                return
+            with open(self.path, "rb") as f:
+                self.data = f.read()
+            self.sha256 = hashlib.sha256(self.data).hexdigest()
+            self._stat = signature
+
+    def hosted_url(self, replicate_client) -> str:
+        """Return a Replicate file URL for this overlay, uploading it if needed."""
+        if self.data is None:
+            self.load()
+        with self._lock:
+            if self._url and self._url_sha256 == self.sha256 and time.time() < self._url_refresh_at:
+                return self._url
+
+            logger.info("Uploading overlay to Replicate", extra={"overlay_path": self.path})
+            uploaded = replicate_client.files.create(
+                io.BytesIO(self.data),
+                filename=os.path.basename(self.path),
+                content_type="image/png"
+            )
+            self._url = uploaded.urls["get"]
+            self._url_sha256 = self.sha256
+            expires_at = _parse_timestamp(getattr(uploaded, "expires_at", None))
+            if expires_at is None:
+                self._url_refresh_at = time.time() + ASSUMED_URL_TTL
+            else:
+                self._url_refresh_at = expires_at - self.refresh_margin
+            logger.info("Overlay uploaded", extra={"overlay_path": self.path})
+            return self._url
+
+    def forget_url(self, error: Exception) -> bool:
+        """
+        If error says Replicate couldn't use the hosted URL (it names the URL or its
+        file id), forget the URL so the next hosted_url() uploads the overlay again.
+        Returns whether it did.
+        """
+        with self._lock:
+            if not self._url:
+                return False
+            message = str(error)
+            if self._url not in message and self._url.rstrip("/").rsplit("/", 1)[-1] not in message:
+                return False
+            self._url = None
+            return True
+
+    def file_object(self) -> io.BytesIO:
+        """In-memory copy of the overlay, for when it can't be passed by URL."""
+        if self.data is None:
+            self.load()
+        return io.BytesIO(self.data)
+
+
+class OverlayRegistry:
+    """One OverlayAsset per overlay path, so every variant is read and uploaded once."""
+
+    def __init__(self, refresh_margin: float):
+        self.refresh_margin = refresh_margin
+        self._assets = {}
+        self._lock = threading.Lock()
+
+    def get(self, path: str) -> OverlayAsset:
+        path = os.path.abspath(path)
+        with self._lock:
+            asset = self._assets.get(path)
+            if asset is None:
+                asset = self._assets[path] = OverlayAsset(path, self.refresh_margin)
+        asset.load()
+        return asset
+
+
+def _parse_timestamp(value: Optional[str]) -> Optional[float]:
+    """Epoch seconds of an ISO 8601 timestamp; None if it is missing or unreadable."""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return None
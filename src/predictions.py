@@ -0,0 +1,93 @@
+import logging
+import time
+from typing import TYPE_CHECKING, Any, Callable, Dict, Optional, Tuple
+
+import httpx
+
+# replicate is imported on first use (see SharedClients), not when this module is
+if TYPE_CHECKING:
+    import replicate
+    from replicate.prediction import Prediction
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = ("succeeded", "failed", "canceled")
+# Longest "Prefer: wait" Replicate accepts, in seconds
+MAX_PREFER_WAIT = 60
+
+
+class PredictionTimeoutError(httpx.TimeoutException):
+    """
+    The deadline passed before the prediction finished; it was canceled. A timeout
+    like any other, so retries, circuit breakers and routing count it.
+    """
+
+    def __init__(self, prediction_id: str):
+        super().__init__(f"Prediction {prediction_id} did not finish before the deadline and was canceled")
+        self.prediction_id = prediction_id
+
+
+def run_prediction(
+    client: "replicate.Client",
+    model: str,
+    input: Dict[str, Any],
+    on_created: Optional[Callable[["Prediction"], None]] = None,
+    deadline: Optional[float] = None
+) -> Tuple[Any, "Prediction"]:
+    """
+    Like client.run() for a model with a single (non-streaming) output, but also
+    returns the Prediction so callers can read its id, status and metrics.
+
+    model is "owner/name" (latest version) or "owner/name:version". With on_created,
+    the prediction is created without waiting for it ("Prefer: wait" would hold its id
+    back until it finishes), on_created is called with it and it is then polled every
+    client.poll_interval seconds. A prediction still running at `deadline` (a
+    time.monotonic() value) is canceled with PredictionTimeoutError.
+    """
+    name, _, version = model.partition(":")
+    wait = on_created is None
+    if wait and deadline is not None:
+        # The server holds the request at most this long, so it can't outlast the deadline
+        wait = max(1, min(MAX_PREFER_WAIT, int(deadline - time.monotonic())))
+    if version:
+        prediction = client.predictions.create(version=version, input=input, wait=wait)
+    else:
+        prediction = client.models.predictions.create(model=name, input=input, wait=wait)
+    if on_created:
+        on_created(prediction)
+    return finish_prediction(client, prediction, deadline)
+
+
+def resume_prediction(client: "replicate.Client", prediction_id: str, deadline: Optional[float] = None) -> Tuple[Any, "Prediction"]:
+    """Wait for a prediction created earlier (possibly by another process) and return it like run_prediction."""
+    return finish_prediction(client, client.predictions.get(prediction_id), deadline)
+
+
+def finish_prediction(client: "replicate.Client", prediction: "Prediction", deadline: Optional[float] = None) -> Tuple[Any, "Prediction"]:
+    from replicate.exceptions import ModelError
+    from replicate.helpers import transform_output
+
+    # "Prefer: wait" returns early for long predictions; poll until it finishes
+    while prediction.status not in TERMINAL_STATUSES:
+        remaining = deadline - time.monotonic() if deadline is not None else client.poll_interval
+        if remaining <= 0:
+            cancel_prediction(prediction)
+            raise PredictionTimeoutError(prediction.id)
+        time.sleep(min(client.poll_interval, remaining))
+        prediction.reload()
+    if prediction.status == "failed":
+        raise ModelError(prediction)
+    return transform_output(prediction.output, client), prediction
+
+
+def cancel_prediction(prediction: "Prediction"):
+    """Stop a prediction nobody will wait for anymore, so it stops running (and costing). Never raises."""
+    try:
+        prediction.cancel()
+    except Exception as e:
+        logger.warning("Could not cancel prediction %s: %s", prediction.id, e)
+
+
+def predict_seconds(prediction: "Prediction") -> float:
+    """Time the model itself spent running, as reported by Replicate (0 if unknown)."""
+    return float((prediction.metrics or {}).get("predict_time") or 0)
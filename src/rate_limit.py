@@ -0,0 +1,185 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Mapping, Optional, Tuple
+
+
+def client_id(
+    headers: Mapping[str, str], peer: Optional[str], trust_forwarded: bool, weights: Optional[Mapping[str, float]] = None
+) -> str:
+    """
+    Who a request is accounted to: its API key (X-API-Key or a bearer token, hashed so
+    it never shows up in logs), else its IP address. Behind a proxy that sets
+    X-Forwarded-For (Railway does), pass trust_forwarded=True to use the original
+    client's address instead of the proxy's.
+
+    The browser Origin never identifies a client on its own, since every visitor of a
+    frontend sends the same one. Only an Origin with an entry in `weights` is kept, as
+    "origin:<origin>|ip:<address>", so that address gets the origin's weight.
+    """
+    key = headers.get("x-api-key")
+    authorization = headers.get("authorization", "")
+    if not key and authorization.lower().startswith("bearer "):
+        key = authorization[7:].strip()
+    if key:
+        return "key:" + hashlib.sha256(key.encode()).hexdigest()[:16]
+    if trust_forwarded and headers.get("x-forwarded-for"):
+        peer = headers["x-forwarded-for"].split(",")[0].strip()
+    address = "ip:" + (peer or "unknown")
+    origin = "origin:" + headers.get("origin", "").lower()
+    if weights and origin in weights:
+        return origin + "|" + address
+    return address
+
+
+def client_weight(weights: Mapping[str, float], client: str) -> float:
+    """The weight of a client id, or of the Origin it was sent from; 1 if neither has one."""
+    if client in weights:
+        return weights[client]
+    origin, separator, _ = client.partition("|")
+    return weights.get(origin, 1.0) if separator else 1.0
+
+
+def parse_weights(spec: str) -> Dict[str, float]:
+    """Parse "key:ab12=4,origin:https://app.example.com=2" into {client id: weight}."""
+    weights = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        client, _, weight = item.rpartition("=")
+        if not client or float(weight) <= 0:
+            raise ValueError(f"Invalid client weight '{item}' (expected <client id>=<positive number>)")
+        weights[client] = float(weight)
+    return weights
+
+
+class RateLimiter:
+    """
+    Token bucket per client, kept in memory (so per process).
+
+    A client's bucket refills at rate * weight tokens per second up to burst * weight.
+    A request is admitted while the bucket is not empty and takes `cost` tokens, which
+    may drive it negative: a large batch is admitted at once and then pays it off, so
+    the client waits correspondingly longer for its next request. At most max_clients
+    buckets are kept; the least recently seen one is dropped first (a dropped bucket
+    was almost always full again anyway).
+    """
+
+    def __init__(self, rate: float, burst: float, weights: Optional[Dict[str, float]] = None, max_clients: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.weights = weights or {}
+        self.max_clients = max_clients
+        self.admitted = 0
+        self.limited = 0
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def weight(self, client: str) -> float:
+        return client_weight(self.weights, client)
+
+    def _take(self, tokens: float, updated: float, now: float, client: str, cost: float) -> Tuple[float, float]:
+        """(new token count, seconds to wait; 0 if admitted) for a bucket last seen at `updated`."""
+        weight = self.weight(client)
+        rate, burst = self.rate * weight, self.burst * weight
+        tokens = min(burst, tokens + (now - updated) * rate)
+        if tokens > 0:
+            return tokens - cost, 0.0
+        # Time until the bucket is positive again
+        return tokens, (-tokens) / rate + 1e-3
+
+    def check(self, client: str, cost: float = 1.0) -> float:
+        """Admit a request costing `cost` tokens: returns 0, or the seconds to wait before retrying."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(client, (self.burst * self.weight(client), now))
+            tokens, retry_after = self._take(tokens, updated, now, client, cost)
+            self._buckets[client] = (tokens, now)
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+            if retry_after:
+                self.limited += 1
+            else:
+                self.admitted += 1
+        return retry_after
+
+    def stats(self) -> dict:
+        return {
+            "backend": "memory",
+            "rate_per_second": self.rate,
+            "burst": self.burst,
+            "clients": len(self._buckets),
+            "admitted": self.admitted,
+            "limited": self.limited
+        }
+
+    def close(self):
+        pass
+
+
+class SqliteRateLimiter(RateLimiter):
+    """
+    The same token buckets in a SQLite file, shared by every worker process (and any
+    other server on the host) that points at it. Each check is one short write
+    transaction; buckets idle long enough to be full again are pruned.
+    """
+
+    PRUNE_EVERY = 1000
+
+    def __init__(self, path: str, rate: float, burst: float, weights: Optional[Dict[str, float]] = None):
+        super().__init__(rate, burst, weights)
+        self._checks = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets (client TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+        )
+
+    def check(self, client: str, cost: float = 1.0) -> float:
+        # Wall clock, since the buckets are shared between processes
+        now = time.time()
+        with self._lock:
+            # IMMEDIATE takes the write lock up front, so two processes never read the same count
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT tokens, updated FROM buckets WHERE client = ?", (client,)).fetchone()
+                tokens, updated = row if row else (self.burst * self.weight(client), now)
+                tokens, retry_after = self._take(tokens, updated, now, client, cost)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO buckets (client, tokens, updated) VALUES (?, ?, ?)", (client, tokens, now)
+                )
+                self._checks += 1
+                if self._checks % self.PRUNE_EVERY == 0:
+                    # A bucket refills completely within burst / rate seconds
+                    self._conn.execute(
+                        "DELETE FROM buckets WHERE updated < ?",
+                        (now - self.burst * max([1.0, *self.weights.values()]) / self.rate,)
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            if retry_after:
+                self.limited += 1
+            else:
+                self.admitted += 1
+        return retry_after
+
+    def stats(self) -> dict:
+        with self._lock:
+            clients = self._conn.execute("SELECT COUNT(*) FROM buckets").fetchone()[0]
+        return {**super().stats(), "backend": "sqlite", "clients": clients}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def create_rate_limiter(backend: str, sqlite_path: str, rate: float, burst: float, weights: Dict[str, float]) -> RateLimiter:
+    """Build the limiter selected by the RATE_LIMIT_BACKEND setting ("memory" or "sqlite")."""
+    if backend == "memory":
+        return RateLimiter(rate, burst, weights)
+    if backend == "sqlite":
+        return SqliteRateLimiter(sqlite_path, rate, burst, weights)
+    raise ValueError(f"Unknown RATE_LIMIT_BACKEND: {backend!r} (expected 'memory' or 'sqlite')")
+
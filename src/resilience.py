@@ -0,0 +1,207 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from typing import Awaitable, Callable, Optional, TypeVar
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Error codes Replicate puts in a failed prediction when its own infrastructure (not the
+# model input) failed, e.g. "Director: unexpected error handling prediction (E6716)"
+TRANSIENT_PREDICTION_ERRORS = ("E6716", "Director")
+
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """The upstream is considered unhealthy; the call was rejected without being made."""
+
+    def __init__(self, retry_after: float):
+        self.retry_after = retry_after
+        super().__init__(f"Replicate is currently failing; not sending new predictions for {retry_after:.0f}s")
+
+
+class RetriesExhaustedError(Exception):
+    """A retryable error persisted until the attempt budget or the deadline ran out."""
+
+    def __init__(self, attempts: int, last_error: Exception, deadline_reached: bool = False):
+        self.attempts = attempts
+        self.last_error = last_error
+        self.deadline_reached = deadline_reached
+        reason = "the request deadline was reached" if deadline_reached else "no attempts were left"
+        super().__init__(
+            f"Replicate service error after {attempts} attempt(s) ({reason}). This may be due to: "
+            "1) Temporary Replicate service issues, 2) Image format/size incompatibility, or 3) Network issues. "
+            f"Please try again with a different image or wait a moment. Original error: {str(last_error)}"
+        )
+
+
+def is_retryable(error: Exception) -> bool:
+    """Whether an error from a prediction attempt is transient (worth retrying)."""
+    # Imported here so this module doesn't load replicate at startup; predictions already have
+    from replicate.exceptions import ModelError, ReplicateError
+
+    if isinstance(error, ReplicateError):
+        # No status means the API answered with something unparseable
+        return error.status is None or error.status in (408, 409, 429) or error.status >= 500
+    if isinstance(error, ModelError):
+        prediction_error = str(error.prediction.error or "")
+        return any(code in prediction_error for code in TRANSIENT_PREDICTION_ERRORS)
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code in (408, 429) or error.response.status_code >= 500
+    # Timeouts, refused/reset connections and broken streams (also while downloading the output)
+    return isinstance(error, (httpx.TimeoutException, httpx.NetworkError, httpx.RemoteProtocolError))
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter, bounded by an attempt count and a deadline.
+
+    The n-th retry waits a random time between 0 and min(max_delay, base_delay * 2**n),
+    which spreads out clients that failed at the same moment.
+    """
+
+    def __init__(self, max_attempts: int, base_delay: float, max_delay: float, deadline: float):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+
+    def backoff(self, retry: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** retry)))
+
+
+class CircuitBreaker:
+    """
+    Fails fast while the upstream is unhealthy.
+
+    After failure_threshold consecutive upstream failures the circuit opens and calls
+    are rejected with CircuitOpenError for reset_timeout seconds. Then it lets up to
+    half_open_probes calls through: one success closes it, a failure opens it again.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float, half_open_probes: int = 1):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_probes = half_open_probes
+        self.state = CIRCUIT_CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.rejected = 0
+        self._probes = 0
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may be made now."""
+        with self._lock:
+            if self.state == CIRCUIT_OPEN:
+                remaining = self.opened_at + self.reset_timeout - time.monotonic()
+                if remaining > 0:
+                    self.rejected += 1
+                    raise CircuitOpenError(remaining)
+                self.state = CIRCUIT_HALF_OPEN
+                self._probes = 0
+            if self.state == CIRCUIT_HALF_OPEN:
+                if self._probes >= self.half_open_probes:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.reset_timeout)
+                self._probes += 1
+
+    def record_success(self):
+        with self._lock:
+            if self.state != CIRCUIT_CLOSED:
+                logger.info("Replicate circuit closed: upstream recovered")
+            self.state = CIRCUIT_CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == CIRCUIT_HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != CIRCUIT_OPEN:
+                    logger.warning("Replicate circuit opened after %d consecutive failure(s)", self.failures)
+                self.state = CIRCUIT_OPEN
+                self.opened_at = time.monotonic()
+
+    def release_probe(self):
+        """Give back a half-open probe slot whose call ended without an upstream verdict."""
+        with self._lock:
+            if self.state == CIRCUIT_HALF_OPEN and self._probes > 0:
+                self._probes -= 1
+
+    async def call(self, attempt: Callable[[], Awaitable[T]], classify: Callable[[Exception], bool]) -> T:
+        """
+        Run one attempt through the breaker. Transient failures (per classify) count
+        against it; permanent ones (bad input) and cancellation don't.
+        """
+        self.before_call()
+        try:
+            result = await attempt()
+        except Exception as e:
+            if classify(e):
+                self.record_failure()
+            else:
+                self.release_probe()
+            raise
+        except BaseException:
+            # Cancelled: no verdict on the upstream's health
+            self.release_probe()
+            raise
+        self.record_success()
+        return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"state": self.state, "consecutive_failures": self.failures, "rejected": self.rejected}
+
+
+async def call_with_retry(
+    attempt: Callable[[float], Awaitable[T]],
+    policy: RetryPolicy,
+    breaker: Optional[CircuitBreaker] = None,
+    classify: Callable[[Exception], bool] = is_retryable,
+    on_retry: Optional[Callable[[Exception], None]] = None
+) -> T:
+    """
+    Run attempt(deadline) until it succeeds, fails permanently or the budget runs out.
+
+    deadline is the time.monotonic() by which the whole call must be over: an attempt
+    must give up (with a retryable timeout error) when it passes, so it bounds waits
+    and predictions already running, not just the retries. Backoff is an
+    asyncio.sleep, so waiting never holds the event loop or a worker. A retry is only
+    started if its backoff ends before the deadline. Each attempt
+    goes through `breaker` if given (see CircuitBreaker.call); attempts that pick
+    their upstream themselves can use a breaker per upstream instead.
+    on_retry is called with the error before each retry.
+    """
+    deadline = time.monotonic() + policy.deadline
+    attempts = 0
+    while True:
+        attempts += 1
+        try:
+            result = await (breaker.call(lambda: attempt(deadline), classify) if breaker else attempt(deadline))
+        except Exception as e:
+            if not classify(e):
+                raise
+            if attempts >= policy.max_attempts:
+                raise RetriesExhaustedError(attempts, e)
+            delay = policy.backoff(attempts - 1)
+            if time.monotonic() + delay >= deadline:
+                # Also where an attempt cut short by the deadline ends up
+                raise RetriesExhaustedError(attempts, e, deadline_reached=True)
+            if on_retry:
+                on_retry(e)
+            logger.warning(
+                "Replicate attempt %d/%d failed (%s). Retrying in %.1fs",
+                attempts, policy.max_attempts, type(e).__name__, delay
+            )
+            await asyncio.sleep(delay)
+        else:
+            return result
@@ -0,0 +1,87 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from typing import Callable, Optional
+
+
+def make_cache_key(image_hash: str, overlay_hash: str, prompt: str, model: str, options: str = "") -> str:
+    """
+    Content address of a generation: the same input image, overlay, prompt, model and
+    processing options always produce the same key, no matter which URL the image was
+    fetched from.
+    """
+    digest = hashlib.sha256()
+    for part in (image_hash, overlay_hash, hashlib.sha256(prompt.encode()).hexdigest(), model, options):
+        digest.update(part.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Maps cache keys to generated files in the output storage.
+
+    The index is a SQLite table so it survives restarts. Entries expire after
+    ttl_seconds and the least recently used ones are evicted once the index holds
+    more than max_entries. Entries whose file no longer exists (checked with
+    the exists callable, e.g. OutputStorage.exists) count as misses.
+    """
+
+    def __init__(self, path: str, exists: Callable[[str], bool], max_entries: int, ttl_seconds: int):
+        self.exists = exists
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " key TEXT PRIMARY KEY, output_filename TEXT NOT NULL,"
+            " created_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS results_last_access ON results (last_access)")
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached output filename for key, or None on a miss."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT output_filename, created_at FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            if row and now - row[1] <= self.ttl_seconds and self.exists(row[0]):
+                self._conn.execute("UPDATE results SET last_access = ? WHERE key = ?", (now, key))
+                self.hits += 1
+                return row[0]
+            if row:
+                self._conn.execute("DELETE FROM results WHERE key = ?", (key,))
+            self.misses += 1
+            return None
+
+    def put(self, key: str, output_filename: str):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (key, output_filename, created_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, output_filename, now, now)
+            )
+            self._evict(now)
+
+    def _evict(self, now: float):
+        self._conn.execute("DELETE FROM results WHERE created_at < ?", (now - self.ttl_seconds,))
+        self._conn.execute(
+            "DELETE FROM results WHERE key IN ("
+            " SELECT key FROM results ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        return {"entries": entries, "max_entries": self.max_entries, "hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
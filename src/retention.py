@@ -0,0 +1,164 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from output_writer import TEMP_PREFIX
+
+logger = logging.getLogger(__name__)
+
+
+class OutputRetention:
+    """
+    Keeps a local output directory within size, count and age limits.
+
+    An SQLite index tracks every generated file with its size, creation time and
+    last access. enforce() reconciles the index with the directory, deletes files
+    older than max_age_seconds, then evicts least recently used files until the
+    directory holds at most max_bytes and max_files. A limit of 0 disables it.
+
+    touch() is cheap and safe to call from any thread: accesses are buffered in
+    memory and written to the index on the next enforce() or flush() run. Several
+    processes may share one index as long as only one of them calls enforce().
+    """
+
+    def __init__(self, directory: str, index_path: str, max_bytes: int, max_files: int, max_age_seconds: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.max_age_seconds = max_age_seconds
+        self.evicted_files = 0
+        self.evicted_bytes = 0
+        # Totals as of the last run (or flush), so stats() never waits for a run in progress
+        self.files = 0
+        self.bytes = 0
+        self.last_run_at: Optional[float] = None
+        self.last_run_seconds: Optional[float] = None
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(index_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " name TEXT PRIMARY KEY, size INTEGER NOT NULL,"
+            " created_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS files_last_access ON files (last_access)")
+        # What the index held at the end of the last run, until this process runs one
+        self.files, self.bytes = self._totals()
+
+    def touch(self, name: str):
+        """Mark a file as just used (published, served or returned from the result cache)."""
+        with self._pending_lock:
+            self._pending[name] = time.time()
+
+    def flush(self):
+        """Write buffered accesses to the index without enforcing (for processes sharing it with an enforcing one)."""
+        with self._lock:
+            self._flush_touches()
+            # The enforcing process keeps the index in sync; report its totals
+            self.files, self.bytes = self._totals()
+
+    def enforce(self) -> int:
+        """Sync the index with the directory and evict files over the limits. Returns the number deleted."""
+        start = time.time()
+        with self._lock:
+            self._sync()
+            self._flush_touches()
+            deleted = 0
+            if self.max_age_seconds:
+                expired = self._conn.execute(
+                    "SELECT name, size FROM files WHERE created_at < ?", (start - self.max_age_seconds,)
+                ).fetchall()
+                deleted += self._delete(expired)
+            deleted += self._evict_lru()
+            self.files, self.bytes = self._totals()
+        self.last_run_at = start
+        self.last_run_seconds = time.time() - start
+        if deleted:
+            logger.info("Output retention removed %d file(s)", deleted, extra={"files": self.files, "bytes": self.bytes})
+        return deleted
+
+    def _sync(self):
+        # The directory is the source of truth: files written by other code paths (or
+        # before the index existed) are adopted, entries for vanished files are dropped
+        on_disk = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.name.startswith(TEMP_PREFIX) or entry.name.startswith("."):
+                    continue
+                try:
+                    if entry.is_file():
+                        stat = entry.stat()
+                        on_disk[entry.name] = (stat.st_size, stat.st_mtime)
+                except FileNotFoundError:
+                    pass
+        indexed = {name for (name,) in self._conn.execute("SELECT name FROM files")}
+        self._conn.execute("BEGIN")
+        for name in indexed - on_disk.keys():
+            self._conn.execute("DELETE FROM files WHERE name = ?", (name,))
+        for name in on_disk.keys() - indexed:
+            size, mtime = on_disk[name]
+            self._conn.execute(
+                "INSERT INTO files (name, size, created_at, last_access) VALUES (?, ?, ?, ?)",
+                (name, size, mtime, mtime)
+            )
+        self._conn.execute("COMMIT")
+
+    def _flush_touches(self):
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+        if pending:
+            self._conn.executemany(
+                "UPDATE files SET last_access = MAX(last_access, ?) WHERE name = ?",
+                [(accessed, name) for name, accessed in pending.items()]
+            )
+
+    def _totals(self):
+        return self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM files").fetchone()
+
+    def _evict_lru(self) -> int:
+        count, total = self._totals()
+        over_files = count - self.max_files if self.max_files else 0
+        over_bytes = total - self.max_bytes if self.max_bytes else 0
+        if over_files <= 0 and over_bytes <= 0:
+            return 0
+        victims = []
+        for name, size in self._conn.execute("SELECT name, size FROM files ORDER BY last_access"):
+            if over_files <= 0 and over_bytes <= 0:
+                break
+            victims.append((name, size))
+            over_files -= 1
+            over_bytes -= size
+        return self._delete(victims)
+
+    def _delete(self, files) -> int:
+        for name, size in files:
+            try:
+                os.unlink(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            self._conn.execute("DELETE FROM files WHERE name = ?", (name,))
+            self.evicted_files += 1
+            self.evicted_bytes += size
+        return len(files)
+
+    def stats(self) -> dict:
+        return {
+            "files": self.files,
+            "bytes": self.bytes,
+            "max_files": self.max_files,
+            "max_bytes": self.max_bytes,
+            "max_age_seconds": self.max_age_seconds,
+            "evicted_files": self.evicted_files,
+            "evicted_bytes": self.evicted_bytes,
+            "last_run_at": self.last_run_at,
+            "last_run_seconds": self.last_run_seconds
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
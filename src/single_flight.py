@@ -0,0 +1,55 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable, Tuple, TypeVar
+
+import httpx
+
+T = TypeVar("T")
+
+
+def normalize_url(url: str) -> str:
+    """
+    Canonical form of an image URL for deduplication: lowercase scheme and host,
+    default port and fragment dropped. Path and query are kept as-is since they
+    may be case sensitive.
+    """
+    # httpx.URL already lowercases scheme and host and omits the default port
+    return str(httpx.URL(url).copy_with(fragment=None))
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls with the same key into one execution.
+
+    The first caller for a key starts fn() as its own task; callers arriving while
+    it runs await that same task and get the same result (or exception). The task
+    is shielded, so a caller that disconnects doesn't cancel the work for the rest.
+    Must be used from a single event loop.
+    """
+
+    def __init__(self):
+        self.leaders = 0
+        self.followers = 0
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> Tuple[T, bool]:
+        """Run fn() once per key at a time. Returns (result, shared), shared=True for followers."""
+        task = self._in_flight.get(key)
+        shared = task is not None
+        if shared:
+            self.followers += 1
+        else:
+            self.leaders += 1
+            task = asyncio.ensure_future(fn())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda finished: self._finished(key, finished))
+        return await asyncio.shield(task), shared
+
+    def _finished(self, key: Hashable, task: asyncio.Future):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        # Mark the exception as retrieved in case every caller went away
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self._in_flight), "leaders": self.leaders, "followers": self.followers}
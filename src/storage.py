@@ -0,0 +1,187 @@
+import logging
+import os
+import shutil
+import tempfile
+from typing import Optional
+
+from output_writer import AtomicOutputFile, cleanup_partial_files
+
+logger = logging.getLogger(__name__)
+
+# Results are content-addressed and never rewritten, so clients and CDNs may cache them forever
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+class OutputStorage:
+    """
+    Where generated images are written and how their public URLs are built.
+
+    A writer streams one result into a local temp file (so it can be post-processed
+    in place) and publish() stores it under its content-addressed name:
+
+        with storage.writer("nano_banana_glasses", ".jpg") as out:
+            for chunk in output:
+                out.write(chunk)
+            output_filename = out.publish()
+        image_url = storage.url_for(output_filename)
+    """
+
+    def startup(self):
+        """Prepare the backend. Called once before the first write."""
+
+    def cleanup(self):
+        """Remove what a crashed run left behind. Only call while no other process writes."""
+
+    def writer(self, prefix: str, suffix: str) -> AtomicOutputFile:
+        raise NotImplementedError
+
+    def exists(self, name: str) -> bool:
+        raise NotImplementedError
+
+    def url_for(self, name: str) -> str:
+        raise NotImplementedError
+
+    def local_path(self, name: str) -> Optional[str]:
+        """Path of the result relative to the working directory, if it is stored on this machine."""
+        return None
+
+    def close(self):
+        pass
+
+
+class LocalStorage(OutputStorage):
+    """Results in a local directory, served by the API itself under public_base_url."""
+
+    def __init__(self, directory: str, public_base_url: str):
+        self.directory = directory
+        self.public_base_url = public_base_url.rstrip("/")
+
+    def startup(self):
+        os.makedirs(self.directory, exist_ok=True)
+
+    def cleanup(self):
+        removed = cleanup_partial_files(self.directory)
+        if removed:
+            logger.info("Removed %d partial output file(s) left by a previous run", removed)
+
+    def writer(self, prefix: str, suffix: str) -> AtomicOutputFile:
+        return AtomicOutputFile(self.directory, prefix, suffix)
+
+    def exists(self, name: str) -> bool:
+        return os.path.exists(os.path.join(self.directory, name))
+
+    def url_for(self, name: str) -> str:
+        return f"{self.public_base_url}/{name}"
+
+    def local_path(self, name: str) -> Optional[str]:
+        return os.path.join(self.directory, name)
+
+
+class S3OutputFile(AtomicOutputFile):
+    """An AtomicOutputFile whose publish() uploads the finished file to a bucket."""
+
+    def __init__(self, storage: "S3Storage", prefix: str, suffix: str):
+        self._storage = storage
+        self._staging_dir = tempfile.mkdtemp(prefix="glasses-output-")
+        super().__init__(self._staging_dir, prefix, suffix)
+
+    def publish(self) -> str:
+        filename = super().publish()
+        path = os.path.join(self._staging_dir, filename)
+        # The name is a content hash: an existing object already has these exact bytes
+        if not self._storage.exists(filename):
+            self._storage.client.upload_file(
+                path,
+                self._storage.bucket,
+                self._storage.key_for(filename),
+                ExtraArgs={"ContentType": self._storage.content_type(filename), "CacheControl": IMMUTABLE_CACHE_CONTROL}
+            )
+        return filename
+
+    def __exit__(self, exc_type, exc, tb):
+        super().__exit__(exc_type, exc, tb)
+        shutil.rmtree(self._staging_dir, ignore_errors=True)
+        return False
+
+
+class S3Storage(OutputStorage):
+    """
+    Results in an S3-compatible bucket (AWS S3, MinIO, R2, ...), served straight from it.
+
+    With public_base_url set (a public bucket or a CDN in front of it) URLs are
+    public_base_url/<key>; otherwise every response gets a presigned GET URL valid
+    for presign_expiry seconds.
+    """
+
+    def __init__(
+        self,
+        bucket: str,
+        key_prefix: str = "",
+        endpoint_url: Optional[str] = None,
+        region: Optional[str] = None,
+        public_base_url: Optional[str] = None,
+        presign_expiry: int = 3600
+    ):
+        try:
+            import boto3
+            from botocore.config import Config
+            from botocore.exceptions import ClientError
+        except ImportError:
+            raise Exception("OUTPUT_STORAGE=s3 requires boto3. Install it with: pip install 'boto3>=1.34'")
+        if not bucket:
+            raise Exception("S3_BUCKET environment variable is required when OUTPUT_STORAGE=s3")
+
+        self.bucket = bucket
+        self.key_prefix = key_prefix.strip("/") + "/" if key_prefix.strip("/") else ""
+        self.public_base_url = public_base_url.rstrip("/") if public_base_url else None
+        self.presign_expiry = presign_expiry
+        # Credentials come from the usual AWS_ACCESS_KEY_ID / AWS_SECRET_ACCESS_KEY / profile chain.
+        # Path-style addressing works with MinIO and other self-hosted endpoints.
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url,
+            region_name=region,
+            config=Config(s3={"addressing_style": "path"} if endpoint_url else {}, retries={"mode": "standard"})
+        )
+        self._client_error = ClientError
+
+    def key_for(self, name: str) -> str:
+        return f"{self.key_prefix}{name}"
+
+    def content_type(self, name: str) -> str:
+        return {".jpg": "image/jpeg", ".png": "image/png", ".webp": "image/webp"}.get(
+            os.path.splitext(name)[1].lower(), "application/octet-stream"
+        )
+
+    def writer(self, prefix: str, suffix: str) -> AtomicOutputFile:
+        return S3OutputFile(self, prefix, suffix)
+
+    def exists(self, name: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.key_for(name))
+            return True
+        except self._client_error as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+    def url_for(self, name: str) -> str:
+        if self.public_base_url:
+            return f"{self.public_base_url}/{self.key_for(name)}"
+        return self.client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket, "Key": self.key_for(name)},
+            ExpiresIn=self.presign_expiry
+        )
+
+    def close(self):
+        self.client.close()
+
+
+def create_storage(backend: str, local_dir: str, local_base_url: str, **s3_options) -> OutputStorage:
+    """Build the configured storage backend: "local" (default) or "s3"."""
+    if backend == "local":
+        return LocalStorage(local_dir, local_base_url)
+    if backend == "s3":
+        return S3Storage(**s3_options)
+    raise Exception(f"Unknown OUTPUT_STORAGE backend '{backend}' (expected 'local' or 's3')")
@@ -0,0 +1,222 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from model_backends import ModelBackend, ModelInput
+from overlays import OverlayAsset, OverlayRegistry
+
+logger = logging.getLogger(__name__)
+
+# Used when the templates file doesn't set "default"
+DEFAULT_TEMPLATE = "classic"
+# Formats a template may ask a model for; results are stored as JPEG either way
+OUTPUT_FORMATS = ("jpg", "png")
+TEMPLATE_FIELDS = ("description", "overlay", "prompt", "model", "output_format")
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+class TemplateError(Exception):
+    """The templates file (or an overlay it names) is missing something or invalid."""
+
+
+class GlassesTemplate:
+    """
+    One way of putting glasses on a photo: the overlay, the prompt, the model (None
+    lets the router choose) and the output format asked of the model.
+
+    Everything that doesn't depend on the photo is worked out when the template is
+    loaded: each backend's input with only the two images left to fill in, and its
+    cache key part. `sha256` covers the whole definition including the overlay's
+    bytes, so it changes whenever anything that affects the result does.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        overlay: OverlayAsset,
+        backends: List[ModelBackend],
+        prompt: Optional[str] = None,
+        model: Optional[str] = None,
+        output_format: Optional[str] = None,
+        description: str = ""
+    ):
+        self.name = name
+        self.overlay = overlay
+        self.prompt = prompt
+        self.model = model
+        self.output_format = output_format
+        self.description = description
+        # The overlay as it was compiled; the asset itself may reload underneath
+        self.overlay_sha256 = overlay.sha256
+        self.inputs: Dict[str, ModelInput] = {
+            backend.name: backend.compile(prompt, output_format) for backend in backends
+        }
+        definition = {
+            "prompt": prompt,
+            "model": model,
+            "output_format": output_format,
+            "overlay": self.overlay_sha256
+        }
+        self.sha256 = hashlib.sha256(json.dumps(definition, sort_keys=True).encode()).hexdigest()
+
+    def describe(self) -> dict:
+        return {
+            "description": self.description,
+            "overlay": os.path.basename(self.overlay.path),
+            "model": self.model,
+            "output_format": self.output_format,
+            "custom_prompt": self.prompt is not None,
+            "sha256": self.sha256
+        }
+
+
+class TemplateRegistry:
+    """
+    The glasses templates by name, read from a JSON file at startup and again by
+    refresh() whenever the file or an overlay it refers to has changed.
+
+    Requests only look templates up by name: the file is parsed, validated and
+    compiled ahead of time and the new table is swapped in whole, so a request always
+    sees one consistent set. A file that fails validation at startup raises
+    TemplateError; on a later reload it is logged and the previous templates stay in
+    use. Without a file there is a single template, "classic": the built-in overlay
+    with each model's own prompt. An entry without an overlay uses the built-in one.
+    """
+
+    def __init__(self, path: str, overlays: OverlayRegistry, backends: List[ModelBackend], builtin_overlay: str):
+        self.path = path
+        self.overlays = overlays
+        self.backends = backends
+        self.builtin_overlay = builtin_overlay
+        self.reloads = 0
+        self.error: Optional[str] = None
+        # (templates by name, default name)
+        self._table: Tuple[Dict[str, GlassesTemplate], str] = ({}, DEFAULT_TEMPLATE)
+        self._signature = None
+        self._failed_signature = None
+        self._lock = threading.Lock()
+        self.load()
+
+    def get(self, name: Optional[str] = None) -> GlassesTemplate:
+        """The template called name (the default one for None); raises KeyError for unknown names."""
+        templates, default = self._table
+        return templates[name or default]
+
+    def all(self) -> Dict[str, GlassesTemplate]:
+        return self._table[0]
+
+    @property
+    def default(self) -> str:
+        return self._table[1]
+
+    def _file_signature(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+    def _read(self) -> dict:
+        """The file's definitions, or just the built-in template when there is no file."""
+        if not os.path.exists(self.path):
+            return {"default": DEFAULT_TEMPLATE, "templates": {DEFAULT_TEMPLATE: {"overlay": self.builtin_overlay}}}
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                spec = json.load(f)
+        except (OSError, ValueError) as e:
+            raise TemplateError(f"Cannot read templates file {self.path}: {e}")
+        if not isinstance(spec, dict) or not isinstance(spec.get("templates"), dict) or not spec["templates"]:
+            raise TemplateError(f"{self.path} must be an object with a non-empty \"templates\" object")
+        return spec
+
+    def _compile(self, name: str, entry: dict) -> GlassesTemplate:
+        if not isinstance(entry, dict):
+            raise TemplateError(f"Template '{name}' must be an object")
+        unknown = set(entry) - set(TEMPLATE_FIELDS)
+        if unknown:
+            raise TemplateError(f"Template '{name}' has unknown fields {sorted(unknown)}; allowed are {list(TEMPLATE_FIELDS)}")
+        model = entry.get("model")
+        if model is not None and model not in {backend.name for backend in self.backends}:
+            raise TemplateError(f"Template '{name}' names unknown model '{model}'")
+        output_format = entry.get("output_format")
+        if output_format is not None and output_format not in OUTPUT_FORMATS:
+            raise TemplateError(f"Template '{name}' has output_format '{output_format}'; use one of {list(OUTPUT_FORMATS)}")
+        # A long prompt reads better in JSON as a list of lines
+        prompt = entry.get("prompt")
+        if isinstance(prompt, list):
+            prompt = "\n".join(prompt)
+        if prompt is not None and (not isinstance(prompt, str) or not prompt.strip()):
+            raise TemplateError(f"Template '{name}' has an empty or invalid prompt")
+        # Relative overlay paths are relative to the templates file
+        overlay_path = entry.get("overlay") or self.builtin_overlay
+        overlay_path = os.path.join(os.path.dirname(os.path.abspath(self.path)), overlay_path)
+        try:
+            overlay = self.overlays.get(overlay_path)
+        except Exception as e:
+            raise TemplateError(f"Template '{name}': {e}")
+        if not overlay.data.startswith(PNG_SIGNATURE):
+            raise TemplateError(f"Template '{name}': overlay {overlay_path} is not a PNG image")
+        return GlassesTemplate(
+            name,
+            overlay,
+            self.backends,
+            prompt=prompt,
+            model=model,
+            output_format=output_format,
+            description=entry.get("description", "")
+        )
+
+    def load(self):
+        """Read, validate and compile every template, then swap them in; raises TemplateError."""
+        with self._lock:
+            signature = self._file_signature()
+            spec = self._read()
+            templates = {name: self._compile(name, entry) for name, entry in spec["templates"].items()}
+            default = spec.get("default", DEFAULT_TEMPLATE)
+            if default not in templates:
+                raise TemplateError(f"Default template '{default}' is not defined in {self.path}")
+            # One assignment, so get() never pairs a new default with the old table
+            self._table = (templates, default)
+            self._signature = (signature, tuple(t.overlay_sha256 for t in templates.values()))
+            self.reloads += 1
+            self.error = None
+        logger.info("Templates loaded", extra={"templates": list(templates), "default": default})
+
+    def _current_signature(self) -> tuple:
+        hashes = []
+        for template in self._table[0].values():
+            try:
+                # Re-stats the overlay file and re-reads it only if it changed
+                template.overlay.load()
+                hashes.append(template.overlay.sha256)
+            except Exception:
+                hashes.append(None)
+        return self._file_signature(), tuple(hashes)
+
+    def refresh(self) -> bool:
+        """Reload if the file or an overlay changed; returns whether it did. Never raises."""
+        signature = self._current_signature()
+        if signature in (self._signature, self._failed_signature):
+            return False
+        try:
+            self.load()
+            return True
+        except Exception as e:
+            # Reported once per broken version, not on every poll
+            self._failed_signature = signature
+            self.error = str(e)
+            logger.error("Templates not reloaded, keeping the previous ones: %s", e)
+            return False
+
+    def stats(self) -> dict:
+        templates, default = self._table
+        return {
+            "path": self.path,
+            "templates": len(templates),
+            "default": default,
+            "reloads": self.reloads,
+            "error": self.error
+        }
@@ -0,0 +1,126 @@
+import hashlib
+import tempfile
+from typing import AsyncIterator, Dict
+
+from python_multipart.exceptions import MultipartParseError
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+# Uploads up to this size stay in memory; larger ones roll over to a temp file
+SPOOL_MEMORY_BYTES = 1024 * 1024
+# Non-file multipart fields (e.g. "model") are short
+MAX_FIELD_BYTES = 4096
+
+
+class UploadError(Exception):
+    """The request body doesn't carry an acceptable image upload."""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class SpooledUpload:
+    """
+    Request body bytes spooled to memory (then disk) as they arrive, hashed on the
+    way in and cut off with a 413 as soon as they pass max_bytes.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.file = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_BYTES)
+        self._digest = hashlib.sha256()
+
+    def write(self, chunk: bytes):
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise UploadError(f"Image is too large (more than {self.max_bytes} bytes).", 413)
+        self._digest.update(chunk)
+        self.file.write(chunk)
+
+    @property
+    def sha256(self) -> str:
+        return self._digest.hexdigest()
+
+    def read(self) -> bytes:
+        self.file.seek(0)
+        return self.file.read()
+
+    def close(self):
+        self.file.close()
+
+
+async def receive_body(stream: AsyncIterator[bytes], upload: SpooledUpload):
+    """Spool a raw image body."""
+    async for chunk in stream:
+        upload.write(chunk)
+
+
+async def receive_multipart(stream: AsyncIterator[bytes], content_type: str, upload: SpooledUpload, file_field: str = "image") -> Dict[str, str]:
+    """
+    Stream a multipart/form-data body: the `file_field` part goes into upload, the
+    other (short) fields are returned by name. Nothing but the upload is buffered.
+    """
+    _, options = parse_options_header(content_type)
+    boundary = options.get(b"boundary")
+    if not boundary:
+        raise UploadError("multipart/form-data body without a boundary.")
+
+    fields: Dict[str, str] = {}
+    part = {}
+    header = {"field": b"", "value": b""}
+
+    def on_part_begin():
+        part.clear()
+        part.update(headers={}, name=None, data=b"")
+
+    def on_header_field(data: bytes, start: int, end: int):
+        header["field"] += data[start:end]
+
+    def on_header_value(data: bytes, start: int, end: int):
+        header["value"] += data[start:end]
+
+    def on_header_end():
+        part["headers"][header["field"].decode("latin-1").lower()] = header["value"]
+        header["field"] = header["value"] = b""
+
+    def on_headers_finished():
+        _, disposition = parse_options_header(part["headers"].get("content-disposition", b""))
+        part["name"] = disposition.get(b"name", b"").decode("utf-8", "replace")
+        if part["name"] == file_field:
+            if upload.size:
+                raise UploadError(f"Only one '{file_field}' part may be uploaded.")
+            part["file"] = True
+        elif b"filename" in disposition:
+            raise UploadError(f"Unexpected file part '{part['name']}'; upload the image as '{file_field}'.")
+
+    def on_part_data(data: bytes, start: int, end: int):
+        if part.get("file"):
+            upload.write(data[start:end])
+            return
+        part["data"] += data[start:end]
+        if len(part["data"]) > MAX_FIELD_BYTES:
+            raise UploadError(f"Form field '{part['name']}' is too long.")
+
+    def on_part_end():
+        if not part.get("file") and part["name"]:
+            fields[part["name"]] = part["data"].decode("utf-8", "replace")
+
+    parser = MultipartParser(boundary, {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+    try:
+        async for chunk in stream:
+            parser.write(chunk)
+        parser.finalize()
+    except MultipartParseError as e:
+        raise UploadError(f"Malformed multipart/form-data body: {e}")
+    if not upload.size:
+        raise UploadError(f"multipart/form-data body has no '{file_field}' file part.")
+    return fields
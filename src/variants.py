@@ -0,0 +1,170 @@
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from PIL import Image, features
+
+# Published results are named <prefix>_<first 32 hex digits of their SHA-256><suffix>
+# (see AtomicOutputFile.publish), so a name always refers to the same bytes
+CONTENT_HASH = re.compile(r"_([0-9a-f]{32})\.[A-Za-z0-9]+$")
+
+# fmt query value -> (Pillow format, file suffix, media type)
+VARIANT_FORMATS = {
+    "jpeg": ("JPEG", ".jpg", "image/jpeg"),
+    "webp": ("WEBP", ".webp", "image/webp"),
+    "avif": ("AVIF", ".avif", "image/avif"),
+    "png": ("PNG", ".png", "image/png"),
+}
+
+
+def content_hash(name: str) -> Optional[str]:
+    """The content hash embedded in a result file name, or None for other files."""
+    match = CONTENT_HASH.search(name)
+    return match.group(1) if match else None
+
+
+class VariantCache:
+    """
+    Resized and re-encoded variants of local results, generated on first request.
+
+    A variant is named after its source (which is content-addressed and never
+    changes), its width, format and quality, so it never goes stale either. Widths
+    are rounded up to a multiple of width_step and capped at max_width, which bounds
+    how many variants one image can have; images are never upscaled. Variants live in
+    cache_dir and the least recently used ones are deleted once they take more than
+    max_bytes. Each process keeps its own LRU index of the directory.
+    """
+
+    def __init__(self, source_dir: str, cache_dir: str, max_bytes: int, max_width: int, width_step: int, quality: int):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.source_dir = source_dir
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_width = max_width
+        self.width_step = width_step
+        self.quality = quality
+        self.hits = 0
+        self.generated = 0
+        self.evicted = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+        self._index: "OrderedDict[str, int]" = OrderedDict()
+        # Adopt variants from earlier runs, least recently used first
+        entries = []
+        with os.scandir(cache_dir) as scan:
+            for entry in scan:
+                if entry.is_file() and not entry.name.startswith("."):
+                    stat = entry.stat()
+                    entries.append((stat.st_atime, entry.name, stat.st_size))
+        for _, name, size in sorted(entries):
+            self._index[name] = size
+            self.bytes += size
+
+    def parse(self, width: Optional[str], fmt: Optional[str]) -> Tuple[Optional[int], str]:
+        """Validate the w and fmt query values; raises ValueError with a message for the client."""
+        fmt = (fmt or "jpeg").lower()
+        if fmt == "jpg":
+            fmt = "jpeg"
+        if fmt not in VARIANT_FORMATS:
+            raise ValueError(f"Unsupported fmt '{fmt}'; use one of {', '.join(VARIANT_FORMATS)}")
+        if fmt in ("webp", "avif") and not features.check(fmt):
+            raise ValueError(f"fmt '{fmt}' is not supported by this server's Pillow build")
+        if width is None:
+            return None, fmt
+        try:
+            value = int(width)
+        except ValueError:
+            raise ValueError(f"w must be a positive integer, not '{width}'")
+        if value <= 0:
+            raise ValueError(f"w must be a positive integer, not '{width}'")
+        # Round up so nearby widths share one variant
+        value = -(-value // self.width_step) * self.width_step
+        return min(value, self.max_width), fmt
+
+    def variant_name(self, name: str, width: Optional[int], fmt: str) -> str:
+        stem = os.path.splitext(name)[0]
+        return f"{stem}_w{width or 0}_q{self.quality}{VARIANT_FORMATS[fmt][1]}"
+
+    def etag(self, name: str, width: Optional[int], fmt: str) -> Optional[str]:
+        """Strong ETag of a variant: its source's content hash plus the variant parameters."""
+        source_hash = content_hash(name)
+        return f"{source_hash}-w{width or 0}-q{self.quality}-{fmt}" if source_hash else None
+
+    def get(self, name: str, width: Optional[int], fmt: str) -> Optional[str]:
+        """
+        Path of the variant of result `name`, generating it if needed. Returns None if
+        the result doesn't exist (anymore), even if a variant of it is still cached.
+        """
+        source = os.path.join(self.source_dir, name)
+        if not os.path.isfile(source):
+            return None
+        variant = self.variant_name(name, width, fmt)
+        path = os.path.join(self.cache_dir, variant)
+        if os.path.exists(path):
+            with self._lock:
+                self.hits += 1
+                if variant in self._index:
+                    self._index.move_to_end(variant)
+                else:
+                    # Written by another worker process
+                    self._add(variant, os.path.getsize(path))
+            return path
+        size = self._render(source, path, width, fmt)
+        with self._lock:
+            self.generated += 1
+            self._add(variant, size)
+            self._evict()
+        return path
+
+    def _render(self, source: str, path: str, width: Optional[int], fmt: str) -> int:
+        pillow_format = VARIANT_FORMATS[fmt][0]
+        with Image.open(source) as image:
+            image.load()
+            if width and width < image.width:
+                height = max(1, round(image.height * width / image.width))
+                image = image.resize((width, height), Image.LANCZOS, reducing_gap=3.0)
+            if pillow_format == "JPEG" and image.mode != "RGB":
+                image = image.convert("RGB")
+            # Written aside and renamed, so a concurrent reader never sees a partial file
+            fd, temp_path = tempfile.mkstemp(prefix=".variant-", dir=self.cache_dir)
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    if pillow_format == "PNG":
+                        image.save(f, pillow_format, optimize=True)
+                    else:
+                        image.save(f, pillow_format, quality=self.quality)
+                os.chmod(temp_path, 0o644)
+                os.replace(temp_path, path)
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.unlink(temp_path)
+                raise
+        return os.path.getsize(path)
+
+    def _add(self, variant: str, size: int):
+        self.bytes += size - self._index.pop(variant, 0)
+        self._index[variant] = size
+
+    def _evict(self):
+        while self.bytes > self.max_bytes and len(self._index) > 1:
+            victim, size = self._index.popitem(last=False)
+            try:
+                os.unlink(os.path.join(self.cache_dir, victim))
+            except FileNotFoundError:
+                pass
+            self.bytes -= size
+            self.evicted += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "variants": len(self._index),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "generated": self.generated,
+                "evicted": self.evicted
+            }
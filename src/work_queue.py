@@ -0,0 +1,138 @@
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Optional, Tuple
+
+from pydantic import BaseModel
+
+# Generation lifecycle: accepted -> submitted (the prediction exists upstream) -> succeeded | failed
+WORK_ACCEPTED = "accepted"
+WORK_SUBMITTED = "submitted"
+WORK_SUCCEEDED = "succeeded"
+WORK_FAILED = "failed"
+FINISHED_STATES = (WORK_SUCCEEDED, WORK_FAILED)
+
+
+class WorkItem(BaseModel):
+    id: str
+    status: str = WORK_ACCEPTED
+    # Key of the in-flight generation (image, template, requested model), so requests
+    # for the same work can join a resumed prediction
+    flight_key: str
+    # Result cache key the output is stored under
+    content_key: str
+    # Model (backend name) running the prediction
+    model: str
+    template: Optional[str] = None
+    prediction_id: Optional[str] = None
+    # Size to restore the output to, if the input was normalized, and the format asked of the model
+    target_size: Optional[Tuple[int, int]] = None
+    output_format: str = "jpg"
+    output_filename: Optional[str] = None
+    error: Optional[str] = None
+    created_at: float
+    updated_at: float
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATES
+
+
+class WorkQueue:
+    """
+    Durable record of every model run in a SQLite file: written when a generation is
+    accepted by a worker, again as soon as Replicate has created its prediction (with
+    the prediction id), and once more when it reaches a terminal state.
+
+    A process that dies mid-generation (a redeploy that outlasts the drain, a crash)
+    leaves its items unfinished. The next process resumes polling the predictions
+    that were submitted instead of paying for new ones; accepted items that never got
+    a prediction cost nothing and are marked failed. Each transition is a single
+    statement, so an item is never seen half-finished. Finished items are kept for
+    keep_finished seconds.
+    """
+
+    PRUNE_EVERY = 1000
+
+    def __init__(self, path: str, keep_finished: float = 86400):
+        self.keep_finished = keep_finished
+        self.resumed = 0
+        self._accepted = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS work ("
+            " id TEXT PRIMARY KEY, status TEXT NOT NULL, updated_at REAL NOT NULL, data TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS work_status ON work (status)")
+
+    def accept(self, flight_key: str, content_key: str, model: str, template: Optional[str] = None) -> WorkItem:
+        now = time.time()
+        item = WorkItem(
+            id=uuid.uuid4().hex,
+            flight_key=flight_key,
+            content_key=content_key,
+            model=model,
+            template=template,
+            created_at=now,
+            updated_at=now
+        )
+        self._save(item)
+        with self._lock:
+            self._accepted += 1
+            prune = self._accepted % self.PRUNE_EVERY == 0
+        if prune:
+            self.prune()
+        return item
+
+    def submitted(self, item: WorkItem, prediction_id: str, target_size: Optional[Tuple[int, int]], output_format: str) -> WorkItem:
+        return self._update(
+            item, status=WORK_SUBMITTED, prediction_id=prediction_id, target_size=target_size, output_format=output_format
+        )
+
+    def succeeded(self, item: WorkItem, output_filename: str) -> WorkItem:
+        return self._update(item, status=WORK_SUCCEEDED, output_filename=output_filename)
+
+    def failed(self, item: WorkItem, error: str) -> WorkItem:
+        return self._update(item, status=WORK_FAILED, error=error)
+
+    def unfinished(self) -> list:
+        """Items that were accepted or submitted when the previous process stopped, oldest first."""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT data FROM work WHERE status NOT IN ({','.join('?' * len(FINISHED_STATES))}) ORDER BY updated_at",
+                FINISHED_STATES
+            ).fetchall()
+        return [WorkItem.model_validate_json(row[0]) for row in rows]
+
+    def prune(self):
+        """Forget finished items last updated more than keep_finished seconds ago."""
+        with self._lock:
+            self._conn.execute(
+                f"DELETE FROM work WHERE status IN ({','.join('?' * len(FINISHED_STATES))}) AND updated_at < ?",
+                (*FINISHED_STATES, time.time() - self.keep_finished)
+            )
+
+    def _update(self, item: WorkItem, **fields) -> WorkItem:
+        item = item.model_copy(update={**fields, "updated_at": time.time()})
+        self._save(item)
+        return item
+
+    def _save(self, item: WorkItem):
+        # One INSERT OR REPLACE of the whole item: a state change is committed completely or not at all
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO work (id, status, updated_at, data) VALUES (?, ?, ?, ?)",
+                (item.id, item.status, item.updated_at, item.model_dump_json())
+            )
+
+    def stats(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM work GROUP BY status").fetchall()
+        return {"items": dict(rows), "resumed": self.resumed}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
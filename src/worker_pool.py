@@ -0,0 +1,68 @@
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+
+class PoolSaturatedError(Exception):
+    """Raised when the generation pool has no free worker and its queue is full."""
+
+
+class GenerationPool:
+    """
+    Bounded worker pool for the blocking generation pipeline.
+
+    At most `max_workers` generations run at once on dedicated threads, and at most
+    `queue_depth` more may wait for a worker. Anything beyond that is rejected
+    immediately with PoolSaturatedError so callers can answer with a fast 503
+    instead of letting requests pile up on the event loop.
+    """
+
+    def __init__(self, max_workers: int, queue_depth: int):
+        self.max_workers = max_workers
+        self.queue_depth = queue_depth
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="generation")
+        self._slots = asyncio.Semaphore(max_workers + queue_depth)
+        self._admitted = 0
+
+    async def run(self, fn, *args, wait: bool = False, **kwargs):
+        """
+        Run `fn(*args, **kwargs)` on a worker thread and await its result.
+
+        With wait=False (the default) a full pool raises PoolSaturatedError right away;
+        with wait=True the caller waits for a slot instead, which is what background
+        work such as jobs wants.
+        """
+        if self._slots.locked() and not wait:
+            raise PoolSaturatedError(
+                f"Generation pool is full ({self.max_workers} running, {self.queue_depth} queued)"
+            )
+        await self._slots.acquire()
+        self._admitted += 1
+
+        # Run in a copy of the caller's context, like asyncio.to_thread, so context
+        # variables such as the request id follow the work onto the worker thread
+        context = contextvars.copy_context()
+        future = asyncio.wrap_future(self._executor.submit(context.run, functools.partial(fn, *args, **kwargs)))
+        # Release the slot when the work actually finishes, not when the caller stops
+        # waiting: a disconnected client must not free a slot whose thread is still busy.
+        future.add_done_callback(self._release)
+        return await asyncio.shield(future)
+
+    def _release(self, future):
+        if not future.cancelled():
+            future.exception()  # mark as retrieved when nobody is awaiting it anymore
+        self._admitted -= 1
+        self._slots.release()
+
+    def stats(self) -> dict:
+        """Return current pool occupancy."""
+        return {
+            "max_workers": self.max_workers,
+            "queue_depth": self.queue_depth,
+            "in_flight": min(self._admitted, self.max_workers),
+            "queued": max(self._admitted - self.max_workers, 0),
+        }
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
@@ -4,5 +4,6 @@
 # Create output directory if it doesn't exist
 mkdir -p output
 
-# Start the API server
-python src/api.py
+# Start the API server; exec so SIGTERM reaches it and in-flight work is drained.
+# WORKERS (default 1) sets the number of worker processes.
+exec python src/api.py
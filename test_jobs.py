@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Test script for the asynchronous job API (POST /jobs, GET /jobs/{id}, SSE events).
+"""
+
+import requests
+import json
+import time
+
+# Configuration
+API_BASE_URL = "http://localhost:8000"  # Change this to your API URL
+TEST_IMAGE_URL = "https://pbs.twimg.com/profile_images/1785089965619118080/NATKmh45_400x400.jpg"
+
+def test_job_polling():
+    """Submit a job and poll GET /jobs/{id} until it finishes"""
+    print("🧪 Testing job submission + polling...")
+
+    try:
+        start_time = time.time()
+        response = requests.post(f"{API_BASE_URL}/jobs", json={"image_url": TEST_IMAGE_URL}, timeout=10)
+        print(f"📊 Submit status: {response.status_code} in {time.time() - start_time:.2f}s")
+        if response.status_code != 202:
+            print(f"❌ Job was not accepted: {response.text}")
+            return
+
+        job = response.json()["job"]
+        print(f"🆔 Job id: {job['id']}")
+
+        while job["status"] not in ("succeeded", "failed"):
+            time.sleep(2)
+            job = requests.get(f"{API_BASE_URL}/jobs/{job['id']}", timeout=10).json()["job"]
+            print(f"⏳ Status: {job['status']}")
+
+        print(f"⏱️  Total time: {time.time() - start_time:.2f} seconds")
+        print(json.dumps(job, indent=2))
+        if job["status"] == "succeeded":
+            print(f"✅ Result: {job['result_url']}")
+        else:
+            print(f"❌ Job failed: {job['error']}")
+
+    except requests.exceptions.ConnectionError:
+        print("🔌 Could not connect to the API. Make sure the server is running.")
+    except Exception as e:
+        print(f"❌ Unexpected error: {e}")
+
+def test_job_events():
+    """Submit a job and follow its Server-Sent Events stream"""
+    print("📡 Testing job SSE stream...")
+
+    try:
+        response = requests.post(f"{API_BASE_URL}/jobs", json={"image_url": TEST_IMAGE_URL}, timeout=10)
+        if response.status_code != 202:
+            print(f"❌ Job was not accepted: {response.text}")
+            return
+        events_url = response.json()["events_url"]
+        print(f"Events URL: {events_url}")
+
+        with requests.get(events_url, stream=True, timeout=(10, 60)) as stream:
+            for line in stream.iter_lines(decode_unicode=True):
+                if line.startswith("data: "):
+                    job = json.loads(line[len("data: "):])
+                    print(f"📨 {job['status']}: {job.get('result_url') or job.get('error') or ''}")
+
+    except requests.exceptions.ConnectionError:
+        print("🔌 Could not connect to the API. Make sure the server is running.")
+    except Exception as e:
+        print(f"❌ Unexpected error: {e}")
+
+if __name__ == "__main__":
+    print("🚀 Starting job API tests...")
+    print("=" * 60)
+    test_job_polling()
+    print("\n" + "=" * 60)
+    test_job_events()
+    print("\n🏁 Tests completed!")